@@ -0,0 +1,304 @@
+# MorphoContour benchmark
+# Seeded synthetic droplet frames with known ellipses, used to measure the throughput, peak memory
+# and accuracy of the MorphoContour entry points and to compare them between versions.
+#
+# Copyright (c) 2024 A.R. Hashemi
+#
+# This program is licensed under the European Union Public License (EUPL) v1.2 with additional terms.
+# For more information, see the LICENSE file in the repository.
+#
+# Usage:
+#   python benchmark.py --sizes 1024x1024,2048x2048 --droplets 10,100 --frames 5 --output report.json
+#
+# The report is a JSON document with one record per (entry point, image size, droplet count),
+# including the time spent in every profiled stage, so two reports can be diffed directly.
+
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import morphocontour
+
+BACKGROUND = 200
+DROPLET = 20
+SPOT = 235
+NOZZLE_WIDTH = 200
+PIXEL2UM = 70.0/160.0
+
+# Synthetic shadowgraph frame: bright background, a dark nozzle on the left, dark elliptical droplets
+# with a bright spot in their center, touching pairs, small satellites without a spot and noise.
+# Returns the grayscale frame and the ground truth droplets as a list of dicts
+# (center_x, center_y, width, height, angle, kind) in the cv2.ellipse convention.
+def make_synthetic_frame(height, width, n_droplets, seed=0, touching_fraction=0.2, satellite_fraction=0.3, noise=2.0):
+    rng = np.random.default_rng(seed)
+    frame = np.full((height, width), BACKGROUND, dtype=np.uint8)
+    nozzle_top, nozzle_bottom = int(height * 0.4), int(height * 0.6)
+    cv2.rectangle(frame, (0, nozzle_top), (NOZZLE_WIDTH - 20, nozzle_bottom), DROPLET, -1)
+
+    n_satellites = int(round(n_droplets * satellite_fraction))
+    n_pairs = int(round((n_droplets - n_satellites) * touching_fraction / 2))
+    n_single = n_droplets - n_satellites - 2 * n_pairs
+    max_radius = max(6, min(40, int(np.sqrt(height * width / max(n_droplets, 1)) / 6)))
+
+    occupied = np.zeros((height, width), dtype=bool)
+    truth = []
+
+    # Place a group of ellipses where nothing has been drawn yet, keeping a 3 pixel gap
+    def place(ellipses):
+        mask = np.zeros((height, width), dtype=np.uint8)
+        for (cx, cy), (w, h), angle in ellipses:
+            cv2.ellipse(mask, ((cx, cy), (w + 6, h + 6), angle), 1, -1)
+        if (occupied & mask.astype(bool)).any():
+            return False
+        occupied[mask.astype(bool)] = True
+        return True
+
+    def random_center(margin):
+        return (float(rng.uniform(NOZZLE_WIDTH + 40 + margin, width - 30 - margin)), float(rng.uniform(30 + margin, height - 30 - margin)))
+
+    def random_axes(low, high):
+        w = float(rng.uniform(low, high))
+        return 2 * w, 2 * w * float(rng.uniform(0.7, 1.0))
+
+    groups = [('droplet', 1)] * n_single + [('touching', 2)] * n_pairs + [('satellite', 1)] * n_satellites
+    for kind, count in groups:
+        for _ in range(100):
+            if kind == 'satellite':
+                axes = random_axes(2, 5)
+                ellipses = [(random_center(5), axes, float(rng.uniform(0, 180)))]
+            else:
+                axes = random_axes(max_radius / 2, max_radius)
+                (cx, cy), angle = random_center(2 * max_radius), float(rng.uniform(0, 180))
+                ellipses = [((cx, cy), axes, angle)]
+                if count == 2:
+                    # Second droplet overlapping the first one by a few pixels
+                    direction = float(rng.uniform(0, 2 * np.pi))
+                    other_axes = random_axes(max_radius / 2, max_radius)
+                    distance = (min(axes) + min(other_axes)) / 2 - 3
+                    ellipses.append(((cx + distance * np.cos(direction), cy + distance * np.sin(direction)), other_axes, float(rng.uniform(0, 180))))
+            if 0 < ellipses[-1][0][0] < width and 0 < ellipses[-1][0][1] < height and place(ellipses):
+                break
+        else:
+            continue
+        for (cx, cy), (w, h), angle in ellipses:
+            cv2.ellipse(frame, ((cx, cy), (w, h), angle), DROPLET, -1)
+            truth.append(dict(center_x=cx, center_y=cy, width=w, height=h, angle=angle, kind=kind))
+        if kind != 'satellite':
+            for (cx, cy), (w, h), angle in ellipses:
+                cv2.circle(frame, (int(round(cx)), int(round(cy))), max(2, int(min(w, h) / 8)), SPOT, -1)
+
+    if noise > 0:
+        frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+    return frame, truth
+
+# Synthetic jet frame for droplet_volume_estimation: axisymmetric droplets along the jet axis
+# (row 775) inside the analysed window (rows 550-1000, columns 251-1000), separated by gaps.
+# Returns the frame and the ground truth volumes in cubic micrometers, in jet order.
+def make_jet_frame(n_droplets, seed=0, noise=2.0):
+    rng = np.random.default_rng(seed)
+    frame = np.full((1100, 1100), BACKGROUND, dtype=np.uint8)
+    volumes = []
+    x = 270.0
+    for _ in range(n_droplets):
+        a = float(rng.uniform(4, 30))
+        b = float(rng.uniform(4, 30))
+        if x + 2 * a > 980:
+            break
+        cv2.ellipse(frame, ((x + a, 775.0), (2 * a, 2 * b), 0.0), DROPLET, -1)
+        volumes.append(4.0 / 3.0 * np.pi * a * b * b * PIXEL2UM ** 3)
+        x += 2 * a + float(rng.uniform(4, 12))
+    if noise > 0:
+        frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+    return frame, volumes
+
+# Greedy matching of detected centers to ground truth centers within `radius` pixels
+def match_centers(truth_centers, detected_centers, radius):
+    truth_centers = np.asarray(truth_centers, dtype=np.float64).reshape(-1, 2)
+    detected_centers = np.asarray(detected_centers, dtype=np.float64).reshape(-1, 2)
+    if len(truth_centers) == 0 or len(detected_centers) == 0:
+        return []
+    distance = np.hypot(truth_centers[:, None, 0] - detected_centers[None, :, 0], truth_centers[:, None, 1] - detected_centers[None, :, 1])
+    pairs = []
+    used_truth, used_detected = set(), set()
+    for flat in np.argsort(distance, axis=None):
+        i, j = np.unravel_index(flat, distance.shape)
+        if distance[i, j] > radius:
+            break
+        if i in used_truth or j in used_detected:
+            continue
+        used_truth.add(i)
+        used_detected.add(j)
+        pairs.append((int(i), int(j), float(distance[i, j])))
+    return pairs
+
+def _accuracy_contour_finder(truth, result):
+    contours, areas, centroids, hierarchy = result
+    if not truth:
+        return {}
+    # The droplet itself is the largest detected contour around its center (its bright spot is a second one)
+    centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+    areas = np.asarray(areas, dtype=np.float64)
+    pairs, area_errors = [], []
+    for t in truth:
+        distance = np.hypot(centroids[:, 0] - t['center_x'], centroids[:, 1] - t['center_y'])
+        candidates = np.flatnonzero(distance <= 3.0)
+        if len(candidates) == 0:
+            continue
+        j = candidates[np.argmax(areas[candidates])]
+        true_area = np.pi * t['width'] * t['height'] / 4
+        pairs.append(float(distance[j]))
+        # Touching pairs are detected as one contour, so only isolated droplets count towards the area error
+        if t['kind'] == 'droplet':
+            area_errors.append(abs(areas[j] - true_area) / true_area)
+    return dict(
+        recall=len(pairs) / len(truth),
+        detections=len(contours),
+        mean_centroid_error=float(np.mean(pairs)) if pairs else None,
+        median_relative_area_error=float(np.median(area_errors)) if area_errors else None)
+
+def _accuracy_droplet_boundary(truth, result, x_offset=220):
+    ellipses, n = result
+    droplets = [t for t in truth if t['kind'] != 'satellite' and t['center_x'] > x_offset]
+    if not droplets:
+        return {}
+    pairs = match_centers([(t['center_x'], t['center_y']) for t in droplets], [e[0] for e in ellipses], radius=3.0)
+    axis_errors = []
+    for i, j, _ in pairs:
+        true_axes = sorted((droplets[i]['width'], droplets[i]['height']))
+        fitted_axes = sorted(ellipses[j][1])
+        axis_errors.append(max(abs(f - t) / t for f, t in zip(fitted_axes, true_axes)))
+    return dict(
+        recall=len(pairs) / len(droplets),
+        precision=len(pairs) / len(ellipses) if ellipses else None,
+        mean_center_error=float(np.mean([d for _, _, d in pairs])) if pairs else None,
+        median_relative_axis_error=float(np.median(axis_errors)) if axis_errors else None)
+
+# Runs `function` over all frames and records wall time, the peak of traced (Python and NumPy)
+# memory and the per-stage breakdown of the MorphoContour profiler (stage name -> calls, seconds,
+# contours, bytes). Profiling only adds a timer call per stage.
+def _measure(function, frames):
+    previous = morphocontour.get_profiler()
+    profiler = morphocontour.enable_profiling(profiler=morphocontour.Profiler())
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        start = time.perf_counter()
+        results = [function(frame) for frame in frames]
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        morphocontour.disable_profiling()
+        if previous is not None:
+            morphocontour.enable_profiling(profiler=previous)
+    return results, seconds, peak, profiler.as_dict()
+
+# The fastest of `repeats` runs of _measure
+def _measure_best(function, frames, repeats):
+    best = None
+    for _ in range(max(repeats, 1)):
+        measured = _measure(function, frames)
+        best = measured if best is None or measured[1] < best[1] else best
+    return best
+
+def _record(entry_point, height, width, n_droplets, frames, seconds, peak, stages, n_contours, accuracy):
+    return dict(
+        entry_point=entry_point,
+        height=height,
+        width=width,
+        droplets=n_droplets,
+        frames=len(frames),
+        seconds=seconds,
+        frames_per_s=len(frames) / seconds if seconds > 0 else None,
+        contours_per_s=n_contours / seconds if seconds > 0 else None,
+        peak_traced_bytes=peak,
+        stages={name: dict(stats, seconds_per_frame=stats['seconds'] / len(frames), fraction=stats['seconds'] / seconds if seconds > 0 else None)
+                for name, stats in sorted(stages.items())},
+        accuracy=accuracy)
+
+# The binarized frames droplet_boundary passes to measure_droplet_properties, and the offset of their crop
+def _droplet_boundary_edges(frame, x_offset=220):
+    return morphocontour.process_image(morphocontour.crop_and_remove_nozzle(frame, x_offset, 0))
+
+def run_benchmark(sizes=((1024, 1024), (2048, 2048)), droplet_counts=(10, 100), n_frames=5, seed=0, repeats=1, noise=2.0):
+    records = []
+    for height, width in sizes:
+        for n_droplets in droplet_counts:
+            synthetic = [make_synthetic_frame(height, width, n_droplets, seed=seed + k, noise=noise) for k in range(n_frames)]
+            frames = [frame for frame, _ in synthetic]
+            truths = [truth for _, truth in synthetic]
+
+            finder = lambda frame: morphocontour.contour_finder(frame, crop_x_lim=(0, height), crop_y_lim=(0, width))
+            results, seconds, peak, stages = _measure_best(finder, frames, repeats)
+            accuracy = [_accuracy_contour_finder(t, r) for t, r in zip(truths, results)]
+            records.append(_record('contour_finder', height, width, n_droplets, frames, seconds, peak, stages,
+                                   sum(len(r[0]) for r in results), _mean_accuracy(accuracy)))
+
+            results, seconds, peak, stages = _measure_best(morphocontour.droplet_boundary, frames, repeats)
+            accuracy = [_accuracy_droplet_boundary(t, r) for t, r in zip(truths, results)]
+            records.append(_record('droplet_boundary', height, width, n_droplets, frames, seconds, peak, stages,
+                                   sum(r[1] for r in results), _mean_accuracy(accuracy)))
+
+            # measure_droplet_properties alone, on the binarized frames of droplet_boundary
+            edges = [_droplet_boundary_edges(frame) for frame in frames]
+            results, seconds, peak, stages = _measure_best(morphocontour.measure_droplet_properties, edges, repeats)
+            accuracy = []
+            for t, (contours, hierarchy, ellipses, n) in zip(truths, results):
+                shifted = [((cx + 220, cy), axes, angle) for (cx, cy), axes, angle in ellipses or []]
+                accuracy.append(_accuracy_droplet_boundary(t, (shifted, n)))
+            records.append(_record('measure_droplet_properties', height, width, n_droplets, edges, seconds, peak, stages,
+                                   sum(r[3] for r in results), _mean_accuracy(accuracy)))
+
+    for n_droplets in droplet_counts:
+        jets = [make_jet_frame(n_droplets, seed=seed + k, noise=noise) for k in range(n_frames)]
+        frames = [frame for frame, _ in jets]
+        results, seconds, peak, stages = _measure_best(morphocontour.droplet_volume_estimation, frames, repeats)
+        accuracy = []
+        for (_, volumes), (total_volume, num_droplets, x_diameters, y_diameters) in zip(jets, results):
+            accuracy.append(dict(
+                count_error=num_droplets - len(volumes),
+                relative_total_volume_error=(sum(total_volume) - sum(volumes)) / sum(volumes) if volumes else None))
+        records.append(_record('droplet_volume_estimation', 1100, 1100, n_droplets, frames, seconds, peak, stages,
+                               sum(r[1] for r in results), _mean_accuracy(accuracy)))
+    return records
+
+def _mean_accuracy(accuracy):
+    keys = sorted({key for record in accuracy for key in record})
+    summary = {}
+    for key in keys:
+        values = [record[key] for record in accuracy if record.get(key) is not None]
+        summary[key] = float(np.mean(values)) if values else None
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MorphoContour on synthetic droplet frames.")
+    parser.add_argument('--sizes', default='1024x1024,2048x2048', help="comma separated HEIGHTxWIDTH image sizes")
+    parser.add_argument('--droplets', default='10,100', help="comma separated droplet counts per frame")
+    parser.add_argument('--frames', type=int, default=5, help="frames per configuration")
+    parser.add_argument('--repeats', type=int, default=1, help="timing repeats, the fastest one is reported")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--noise', type=float, default=2.0, help="standard deviation of the Gaussian noise added to the frames")
+    parser.add_argument('--output', default=None, help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in size.lower().split('x')) for size in args.sizes.split(',')]
+    droplet_counts = [int(v) for v in args.droplets.split(',')]
+    report = dict(
+        environment=dict(python=platform.python_version(), numpy=np.__version__, opencv=cv2.__version__,
+                         machine=platform.machine(), processor=platform.processor()),
+        config=dict(sizes=sizes, droplets=droplet_counts, frames=args.frames, repeats=args.repeats, seed=args.seed, noise=args.noise),
+        results=run_benchmark(sizes, droplet_counts, args.frames, args.seed, args.repeats, args.noise))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -15,17 +15,225 @@
 #
 # For more information, see the LICENSE file in the repository.
 
+import os
+import glob
+import json
+import time
+import queue
+import shutil
+import socket
+import numbers
+import hashlib
+import functools
+import importlib
+import itertools
+import threading
+import warnings
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 # import operator # for sorting and comparing
-import pyefd
+# matplotlib and pyefd are imported where they are used, importing morphocontour stays fast
+
+# Opt-in per-stage instrumentation. Profiling is off by default; enable_profiling() installs a
+# Profiler that aggregates wall time, call counts, contour counts and the bytes of the arrays each
+# stage produces. While it is off, every stage costs one global lookup and returns a shared no-op.
+class StageStats:
+    __slots__ = ('calls', 'seconds', 'contours', 'bytes')
+
+    def __init__(self, calls=0, seconds=0.0, contours=0, bytes=0):
+        self.calls = calls
+        self.seconds = seconds
+        self.contours = contours
+        self.bytes = bytes
+
+    def add(self, other):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.contours += other.contours
+        self.bytes += other.bytes
+
+    def as_dict(self):
+        return dict(calls=self.calls, seconds=self.seconds, contours=self.contours, bytes=self.bytes)
+
+    def __repr__(self):
+        return f"StageStats(calls={self.calls}, seconds={self.seconds:.6f}, contours={self.contours}, bytes={self.bytes})"
+
+# Aggregated stage statistics of a run. `sink`, if given, is called as sink(stage_name, stats) with
+# the StageStats of every recorded call (and of every batch merged in), e.g. to push them to a
+# metrics system.
+class Profiler:
+    def __init__(self, sink=None):
+        self.stats = {}
+        self.sink = sink
+        self._lock = threading.Lock()
+
+    def record(self, name, stats):
+        with self._lock:
+            total = self.stats.get(name)
+            if total is None:
+                total = self.stats[name] = StageStats()
+            total.add(stats)
+        if self.sink is not None:
+            self.sink(name, stats)
+
+    # Adds the stats of another profiler, or its as_dict(), e.g. the stats returned by batch workers
+    def merge(self, other):
+        items = other.stats.items() if isinstance(other, Profiler) else ((name, StageStats(**values)) for name, values in other.items())
+        for name, stats in items:
+            self.record(name, stats)
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def as_dict(self):
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    def __getitem__(self, name):
+        return self.stats[name]
+
+    def __repr__(self):
+        lines = [f"{'stage':<40}{'calls':>8}{'seconds':>12}{'contours':>10}{'bytes':>14}"]
+        for name, stats in sorted(self.as_dict().items()):
+            lines.append(f"{name:<40}{stats['calls']:>8}{stats['seconds']:>12.4f}{stats['contours']:>10}{stats['bytes']:>14}")
+        return "\n".join(lines)
+
+_profiler = None
+
+# Starts recording into a new Profiler (or the given one) and returns it
+def enable_profiling(sink=None, profiler=None):
+    global _profiler
+    _profiler = profiler if profiler is not None else Profiler(sink)
+    return _profiler
+
+# Stops recording and returns the profiler that was active, if any
+def disable_profiling():
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+def get_profiler():
+    return _profiler
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start', 'stats')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.stats = StageStats(calls=1)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.seconds = time.perf_counter() - self.start
+        self.profiler.record(self.name, self.stats)
+        return False
+
+    # Counts the contours a stage produced and the bytes of its output arrays
+    def count(self, contours=0, *outputs):
+        self.stats.contours += contours
+        for output in outputs:
+            if isinstance(output, np.ndarray):
+                self.stats.bytes += output.nbytes
+            elif isinstance(output, (list, tuple)):
+                self.stats.bytes += sum(o.nbytes for o in output if isinstance(o, np.ndarray))
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, contours=0, *outputs):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+def _stage(name):
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_STAGE
+    return _Stage(profiler, name)
+
+# Records the total time and number of calls of an entry point as the stage `name`
+def _profiled(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def to_gray(image):
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+_REDUCED_GRAYSCALE = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+_REDUCED_COLOR = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# Loader shared by all entry points. `image` is an image path or an already decoded frame
+# (e.g. from a frame source), and the region of interest rows=(start, stop), cols=(start, stop)
+# is returned as a view of it. Files are decoded in their own color format, so gray files stay
+# single-channel, and only the region of interest of a color frame is converted to gray, with
+# cvtColor as before. With fast_decode, files are decoded straight to grayscale instead, which
+# can differ from cvtColor by a few grey levels on color files. reduce = 2, 4 or 8 opts in to
+# the reduced-resolution decode modes of OpenCV (decoded frames are resized with INTER_AREA);
+# the region of interest is still given in full-resolution pixels. The entry points take both
+# options and pass them on; with reduce, their contours, areas and ellipses are in reduced pixels.
+def load_image(image, rows=None, cols=None, grayscale=True, fast_decode=False, reduce=1):
+    if reduce not in (1, 2, 4, 8):
+        raise ValueError(f"reduce must be 1, 2, 4 or 8, got {reduce!r}")
+    if isinstance(image, np.ndarray):
+        if reduce != 1:
+            image = cv2.resize(image, (image.shape[1] // reduce, image.shape[0] // reduce), interpolation=cv2.INTER_AREA)
+    else:
+        path = image
+        if reduce != 1:
+            flags = (_REDUCED_GRAYSCALE if grayscale and fast_decode else _REDUCED_COLOR)[reduce]
+        elif grayscale:
+            flags = cv2.IMREAD_GRAYSCALE if fast_decode else cv2.IMREAD_ANYCOLOR
+        else:
+            flags = cv2.IMREAD_COLOR
+        image = cv2.imread(path, flags)
+        if image is None:
+            raise IOError(f"Could not read image {path}")
+    rows = slice(None) if rows is None else slice(*[None if v is None else v // reduce for v in rows])
+    cols = slice(None) if cols is None else slice(*[None if v is None else v // reduce for v in cols])
+    roi = image[rows, cols]
+    return to_gray(roi) if grayscale else roi
 
 def enhance_contrast(image, clipLimit=2.0, tileGridSize=(8, 8)):
     # Convert the image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=clipLimit, tileGridSize=tileGridSize)
-    return clahe.apply(gray)
+    gray = to_gray(image)
+    return _clahe(clipLimit, tileGridSize).apply(gray)
+
+# CLAHE objects keep internal buffers, so they are cached per thread and parameters
+_clahe_objects = threading.local()
+
+def _clahe(clipLimit, tileGridSize):
+    objects = getattr(_clahe_objects, 'objects', None)
+    if objects is None:
+        objects = _clahe_objects.objects = {}
+    key = (float(clipLimit), tuple(tileGridSize))
+    if key not in objects:
+        objects[key] = cv2.createCLAHE(clipLimit=clipLimit, tileGridSize=tileGridSize)
+    return objects[key]
 
 def crop_and_remove_nozzle(image, x_offset=0, y_offset=0):
     cropped = image[y_offset:, x_offset:]  # Crop the right side of the image
@@ -100,27 +308,105 @@ def measure_nozzle_diameter(edges):
             
         # cv2.imwrite('droplet_boundary.jpg', image)
 
-def contour_intersect(cnt_ref,cnt_query, edges_only = True):
-    
-    intersecting_pts = []
-    
-    ## Loop through all points in the contour
-    for pt in cnt_query:
-        x,y = pt[0]
-
-        ## find point that intersect the ref contour
-        ## edges_only flag check if the intersection to detect is only at the edges of the contour
-        
-        if edges_only and (cv2.pointPolygonTest(cnt_ref,(x,y),True) == 0):
-            intersecting_pts.append(pt[0])
-        elif not(edges_only) and (cv2.pointPolygonTest(cnt_ref,(x,y),True) >= 0):
-            intersecting_pts.append(pt[0])
-            
-    if len(intersecting_pts) > 0:
-        return True
-    else:
+# Checks whether any point of cnt_query lies on the edge of cnt_ref (edges_only) or inside or on
+# it (edges_only=False), with the same result as testing every point with cv2.pointPolygonTest.
+# Pairs whose bounding boxes do not meet are rejected at once and small query contours are
+# tested point by point. Otherwise cnt_ref is drawn into a mask of its bounding box (its outline
+# with edges_only, else filled) and dilated by one pixel, which keeps every point that can be on
+# or inside the polygon; only those are classified exactly, in chunks that grow from a few points
+# so the test stops soon after the first hit.
+# method='raster' skips the exact classification and answers from the undilated mask. It is
+# approximate: outline pixels are the rasterized edges, not the exact segments.
+def contour_intersect(cnt_ref,cnt_query, edges_only = True, method='exact'):
+    # Bounding boxes that do not meet cannot share a point
+    rx, ry, rw, rh = cv2.boundingRect(cnt_ref)
+    qx, qy, qw, qh = cv2.boundingRect(cnt_query)
+    if qx >= rx + rw or rx >= qx + qw or qy >= ry + rh or ry >= qy + qh:
         return False
-    
+    # A few points are cheapest to test one by one (only the sign is needed)
+    if method == 'exact' and len(cnt_query) <= _INTERSECT_LOOP_POINTS:
+        for x, y in np.asarray(cnt_query).reshape(-1, 2).tolist():
+            location = cv2.pointPolygonTest(cnt_ref, (x, y), False)
+            if location == 0 if edges_only else location >= 0:
+                return True
+        return False
+    points = _intersect_candidates(cnt_ref, np.asarray(cnt_query).reshape(-1, 2), edges_only, method)
+    if method == 'raster':
+        return len(points) > 0
+    start, step = 0, 8
+    while start < len(points):
+        location = _points_in_polygon(cnt_ref, points[start:start + step])
+        if (location == 0).any() if edges_only else (location >= 0).any():
+            return True
+        start, step = start + step, min(4 * step, _intersect_chunk(cnt_ref))
+    return False
+
+# Query contours up to this many points are tested point by point with cv2.pointPolygonTest
+_INTERSECT_LOOP_POINTS = 16
+_INTERSECT_KERNEL = np.ones((3, 3), dtype=np.uint8)
+
+# The points of cnt_query found by contour_intersect, as an (K, 2) array in contour order
+def contour_intersection_points(cnt_ref, cnt_query, edges_only=True, method='exact'):
+    points = _intersect_candidates(cnt_ref, np.asarray(cnt_query).reshape(-1, 2), edges_only, method)
+    if method == 'raster' or len(points) == 0:
+        return points
+    location = _points_in_polygon(cnt_ref, points)
+    return points[location == 0 if edges_only else location >= 0]
+
+# Query points that hit the mask of cnt_ref (see contour_intersect), in contour order. For the
+# exact method the mask is dilated by a pixel, so it keeps every point on or inside cnt_ref.
+def _intersect_candidates(cnt_ref, points, edges_only, method):
+    pad = 1 if method == 'exact' else 0
+    x, y, w, h = cv2.boundingRect(cnt_ref)
+    x, y, w, h = x - pad, y - pad, w + 2*pad, h + 2*pad
+    points = points[(points[:, 0] >= x) & (points[:, 0] < x + w) & (points[:, 1] >= y) & (points[:, 1] < y + h)]
+    if len(points) == 0:
+        return points
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.drawContours(mask, [cnt_ref], -1, 1, 1 if edges_only else -1, offset=(-x, -y))
+    if pad:
+        mask = cv2.dilate(mask, _INTERSECT_KERNEL)
+    return points[mask[points[:, 1] - y, points[:, 0] - x].astype(bool)]
+
+# Number of pixels covered by both filled contours, from the AND of their masks drawn in the
+# intersection of their bounding boxes
+def contour_overlap_area(cnt_a, cnt_b):
+    ax, ay, aw, ah = cv2.boundingRect(cnt_a)
+    bx, by, bw, bh = cv2.boundingRect(cnt_b)
+    x0, y0 = max(ax, bx), max(ay, by)
+    x1, y1 = min(ax + aw, bx + bw), min(ay + ah, by + bh)
+    if x0 >= x1 or y0 >= y1:
+        return 0
+    mask_a = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    mask_b = np.zeros_like(mask_a)
+    cv2.drawContours(mask_a, [cnt_a], -1, 1, -1, offset=(-x0, -y0))
+    cv2.drawContours(mask_b, [cnt_b], -1, 1, -1, offset=(-x0, -y0))
+    return int(cv2.countNonZero(cv2.bitwise_and(mask_a, mask_b)))
+
+# Points per chunk, so a chunk compares about a million point-edge pairs
+def _intersect_chunk(polygon):
+    return max(1, (1 << 20) // max(len(polygon), 1))
+
+# cv2.pointPolygonTest(polygon, point, False) for integer points: 1 inside, 0 on an edge,
+# -1 outside. A point is on an edge when it is collinear with and between its end points,
+# otherwise it is inside when a ray to the right crosses an odd number of edges.
+def _points_in_polygon(polygon, points):
+    a = np.asarray(polygon).reshape(-1, 2).astype(np.int64)
+    b = np.roll(a, -1, axis=0)
+    ax, ay, bx, by = a[:, 0], a[:, 1], b[:, 0], b[:, 1]
+    location = np.empty(len(points), dtype=np.int8)
+    step = _intersect_chunk(a)
+    for start in range(0, len(points), step):
+        chunk = np.asarray(points[start:start + step], dtype=np.int64)
+        x, y = chunk[:, :1], chunk[:, 1:]
+        cross = (bx - ax) * (y - ay) - (by - ay) * (x - ax)
+        on_edge = ((cross == 0) & (np.minimum(ax, bx) <= x) & (x <= np.maximum(ax, bx)) &
+                   (np.minimum(ay, by) <= y) & (y <= np.maximum(ay, by))).any(axis=1)
+        # The crossing of a straddling edge lies right of the point when cross/(by - ay) > 0
+        crossings = (((ay > y) != (by > y)) & ((cross > 0) == (by > ay))).sum(axis=1)
+        location[start:start + step] = np.where(on_edge, 0, np.where(crossings % 2 == 1, 1, -1))
+    return location
+
 def get_centroid(contour):
     M = cv2.moments(contour)
     if M['m00'] != 0:
@@ -154,6 +440,106 @@ def find_darkest_point(img, c1, c2):
     
     return darkest_point
 
+# Pixels of the 8-connected lines from starts[i] to ends[i], in the order cv2.LineIterator visits
+# them: Bresenham along the major axis with the minor coordinate floor((2*dy*k + dx - 1) / (2*dx)),
+# all segments at once. Segments leaving the image are clipped with cv2.clipLine first, like
+# LineIterator does. Returns the (P, 2) x, y pixels and the offsets of every segment.
+def _line_pixels(shape, starts, ends):
+    height, width = shape[:2]
+    starts = np.array(starts, dtype=np.int64).reshape(-1, 2)
+    ends = np.array(ends, dtype=np.int64).reshape(-1, 2)
+    outside = ((starts < 0) | (starts >= (width, height)) | (ends < 0) | (ends >= (width, height))).any(axis=1)
+    empty = np.zeros(len(starts), dtype=bool)
+    for i in np.flatnonzero(outside):
+        inside, start, end = cv2.clipLine((0, 0, width, height), tuple(starts[i].tolist()), tuple(ends[i].tolist()))
+        starts[i], ends[i] = start, end
+        empty[i] = not inside
+    delta = ends - starts
+    step = np.where(delta < 0, -1, 1)
+    delta = np.abs(delta)
+    vertical = delta[:, 1] > delta[:, 0]
+    major = np.where(vertical, delta[:, 1], delta[:, 0])
+    minor = np.where(vertical, delta[:, 0], delta[:, 1])
+    counts = np.where(empty, 0, major + 1)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    # Unit steps along the major and the minor axis of every segment
+    major_step = np.where(vertical[:, None], [0, 1], [1, 0]) * step
+    minor_step = np.where(vertical[:, None], [1, 0], [0, 1]) * step
+    k = np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts)
+    # (clamped for single-pixel segments, where the formula gives -1)
+    across = np.maximum((2*np.repeat(minor, counts)*k + np.repeat(major - 1, counts)) // np.repeat(np.maximum(2*major, 1), counts), 0)
+    pixels = np.repeat(starts, counts, axis=0)
+    pixels += np.repeat(major_step, counts, axis=0) * k[:, None]
+    pixels += np.repeat(minor_step, counts, axis=0) * across[:, None]
+    return pixels, offsets
+
+# Bilinear samples of img at the float coordinates x, y (clamped to the image)
+def _bilinear(img, x, y):
+    height, width = img.shape[:2]
+    x = np.clip(x, 0, width - 1)
+    y = np.clip(y, 0, height - 1)
+    x0 = np.minimum(np.floor(x).astype(np.int64), width - 2) if width > 1 else np.zeros(len(x), dtype=np.int64)
+    y0 = np.minimum(np.floor(y).astype(np.int64), height - 2) if height > 1 else np.zeros(len(y), dtype=np.int64)
+    x1 = np.minimum(x0 + 1, width - 1)
+    y1 = np.minimum(y0 + 1, height - 1)
+    fx = x - x0
+    fy = y - y0
+    img = img.astype(np.float64, copy=False)
+    top = img[y0, x0] * (1 - fx) + img[y0, x1] * fx
+    bottom = img[y1, x0] * (1 - fx) + img[y1, x1] * fx
+    return top * (1 - fy) + bottom * fy
+
+# find_darkest_point for many segments at once: starts and ends are (N, 2) arrays of x, y points
+# (e.g. pairs of neighboring centroids from contour_finder). Returns
+#   points      - (N, 2) darkest point of every segment, (-1, -1) where none is darker than 255
+#   intensities - (N,) intensity at that point
+#   profiles    - all intensity profiles packed in one array, segment i is
+#   offsets       profiles[offsets[i]:offsets[i+1]]
+# By default the pixels of the 8-connected line are visited like cv2.LineIterator and the first
+# darkest one is kept, as in find_darkest_point. With subpixel=True the segment is sampled every
+# 1/samples_per_pixel pixels with bilinear interpolation and the points are floats.
+# With contours (one per segment), every contour is also split at the pixel nearest to its
+# darkest point with split_contour_at_point and the list of (part1, part2) is returned as well.
+def find_darkest_points(img, starts, ends, subpixel=False, samples_per_pixel=2, contours=None):
+    img = to_gray(img)
+    if not subpixel:
+        pixels, offsets = _line_pixels(img.shape, starts, ends)
+        profiles = img[pixels[:, 1], pixels[:, 0]]
+        coordinates = pixels
+    else:
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        length = np.hypot(*(ends - starts).T)
+        counts = np.ceil(length * samples_per_pixel).astype(np.int64) + 1
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        segment = np.repeat(np.arange(len(counts)), counts)
+        t = (np.arange(offsets[-1]) - offsets[:-1][segment]) / np.maximum(counts[segment] - 1, 1)
+        coordinates = starts[segment] + (ends - starts)[segment] * t[:, None]
+        profiles = _bilinear(img, coordinates[:, 0], coordinates[:, 1])
+
+    n = len(offsets) - 1
+    counts = np.diff(offsets)
+    found = counts > 0
+    points = np.full((n, 2), -1, dtype=coordinates.dtype)
+    intensities = np.full(n, 255, dtype=profiles.dtype)
+    if found.any():
+        # First minimum of every profile
+        heads = offsets[:-1][found]
+        minimum = np.minimum.reduceat(profiles, heads)
+        position = np.where(profiles == np.repeat(minimum, counts[found]), np.arange(len(profiles)), len(profiles))
+        first = np.minimum.reduceat(position, heads)
+        # Like find_darkest_point, a point has to be darker than 255
+        darker = profiles[first] < 255
+        rows = np.flatnonzero(found)[darker]
+        points[rows] = coordinates[first[darker]]
+        intensities[rows] = profiles[first[darker]]
+    if contours is None:
+        return points, intensities, profiles, offsets
+    splits = [split_contour_at_point(contour, point) if point[0] >= 0 else (contour, contour[:0]) for contour, point in zip(contours, points)]
+    return points, intensities, profiles, offsets, splits
+
 # Function for splitting a contour at a given point
 def split_contour_at_point(contour, split_point):
     # Find the index of the contour point closest to the split_point
@@ -168,67 +554,35 @@ def split_contour_at_point(contour, split_point):
     return contour_part1, contour_part2
 
 
-# Function to check the gradient change
+# Function to check the gradient change: True when any boundary pixel of the contour is darker
+# than the pixel at its centroid (or at its first point when it has no area)
 def check_gradient(image, contour):
-    # Find the centroid or a point inside the contour
-    M = cv2.moments(contour)
-    if M['m00'] != 0:
-        cx = int(M['m10'] / M['m00'])
-        cy = int(M['m01'] / M['m00'])
-    else:
-        # Handle the case where the contour is a line or a point
-        # by taking the first point of the contour
-        cx, cy = contour[0][0]
-
-    # Define the step size for moving towards the boundary
-    step_size = 1
-
-    # Move towards the boundary of the contour
-    for i in range(0, len(contour), step_size):
-        point = contour[i][0]
-        x, y = point
-
-        # Check the color intensity at the current point
-        intensity_centroid = image[cy][cx]
-        intensity_boundary = image[y][x]
-
-        # Check for gradient change from white to dark
-        if intensity_boundary < intensity_centroid:
-            # Gradient change detected, accept the contour
-            return True
-
-    # No gradient change detected, reject the contour
-    return False
+    cx, cy = get_centroid(contour)
+    points = np.asarray(contour).reshape(-1, 2)
+    return bool((image[points[:, 1], points[:, 0]] < image[cy, cx]).any())
+
+# check_gradient for all contours of a ContourTable (or a list of contours) at once: one gather of
+# all boundary pixels from the packed point buffer, compared with the centroid pixels of their
+# contours and reduced per contour. Returns a boolean mask with one entry per contour.
+# `offset` is the (x, y) position of the image in the coordinates of the contours.
+def check_gradient_batch(image, contours, offset=(0, 0)):
+    table = contours if isinstance(contours, ContourTable) else ContourTable.from_contours(contours)
+    if len(table) == 0:
+        return np.zeros(0, dtype=bool)
+    points = table.points.reshape(-1, 2) - offset
+    centroid = table.centroid - offset
+    centroid_intensity = image[centroid[:, 1], centroid[:, 0]]
+    darker = image[points[:, 1], points[:, 0]] < np.repeat(centroid_intensity, table.lengths)
+    return np.logical_or.reduceat(darker, table.offsets[:-1])
 
 def apply_fourier_transform(gray_image):
     # Load the image in grayscale
     # image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
 
-    # Apply 2D Discrete Fourier Transform (DFT)
-    dft = cv2.dft(np.float32(gray_image), flags=cv2.DFT_COMPLEX_OUTPUT)
-    dft_shift = np.fft.fftshift(dft)
-
-    # Create a mask with high-pass filter (1s in the corners, 0s in the center)
-    rows, cols = gray_image.shape
-    crow, ccol = rows // 2, cols // 2
-    mask = np.ones((rows, cols, 2), np.uint8)
-    r = 10  # Radius of the low frequencies to block
-    center = [crow, ccol]
-    x, y = np.ogrid[:rows, :cols]
-    mask_area = (x - center[0]) ** 2 + (y - center[1]) ** 2 <= r*r
-    mask[mask_area] = 0
-
-    # Apply the mask to the shifted DFT
-    fshift = dft_shift * mask
-
-    # Inverse DFT to get the image back
-    f_ishift = np.fft.ifftshift(fshift)
-    img_back = cv2.idft(f_ishift)
-    img_back = cv2.magnitude(img_back[:, :, 0], img_back[:, :, 1])
-
-    # Normalize the image for display
-    cv2.normalize(img_back, img_back, 0, 255, cv2.NORM_MINMAX)
-    img_back = np.uint8(img_back)
+    # High-pass filter (block the frequencies within a radius of 10), built once per image shape
+    fourier_filter = _fourier_filter(gray_image.shape)
+    with fourier_filter.lock:
+        img_back = fourier_filter.apply(gray_image)
 
     # Display the original and processed images
     # cv2.imshow('Original Image', image)
@@ -239,27 +593,126 @@ def apply_fourier_transform(gray_image):
 
     return img_back
 
+# Filters of apply_fourier_transform for the most recently used shapes. Each one holds a mask and
+# three float32 buffers of the frame size, so only a few are kept.
+_FOURIER_FILTER_SHAPES = 8
+
+@functools.lru_cache(maxsize=_FOURIER_FILTER_SHAPES)
+def _fourier_filter(shape):
+    return FourierHighPass(shape, radius=10)
+
+# FFT high-pass filter for frames of one shape: blocks the spatial frequencies within `radius`
+# of zero (in cycles per frame, the circular mask of apply_fourier_transform) and returns the
+# magnitude of the filtered image scaled to 0-255 as uint8.
+# Everything shape dependent is built once. The transform is the real-input cv2.dft, whose
+# packed CCS spectrum has the size of the frame, and the mask is precomputed in that unshifted
+# packed layout, so no fftshift copies and no complex (rows, cols, 2) arrays are needed. By
+# default the output is that of apply_fourier_transform (to within one grey level). optimal_size
+# opts in to padding the frames (reflected) to cv2.getOptimalDFTSize sizes, which is faster for
+# awkward sizes, with the mask an ellipse in the padded frequency grid so the cut-off frequency
+# stays the same. The padding changes the output, by up to tens of grey levels on small frames.
+# apply() takes one frame (H, W) or a stack (T, H, W); the work buffers are reused across calls,
+# so an instance must not be used from several threads at once.
+class FourierHighPass:
+    def __init__(self, shape, radius=10, optimal_size=False):
+        self.shape = tuple(shape[-2:])
+        self.radius = radius
+        rows, cols = self.shape
+        self.fft_shape = (cv2.getOptimalDFTSize(rows), cv2.getOptimalDFTSize(cols)) if optimal_size else self.shape
+        fft_rows, fft_cols = self.fft_shape
+        # Frequency of every element of the CCS layout: along a packed axis (the rows of a real
+        # frame, and the columns 0 and, for an even width, the last one) element k holds
+        # frequency (k + 1) // 2, along the other columns row u holds the signed frequency u
+        packed = lambda n: (np.arange(n) + 1) // 2
+        fv = packed(fft_cols) * (cols / fft_cols)
+        fu = ((np.arange(fft_rows) + fft_rows // 2) % fft_rows - fft_rows // 2) * (rows / fft_rows)
+        fu = np.repeat(fu[:, None], fft_cols, axis=1)
+        packed_columns = [0, fft_cols - 1] if fft_cols % 2 == 0 else [0]
+        fu[:, packed_columns] = (packed(fft_rows) * (rows / fft_rows))[:, None]
+        self.mask = (fu ** 2 + fv[None, :] ** 2 > radius * radius).astype(np.float32)
+        self.lock = threading.Lock()
+        self._padded = np.empty(self.fft_shape, dtype=np.float32)
+        self._spectrum = np.empty(self.fft_shape, dtype=np.float32)
+        self._filtered = np.empty(self.fft_shape, dtype=np.float32)
+
+    def apply(self, frames, out=None):
+        frames = np.asarray(frames)
+        single = frames.ndim == 2
+        if single:
+            frames = frames[np.newaxis]
+        if frames.shape[1:] != self.shape:
+            raise ValueError(f"Frames of shape {frames.shape[1:]} given to a filter built for {self.shape}")
+        if out is None:
+            out = np.empty(frames.shape, dtype=np.uint8)
+        for frame, frame_out in zip(frames, out):
+            self._apply_frame(frame, frame_out)
+        return out[0] if single else out
+
+    def _apply_frame(self, frame, out):
+        rows, cols = self.shape
+        fft_rows, fft_cols = self.fft_shape
+        if self.fft_shape == self.shape:
+            np.copyto(self._padded, frame, casting='unsafe')
+        else:
+            np.copyto(self._padded, cv2.copyMakeBorder(frame, 0, fft_rows - rows, 0, fft_cols - cols, cv2.BORDER_REFLECT_101), casting='unsafe')
+        cv2.dft(self._padded, dst=self._spectrum)
+        cv2.multiply(self._spectrum, self.mask, dst=self._spectrum)
+        cv2.idft(self._spectrum, dst=self._filtered, flags=cv2.DFT_REAL_OUTPUT)
+        # The filtered image is real, its magnitude is the absolute value
+        magnitude = np.abs(self._filtered[:rows, :cols])
+        # Normalize the image for display
+        cv2.normalize(magnitude, magnitude, 0, 255, cv2.NORM_MINMAX)
+        np.copyto(out, magnitude, casting='unsafe')
+
+# Scratch buffers of split_contour, one set per thread, grown on demand and reused across calls
+_split_scratch = threading.local()
+
+def _scratch_image(name, shape, dtype):
+    size = shape[0] * shape[1]
+    buffer = getattr(_split_scratch, name, None)
+    if buffer is None or buffer.size < size:
+        buffer = np.empty(size, dtype=dtype)
+        setattr(_split_scratch, name, buffer)
+    return buffer[:size].reshape(shape)
+
+_SPLIT_KERNEL = np.ones((9, 9), dtype=np.uint8) # Adjust the kernel size according to your image
+# Margin around the bounding box of a contour that split_contour works in. It keeps a ring of
+# background around the filled contour wider than the 4 pixel reach of the 9x9 dilation, so the
+# result is the same as when working on the full frame.
+_SPLIT_PAD = 6
+
 # A new function that uses Distance Transform
 def split_contour(img_gray, contour, image_path="", index=0):
+    return _split_contour(img_gray.shape[:2], contour)
+
+# split_contour for a frame of the given (height, width), only its shape is needed
+def _split_contour(frame_shape, contour):
+    # Work in the padded bounding box of the contour, clipped to the frame
+    height, width = frame_shape
+    x, y, w, h = cv2.boundingRect(contour)
+    x0, y0 = max(x - _SPLIT_PAD, 0), max(y - _SPLIT_PAD, 0)
+    x1, y1 = min(x + w + _SPLIT_PAD, width), min(y + h + _SPLIT_PAD, height)
+    shape = (y1 - y0, x1 - x0)
+
     # Create a binary image from the contour
-    # img = np.zeros((480, 640), dtype=np.uint8) # Adjust the size according to your image
-    img = np.zeros_like(img_gray)
-    cv2.drawContours(img, [contour], -1, 255, -1)
+    img = _scratch_image('mask', shape, np.uint8)
+    img.fill(0)
+    cv2.drawContours(img, [contour], -1, 255, -1, offset=(-x0, -y0))
     
     # Apply Distance Transform to the image
-    dist = cv2.distanceTransform(img, cv2.DIST_L2, 3)
+    dist = cv2.distanceTransform(img, cv2.DIST_L2, 3, dst=_scratch_image('dist', shape, np.float32))
     cv2.normalize(dist, dist, 0, 255.0, cv2.NORM_MINMAX)
-    dist = dist.astype(np.uint8)
-    # cv2.imwrite("process"+"/"+image_path+str(index)+'_distanceTransform.jpg', dist)
+    dist_8u = _scratch_image('dist_8u', shape, np.uint8)
+    np.copyto(dist_8u, dist, casting='unsafe')
+    # cv2.imwrite("process"+"/"+image_path+str(index)+'_distanceTransform.jpg', dist_8u)
     
     # Apply a threshold and a dilation to the distance image
-    thresh = cv2.threshold(dist, 50, 255, cv2.THRESH_BINARY)[1] # Adjust the threshold value according to your image
-    kernel = np.ones((9, 9), dtype=np.uint8) # Adjust the kernel size according to your image
-    dilated = cv2.dilate(thresh, kernel)
+    thresh = cv2.threshold(dist_8u, 50, 255, cv2.THRESH_BINARY, dst=_scratch_image('thresh', shape, np.uint8))[1] # Adjust the threshold value according to your image
+    dilated = cv2.dilate(thresh, _SPLIT_KERNEL, dst=img)
     # cv2.imwrite("process"+"/"+image_path+str(index)+'_split_contour.jpg', dilated)
     
-    # Find the two contours from the dilated image
-    contours, hierarchy = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # Find the two contours from the dilated image, in frame coordinates
+    contours, hierarchy = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
     # if len(contours) != 2:
     #     print("Could not find two ellipses")
     #     return None, None
@@ -287,87 +740,269 @@ def contour_child_finder(contour_index, hierarchy):
     # Check if the current contour has a single child
     return number_of_child, child_indexes #hierarchy[0, index, 2] != -1
 
-
+# Index over a RETR_TREE hierarchy, built once per frame. Besides the parent and sibling links
+# it holds the child count and depth of every contour (top level contours have depth 0) and
+# the children in CSR form: the children of contour i are child_items[child_start[i]:child_start[i+1]],
+# in the order of their sibling list, i.e. the order contour_child_finder returns.
+#   leaves        - contours without a child
+#   with_children - contours with a number of children in a range
+#   at_depth      - contours at a given depth
+class ContourHierarchy:
+    def __init__(self, hierarchy):
+        links = np.zeros((0, 4), dtype=np.int64) if hierarchy is None else hierarchy.reshape(-1, 4).astype(np.int64)
+        self.next, self.previous, self.first_child, self.parent = links.T
+        n = len(links)
+        has_parent = self.parent >= 0
+        self.child_count = np.bincount(self.parent[has_parent], minlength=n)
+
+        # Position in the sibling list from the distance to its end, and depth from the
+        # distance to the top, both by pointer jumping
+        to_end = _pointer_jump(self.next)
+        self.depth = _pointer_jump(self.parent)
+        position = self.child_count[self.parent[has_parent]] - 1 - to_end[has_parent]
+        self.child_start = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.child_count, out=self.child_start[1:])
+        self.child_items = np.zeros(len(position), dtype=np.int64)
+        self.child_items[self.child_start[self.parent[has_parent]] + position] = np.flatnonzero(has_parent)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def children(self, i):
+        return self.child_items[self.child_start[i]:self.child_start[i + 1]]
+
+    def leaves(self):
+        return np.flatnonzero(self.child_count == 0)
+
+    # Contours with at least `minimum` and at most `maximum` children (no upper limit by default)
+    def with_children(self, minimum=1, maximum=None):
+        keep = self.child_count >= minimum
+        if maximum is not None:
+            keep &= self.child_count <= maximum
+        return np.flatnonzero(keep)
+
+    def at_depth(self, k):
+        return np.flatnonzero(self.depth == k)
+
+# Number of links followed from every node until -1, for an array of links that ends in -1
+# from every node (sibling or parent links): log2 of the longest chain vectorized passes
+def _pointer_jump(links):
+    distance = (links >= 0).astype(np.int64)
+    jump = links.copy()
+    active = np.flatnonzero(jump >= 0)
+    while len(active):
+        target = jump[active]
+        distance[active] += distance[target]
+        jump[active] = jump[target]
+        active = active[jump[active] >= 0]
+    return distance
+
+
+# Ellipses fitted to a batch of contours, one row per contour, in the RotatedRect
+# convention of cv2.fitEllipseDirect: centers (x, y), axes (width, height) with
+# width <= height, and angles in degrees. `fitted` marks the contours that could be
+# fitted (at least 5 points), `accepted` the ones that pass the shape test of
+# measure_droplet_properties.
+class EllipseTable:
+    def __init__(self, centers, axes, angles, fitted=None, accepted=None):
+        self.centers = centers
+        self.axes = axes
+        self.angles = angles
+        self.fitted = np.ones(len(angles), dtype=bool) if fitted is None else fitted
+        self.accepted = self.fitted.copy() if accepted is None else accepted
+
+    def __len__(self):
+        return len(self.angles)
+
+    # A single index returns the ellipse as a ((cx, cy), (width, height), angle) tuple, anything else a new table
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return (tuple(self.centers[key].tolist()), tuple(self.axes[key].tolist()), float(self.angles[key]))
+        return self.take(np.arange(len(self))[key])
+
+    def take(self, indices):
+        return EllipseTable(self.centers[indices], self.axes[indices], self.angles[indices], self.fitted[indices], self.accepted[indices])
+
+    def to_list(self):
+        return [(tuple(c), tuple(a), angle) for c, a, angle in zip(self.centers.tolist(), self.axes.tolist(), self.angles.tolist())]
+
+    # One table with the ellipses of all given tables, in order
+    @classmethod
+    def concat(cls, tables):
+        tables = list(tables)
+        columns = [np.concatenate([getattr(table, name) for table in tables]) for name in ('centers', 'axes', 'angles', 'fitted', 'accepted')]
+        return cls(*columns)
+
+# Vectorized version of cv2.fitEllipseDirect for a ContourTable (or a list of contours).
+# Every contour is centered and scaled like OpenCV does, the 6x6 scatter matrices of all
+# contours are accumulated from the packed point buffer at once and the direct least squares
+# problem (Fitzgibbon, in the numerically stable form of Halir and Flusser) is solved for all
+# of them with stacked 3x3 eigenproblems. Near-singular and degenerate fits (e.g. one pixel
+# wide lines), where OpenCV perturbs the points, are refitted with cv2.fitEllipseDirect.
+# Axes and angles then match cv2.fitEllipseDirect to float32 precision.
+# The acceptance test of measure_droplet_properties is evaluated on the same arrays: the area
+# or the perimeter of the ellipse has to be within `tolerance` of the area or the (open)
+# arc length of the contour.
+def fit_ellipses(contours, tolerance=0.2):
+    table = contours if isinstance(contours, ContourTable) else ContourTable.from_contours(contours)
+    n = len(table)
+    centers = np.zeros((n, 2), dtype=np.float32)
+    axes = np.zeros((n, 2), dtype=np.float32)
+    angles = np.zeros(n, dtype=np.float32)
+    fitted = table.lengths >= 5
+    if not fitted.any():
+        return EllipseTable(centers, axes, angles, fitted, np.zeros(n, dtype=bool))
+
+    subset = table if fitted.all() else table.filter(fitted)
+    fit_centers, fit_axes, fit_angles, stable = _fit_ellipses_direct(subset.points, subset.offsets, subset.bbox)
+    for i in np.flatnonzero(~stable):
+        (cx, cy), (width, height), angle = cv2.fitEllipseDirect(subset.contour(i))
+        fit_centers[i] = cx, cy
+        fit_axes[i] = width, height
+        fit_angles[i] = angle
+    centers[fitted] = fit_centers
+    axes[fitted] = fit_axes
+    angles[fitted] = fit_angles
+
+    # Calculate area and perimeter of the ellipses and compare them to the contours
+    major_axis, minor_axis = axes[:, 0].astype(np.float64), axes[:, 1].astype(np.float64)
+    area_ellipse = np.pi * (major_axis/2) * (minor_axis/2)
+    perimeter_ellipse = 2.0 * np.pi * np.sqrt(((major_axis/2)**2 + (minor_axis/2)**2)/2.0)
+    area = table.area
+    perimeter = _open_arc_lengths(table.points, table.offsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        area_ratio = area_ellipse/area
+        perimeter_ratio = perimeter_ellipse/perimeter
+    accepted = fitted & (area_ellipse > 0) & (area > 0) & ((np.abs(area_ratio-1) < tolerance) | (np.abs(perimeter_ratio-1) < tolerance))
+    return EllipseTable(centers, axes, angles, fitted, accepted)
+
+# cv2.arcLength(contour, False) of all packed contours
+def _open_arc_lengths(points, offsets):
+    if len(offsets) < 2:
+        return np.zeros(0)
+    xy = points.reshape(-1, 2).astype(np.float32)
+    steps = np.sqrt(np.sum(np.diff(xy, axis=0)**2, axis=1)).astype(np.float64)
+    # Drop the steps that join the last point of a contour to the first point of the next one
+    steps[offsets[1:-1] - 1] = 0.0
+    steps = np.append(steps, 0.0)
+    return np.add.reduceat(steps, offsets[:-1])
+
+# Position of the entries of the 6x6 scatter matrix of the design vector (x^2, xy, y^2, x, y, 1)
+# in the list of monomials (x^4, x^3y, x^2y^2, xy^3, y^4, x^3, x^2y, xy^2, y^3, x^2, xy, y^2, x, y, 1)
+_SCATTER_MONOMIALS = np.array([
+    [0, 1, 2, 5, 6, 9],
+    [1, 2, 3, 6, 7, 10],
+    [2, 3, 4, 7, 8, 11],
+    [5, 6, 7, 9, 10, 12],
+    [6, 7, 8, 10, 11, 13],
+    [9, 10, 11, 12, 13, 14]])
+
+def _fit_ellipses_direct(points, offsets, bbox):
+    n_points = np.diff(offsets)
+    starts = offsets[:-1]
+    contour_of_point = np.repeat(np.arange(len(n_points)), n_points)
+    xy = points.reshape(-1, 2).T.astype(np.float64)
+
+    # Center and scale every contour
+    center = np.add.reduceat(xy, starts, axis=1) / n_points
+    d = xy - center[:, contour_of_point]
+    spread = np.add.reduceat(np.abs(d[0]) + np.abs(d[1]), starts)
+    scale = 100.0/np.maximum(spread, np.finfo(np.float32).eps)
+    x = d[0]*scale[contour_of_point]
+    y = d[1]*scale[contour_of_point]
+
+    # Mean scatter matrices of the design vectors, assembled from the sums of 14 monomials
+    x2, xy_, y2 = x*x, x*y, y*y
+    monomials = np.stack([x2*x2, x2*xy_, x2*y2, xy_*y2, y2*y2, x2*x, x2*y, x*y2, y2*y, x2, xy_, y2, x, y])
+    sums = np.add.reduceat(monomials, starts, axis=1) / n_points
+    sums = np.concatenate([sums, np.ones((1, len(n_points)))])
+    scatter = np.moveaxis(sums[_SCATTER_MONOMIALS], -1, 0)
+    center = center.T
+    s1, s2, s3 = scatter[:, :3, :3], scatter[:, :3, 3:], scatter[:, 3:, 3:]
+    with np.errstate(all='ignore'):
+        singular = np.abs(np.linalg.det(s3)) < 1e-300
+        s3[singular] = np.eye(3)
+        t = -np.linalg.solve(s3, np.swapaxes(s2, 1, 2))
+        m = s1 + s2 @ t
+        # Premultiply by the inverse of the constraint matrix 4ac - b^2 = 1
+        m = np.stack([m[:, 2]/2, -m[:, 1], m[:, 0]/2], axis=1)
+        stable = ~singular & (np.abs(np.linalg.det(m)) > 1.0e-10) & np.isfinite(m).all(axis=(1, 2))
+        m[~stable] = np.eye(3)
+        eigenvectors = np.linalg.eig(m)[1].real
+
+        # Select the eigenvector {a, b, c} which satisfies 4ac - b^2 > 0, with OpenCV's sign convention
+        condition = 4.0*eigenvectors[:, 0, :]*eigenvectors[:, 2, :] - eigenvectors[:, 1, :]**2
+        best = np.argmax(condition, axis=1)
+        p = np.take_along_axis(eigenvectors, best[:, None, None], axis=2)[:, :, 0]
+        norm = np.sqrt(np.sum(p**2, axis=1))
+        norm = np.where(np.prod(np.where(p < 0.0, -1, 1), axis=1) <= 0, -norm, norm)
+        p = p/norm[:, None]
+        q = (t @ p[:, :, None])[:, :, 0]
+
+        # Conic a x^2 + b xy + c y^2 + d x + e y + f = 0 to center, axes and angle
+        a, b, c = p[:, 0], p[:, 1], p[:, 2]
+        d, e, f = q[:, 0], q[:, 1], q[:, 2]
+        u1 = c*d*d - b*d*e + a*e*e + b*b*f
+        u2 = a*c*f
+        l1 = np.sqrt(b*b + (a - c)**2)
+        l2 = a + c
+        l3 = b*b - 4*a*c
+        x0 = (2*c*d - b*e)/l3/scale + center[:, 0]
+        y0 = (2*a*e - b*d)/l3/scale + center[:, 1]
+        semi_1 = np.sqrt(2.)*np.sqrt((u1 - 4.0*u2)/((l1 - l2)*l3))/scale
+        semi_2 = np.sqrt(2.)*np.sqrt(-1.0*((u1 - 4.0*u2)/((l1 + l2)*l3)))/scale
+        theta = np.where(b == 0, np.where(a < c, 0.0, np.pi/2.), np.pi/2. + 0.5*np.arctan2(b, a - c))
+
+    width, height = 2.0*semi_1, 2.0*semi_2
+    swap = width > height
+    angles = np.where(swap, np.fmod(90 + np.degrees(theta), 180.0), np.fmod(np.degrees(theta), 180.0))
+    axes = np.stack([np.where(swap, height, width), np.where(swap, width, height)], axis=1)
+    centers = np.stack([x0, y0], axis=1)
+    # Ellipses far larger than the contour come from degenerate point sets
+    diagonal = np.hypot(bbox[:, 2], bbox[:, 3])
+    stable &= np.isfinite(centers).all(axis=1) & np.isfinite(axes).all(axis=1) & (axes[:, 1] <= 2*diagonal)
+    return centers.astype(np.float32), axes.astype(np.float32), angles.astype(np.float32), stable
+
+@_profiled('measure_droplet_properties')
 def measure_droplet_properties(edges, image_path="", save_contour=False):
-    contours, hierarchy = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    with _stage('measure_droplet_properties.find_contours') as stage:
+        contours, hierarchy = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        stage.count(len(contours), contours, hierarchy)
     # print(hierarchy)
 
-    if contours:        
-        # Assuming the largest contour corresponds to the droplet
-        # largest_contour = max(contours, key=cv2.contourArea)
-        # Calculate area of the droplet
-        # area = cv2.contourArea(largest_contour)
-
-        # # Fit an ellipse to the contour to get semi-axes
-        # ellipse = cv2.fitEllipse(largest_contour)
-        # print(ellipse)
-        # print(type(ellipse[0][0]))
-        # # major_axis, minor_axis = ellipse[1]
-
-        # return largest_contour, area, ellipse# major_axis, minor_axis,
-        ellipses = []
-        n = 0
-        # i = 0
-        for i, contour in enumerate(contours): #while i < len(contours):
-            # contour = contours[i]
-            number_of_child, child_indexes = contour_child_finder(i, hierarchy)
-            # print(f'Number of children for contour {i}: {number_of_child}')
-            if number_of_child>1:
-                cnts, hiers = split_contour(edges, contour, image_path, i)
-                for cnt in cnts:
-                    n+=1
-                    if len(cnt) >= 5:
-                        # Calculate area of the contour
-                        area = cv2.contourArea(cnt)
-                        perimeter = cv2.arcLength(cnt, False)
-                        # print(contour)
-
-                        # Fit an ellipse to the contour to get semi-axes
-                        ellipse = cv2.fitEllipseDirect(cnt)
-                        if ellipse is not None:
-
-                            major_axis, minor_axis = ellipse[1]
-                        # print(f'Major Axis: {major_axis}, Minor Axis: {minor_axis}, Angle: {ellipse[2]}')
-                            area_ellipse = np.pi * (major_axis/2) * (minor_axis/2)
-                            perimeter_ellipse = 2.0 * np.pi * np.sqrt(((major_axis/2)**2 + (minor_axis/2)**2)/2.0)
-                            if area_ellipse > 0 and area > 0:
-                                area_ratio = area_ellipse/area
-                                perimeter_ratio = perimeter_ellipse/perimeter
-                            # print(area_ratio, perimeter_ratio)
-                                if np.abs(area_ratio-1) < 0.2 or np.abs(perimeter_ratio-1) < 0.2:#
-                                    ellipses.append(ellipse)
-                # print(f"Contour {i} has more than one child")
-            elif number_of_child==1:
-                # print(f"Contour {i} has a single child")
-                n+=1
-                if len(contour) >= 5:
-                    # Calculate area of the contour
-                    area = cv2.contourArea(contour)
-                    perimeter = cv2.arcLength(contour, False)
-                    # print(contour)
-
-                    # Fit an ellipse to the contour to get semi-axes
-                    ellipse = cv2.fitEllipseDirect(contour)
-                    if ellipse is not None:
-
-                        major_axis, minor_axis = ellipse[1]
-                    # print(f'Major Axis: {major_axis}, Minor Axis: {minor_axis}, Angle: {ellipse[2]}')
-                        area_ellipse = np.pi * (major_axis/2) * (minor_axis/2)
-                        perimeter_ellipse = 2.0 * np.pi * np.sqrt(((major_axis/2)**2 + (minor_axis/2)**2)/2.0)
-                        if area_ellipse > 0 and area > 0:
-                            area_ratio = area_ellipse/area
-                            perimeter_ratio = perimeter_ellipse/perimeter
-                            # print(area_ratio, perimeter_ratio)
-                            if np.abs(area_ratio-1) < 0.2 or np.abs(perimeter_ratio-1) < 0.2:#
-                                ellipses.append(ellipse)
-            
-
+    if contours:
+        ellipses, n = _droplet_ellipses(contours, hierarchy, edges.shape[:2])
         return contours, hierarchy, ellipses, n# major_axis, minor_axis,
 
         
     else:
         return None, 0, None, 0
     
+# Droplet ellipses of the contours of a frame of the given shape and their RETR_TREE hierarchy
+def _droplet_ellipses(contours, hierarchy, frame_shape):
+    # Collect the droplet contours: contours with a single child as they are,
+    # contours with more than one child split into their parts
+    candidates = []
+    n = 0
+    child_count = ContourHierarchy(hierarchy).child_count
+    for i in np.flatnonzero(child_count).tolist():
+        if child_count[i]>1:
+            with _stage('measure_droplet_properties.split') as stage:
+                cnts, hiers = _split_contour(frame_shape, contours[i])
+                stage.count(len(cnts), cnts)
+            n += len(cnts)
+            candidates.extend(cnts)
+        else:
+            n+=1
+            candidates.append(contours[i])
+
+    # Fit ellipses to all of them at once and keep the ones that resemble an ellipse
+    with _stage('measure_droplet_properties.fit_ellipses') as stage:
+        fits = fit_ellipses(ContourTable.from_contours(candidates))
+        ellipses = fits[fits.accepted].to_list()
+        stage.count(len(candidates), fits.centers, fits.axes, fits.angles)
+    return ellipses, n
+
 def draw_contours_with_different_colors(img, contours):
     # Draw each contour with a different color
     color_list = [(0,255,0), (255,0,0), (0,0,255), (255,255,0), (0,255,255), (255,0,255)]
@@ -379,6 +1014,8 @@ def draw_contours_with_different_colors(img, contours):
     return img
 
 def ellipses_analysis(ellipses, save_ellipse=False, filename_vars=None):
+    if isinstance(ellipses, EllipseTable):
+        return _ellipse_table_analysis(ellipses)
     
     ellipses_sorted = ellipses
     n = 0
@@ -401,96 +1038,937 @@ def ellipses_analysis(ellipses, save_ellipse=False, filename_vars=None):
     #     properties = [(0,0,0)]
     return n, properties, ellipses_sorted
 
+# ellipses_analysis for an EllipseTable: the ellipses are sorted by area with one argsort and
+# returned, like for a list, as a list of (center_x, center_y, major_axis, minor_axis, angle)
+# properties and a list of ((cx, cy), (width, height), angle) tuples
+def _ellipse_table_analysis(ellipses):
+    n = len(ellipses)
+    if n == 0:
+        return 0, [(0,0,0,0,0)], []
+    area = ellipses.axes[:, 0].astype(np.float64) * ellipses.axes[:, 1]
+    ellipses_sorted = ellipses.take(np.argsort(-area, kind='stable'))
+    properties = np.column_stack([ellipses_sorted.centers, ellipses_sorted.axes, ellipses_sorted.angles]).astype(np.float64)
+    return n, [tuple(row) for row in properties.tolist()], ellipses_sorted.to_list()
+
+# Column and row sums of an image, or of every image of a (T, H, W) stack
 def calculate_pixel_sum(image):
-    s1 = np.sum(image, axis=0)
-    s2 = np.sum(image, axis=1)
+    s1 = np.sum(image, axis=-2)
+    s2 = np.sum(image, axis=-1)
     return s1, s2
 
 def calculate_pixel_grad(s1, s2):
-    grad_x = np.gradient(s1)
-    grad_y = np.gradient(s2)
+    grad_x = np.gradient(s1, axis=-1)
+    grad_y = np.gradient(s2, axis=-1)
     return grad_x, grad_y    
 
-def contour_finder(image_path, crop_x_lim=(400,1100), crop_y_lim=(230,1660), clipLimit=2.0, tileGridSize=(8, 8), threshold=50, binarization_max_val=255, save_contour=False, save_contrast=False, save_binarized=False, droplet_hierarchy_check=False):
+# Normalized pixel sums and their gradients along x and y of a binary image, or of a (T, H, W)
+# stack of them, as returned by gradient_labeling
+def gradient_profiles(thresh):
+    sx, sy = calculate_pixel_sum(thresh)
+    grad_x, grad_y = calculate_pixel_grad(sx, sy)
+    normalize = lambda profile: profile/np.max(profile, axis=-1, keepdims=True)
+    return normalize(grad_x), normalize(grad_y), normalize(sx), normalize(sy)
+
+# Pack a list of contours into a single point buffer plus an offsets array,
+# contour i is points[offsets[i]:offsets[i+1]]
+def pack_contours(contours):
+    offsets = np.zeros(len(contours) + 1, dtype=np.int64)
+    if len(contours) == 0:
+        return np.empty((0, 1, 2), dtype=np.int32), offsets
+    offsets[1:] = np.cumsum([len(contour) for contour in contours])
+    points = np.concatenate([np.asarray(contour, dtype=np.int32).reshape(-1, 1, 2) for contour in contours])
+    return points, offsets
+
+# Inverse of pack_contours, the returned contours are views into the point buffer
+def unpack_contours(points, offsets):
+    return [points[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+# Columnar result of contour_finder. All contour points live in one packed buffer
+# (contour i is points[offsets[i]:offsets[i+1]]) and the moments, area, centroid and
+# bounding box of every contour are computed once, as contiguous arrays, when the table
+# is built from findContours output. Filtering, sorting and slicing are array operations
+# that never recompute these properties.
+class ContourTable:
+    def __init__(self, points, offsets, index=None, _columns=None):
+        self.points = points
+        self.offsets = offsets
+        # Position of every contour in the findContours output, i.e. its row in the hierarchy
+        self.index = np.arange(len(offsets) - 1) if index is None else index
+        if _columns is None:
+            _columns = _contour_properties(points, offsets)
+        self.m00, self.m10, self.m01, self.area, self.centroid, self.bbox = _columns
+
+    @classmethod
+    def from_contours(cls, contours):
+        points, offsets = pack_contours(contours)
+        return cls(points, offsets)
+
+    # One table with the contours of all given tables, in order
+    @classmethod
+    def concat(cls, tables):
+        tables = list(tables)
+        if not tables:
+            return cls.from_contours([])
+        offsets = np.zeros(sum(len(table) for table in tables) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate([table.lengths for table in tables]), out=offsets[1:])
+        columns = tuple(np.concatenate([getattr(table, name) for table in tables]) for name in ('m00', 'm10', 'm01', 'area', 'centroid', 'bbox'))
+        points = np.concatenate([table.points for table in tables])
+        return cls(points, offsets, np.concatenate([table.index for table in tables]), columns)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # A single index returns the contour itself, anything else (slice, index array, boolean mask) a new table
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.contour(key)
+        return self.take(np.arange(len(self))[key])
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def contour(self, i):
+        if i < 0:
+            i += len(self)
+        return self.points[self.offsets[i]:self.offsets[i + 1]]
+
+    def contours(self):
+        return unpack_contours(self.points, self.offsets)
+
+    # New table with the contours at the given positions, in the given order
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.lengths[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        point_index = np.repeat(self.offsets[:-1][indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        columns = (self.m00[indices], self.m10[indices], self.m01[indices], self.area[indices], self.centroid[indices], self.bbox[indices])
+        return ContourTable(self.points[point_index], offsets, self.index[indices], columns)
+
+    def filter(self, mask):
+        return self.take(np.flatnonzero(mask))
+
+    # Sort by area, ties keep their order like sorted(..., reverse=True)
+    def sort_by_area(self, reverse=True):
+        key = -self.area if reverse else self.area
+        return self.take(np.argsort(key, kind='stable'))
+
+    # The three parallel lists returned by contour_finder
+    def to_lists(self):
+        contour_centroids = [tuple(c) for c in self.centroid.tolist()]
+        return self.contours(), self.area.tolist(), contour_centroids
+
+# Moments, area, centroid and bounding box of all packed contours at once, using the same
+# formulas as cv2.moments, cv2.contourArea, get_centroid and cv2.boundingRect
+def _contour_properties(points, offsets):
+    n = len(offsets) - 1
+    if n == 0:
+        empty = np.zeros(0)
+        return empty, empty, empty, empty, np.zeros((0, 2), dtype=np.int64), np.zeros((0, 4), dtype=np.int64)
+    xy = points.reshape(-1, 2).astype(np.int64)
+    x, y = xy[:, 0], xy[:, 1]
+    starts = offsets[:-1]
+    previous = np.arange(len(x)) - 1
+    previous[starts] = offsets[1:] - 1
+    x_prev, y_prev = x[previous], y[previous]
+
+    # Green's theorem sums, exact in integer arithmetic
+    dxy = x_prev*y - x*y_prev
+    a00 = np.add.reduceat(dxy, starts)
+    a10 = np.add.reduceat(dxy*(x_prev + x), starts)
+    a01 = np.add.reduceat(dxy*(y_prev + y), starts)
+    sign = np.where(a00 < 0, -1, 1)
+    m00 = (a00*sign)*0.5
+    m10 = (a10*sign)*(1.0/6)
+    m01 = (a01*sign)*(1.0/6)
+    area = np.abs(a00)*0.5
+
+    # Centroids truncated to integers, degenerate contours fall back to their first point
+    centroid = xy[starts].copy()
+    nonzero = m00 != 0
+    centroid[nonzero, 0] = np.trunc(m10[nonzero]/m00[nonzero])
+    centroid[nonzero, 1] = np.trunc(m01[nonzero]/m00[nonzero])
+
+    x_min = np.minimum.reduceat(x, starts)
+    y_min = np.minimum.reduceat(y, starts)
+    x_max = np.maximum.reduceat(x, starts)
+    y_max = np.maximum.reduceat(y, starts)
+    bbox = np.stack([x_min, y_min, x_max - x_min + 1, y_max - y_min + 1], axis=1)
+    return m00, m10, m01, area, centroid, bbox
+
+# Spatial index over the bounding boxes of a ContourTable (or a list of contours) for overlap and
+# neighbor queries. Bounding boxes and centroids are bucketed in a uniform grid of cell_size
+# pixels (by default twice the median bounding box size), stored CSR-style: the contours of
+# cell c are cell_items[cell_start[c]:cell_start[c+1]].
+#   candidate_pairs - pairs of contours whose bounding boxes overlap (sort and sweep along x)
+#   intersecting_pairs - the candidate pairs that really touch or overlap (contour_intersect)
+#   query_region    - contours whose bounding box meets a rectangle
+#   nearest         - k nearest contours to a point, by centroid
+class ContourIndex:
+    def __init__(self, contours, cell_size=None):
+        self.table = contours if isinstance(contours, ContourTable) else ContourTable.from_contours(contours)
+        bbox = self.table.bbox.astype(np.int64)
+        self.x0, self.y0 = bbox[:, 0], bbox[:, 1]
+        self.x1, self.y1 = bbox[:, 0] + bbox[:, 2] - 1, bbox[:, 1] + bbox[:, 3] - 1
+        self.centroid = self.table.centroid.astype(np.int64)
+        if cell_size is None:
+            cell_size = 2 * int(np.median(bbox[:, 2:].max(axis=1))) if len(bbox) else 1
+        self.cell_size = max(int(cell_size), 1)
+        n = len(self.table)
+        self.origin = (int(min(self.x0.min(), self.centroid[:, 0].min())), int(min(self.y0.min(), self.centroid[:, 1].min()))) if n else (0, 0)
+        extent_x = int(max(self.x1.max(), self.centroid[:, 0].max())) - self.origin[0] + 1 if n else 1
+        extent_y = int(max(self.y1.max(), self.centroid[:, 1].max())) - self.origin[1] + 1 if n else 1
+        # Keep the grid to about 4 cells per contour however small cell_size is
+        max_cells = 4 * max(n, 1)
+        while -(-extent_x // self.cell_size) * -(-extent_y // self.cell_size) > max_cells:
+            self.cell_size *= 2
+        self.shape = (-(-extent_y // self.cell_size), -(-extent_x // self.cell_size))
+
+        # Boxes: one entry per covered cell
+        cx0, cy0 = self._cell(self.x0, self.y0)
+        cx1, cy1 = self._cell(self.x1, self.y1)
+        widths, heights = cx1 - cx0 + 1, cy1 - cy0 + 1
+        counts = widths * heights
+        items = np.repeat(np.arange(n), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (np.repeat(cy0, counts) + k // np.repeat(widths, counts)) * self.shape[1] + np.repeat(cx0, counts) + k % np.repeat(widths, counts)
+        self.cell_start, self.cell_items = self._csr(cells, items)
+        # Centroids: one cell each
+        cx, cy = self._cell(self.centroid[:, 0], self.centroid[:, 1])
+        self.centroid_start, self.centroid_items = self._csr(cy * self.shape[1] + cx, np.arange(n))
+
+    def __len__(self):
+        return len(self.table)
+
+    def _cell(self, x, y):
+        cx = np.clip((np.asarray(x) - self.origin[0]) // self.cell_size, 0, self.shape[1] - 1)
+        cy = np.clip((np.asarray(y) - self.origin[1]) // self.cell_size, 0, self.shape[0] - 1)
+        return cx, cy
+
+    def _csr(self, cells, items):
+        order = np.argsort(cells, kind='stable')
+        start = np.searchsorted(cells[order], np.arange(self.shape[0] * self.shape[1] + 1))
+        return start, items[order]
+
+    # Contours listed in the cells of the given cell rectangle (with repetitions)
+    def _gather(self, start, items, cx0, cy0, cx1, cy1):
+        rows = np.arange(cy0, cy1 + 1)[:, None] * self.shape[1] + np.arange(cx0, cx1 + 1)
+        rows = rows.ravel()
+        counts = start[rows + 1] - start[rows]
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return items[np.repeat(start[rows], counts) + k]
+
+    # (M, 2) array of index pairs i < j whose bounding boxes overlap or are at most `margin`
+    # pixels apart, sorted. Sort and sweep: after sorting by left edge, the partners of a box are
+    # the following boxes whose left edge is not past its right edge.
+    def candidate_pairs(self, margin=0):
+        n = len(self.table)
+        order = np.argsort(self.x0, kind='stable')
+        x0, x1 = self.x0[order], self.x1[order]
+        end = np.searchsorted(x0, x1 + margin, side='right')
+        counts = np.maximum(end - np.arange(n) - 1, 0)
+        first = np.repeat(np.arange(n), counts)
+        second = first + 1 + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        i, j = order[first], order[second]
+        overlap = (self.y0[i] <= self.y1[j] + margin) & (self.y0[j] <= self.y1[i] + margin) & (self.x0[i] <= self.x1[j] + margin)
+        pairs = np.sort(np.stack([i[overlap], j[overlap]], axis=1), axis=1)
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))] if len(pairs) else pairs.reshape(0, 2)
+
+    # Candidate pairs that really intersect, tested in both directions with contour_intersect
+    def intersecting_pairs(self, edges_only=True, margin=0, method='exact'):
+        pairs = self.candidate_pairs(margin)
+        keep = [contour_intersect(self.table.contour(i), self.table.contour(j), edges_only, method) or
+                contour_intersect(self.table.contour(j), self.table.contour(i), edges_only, method) for i, j in pairs.tolist()]
+        return pairs[np.array(keep, dtype=bool)] if len(pairs) else pairs
+
+    # Sorted indices of the contours whose bounding box meets the rectangle x, y, w, h
+    def query_region(self, x, y, w, h):
+        if len(self.table) == 0 or w <= 0 or h <= 0:
+            return np.zeros(0, dtype=np.int64)
+        cx0, cy0 = self._cell(x, y)
+        cx1, cy1 = self._cell(x + w - 1, y + h - 1)
+        candidates = np.unique(self._gather(self.cell_start, self.cell_items, int(cx0), int(cy0), int(cx1), int(cy1)))
+        hit = (self.x0[candidates] <= x + w - 1) & (self.x1[candidates] >= x) & (self.y0[candidates] <= y + h - 1) & (self.y1[candidates] >= y)
+        return candidates[hit]
+
+    # Indices and distances of the k contours whose centroids are nearest to (x, y), nearest
+    # first. Rings of grid cells are searched outwards until the k-th distance is covered.
+    def nearest(self, x, y, k=1):
+        n = len(self.table)
+        k = min(k, n)
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        cx, cy = (int(v) for v in self._cell(x, y))
+        ring = 0
+        while True:
+            cx0, cy0 = max(cx - ring, 0), max(cy - ring, 0)
+            cx1, cy1 = min(cx + ring, self.shape[1] - 1), min(cy + ring, self.shape[0] - 1)
+            candidates = self._gather(self.centroid_start, self.centroid_items, cx0, cy0, cx1, cy1)
+            covers_grid = cx0 == 0 and cy0 == 0 and cx1 == self.shape[1] - 1 and cy1 == self.shape[0] - 1
+            if len(candidates) >= k or covers_grid:
+                distance = np.hypot(self.centroid[candidates, 0] - x, self.centroid[candidates, 1] - y)
+                nearest = np.lexsort((candidates, distance))[:k]
+                # Everything within `ring` cells is known, i.e. everything closer than this to (x, y);
+                # a centroid at exactly this distance can be in the next ring, and win a tie
+                reach = min(x - self.origin[0] - (cx - ring) * self.cell_size, (cx + ring + 1) * self.cell_size - (x - self.origin[0]),
+                            y - self.origin[1] - (cy - ring) * self.cell_size, (cy + ring + 1) * self.cell_size - (y - self.origin[1]))
+                if covers_grid or distance[nearest[-1]] < reach:
+                    return candidates[nearest], distance[nearest]
+            ring += 1
+
+# Content-addressed cache of the intermediate stages of contour_finder: decoded ROI, CLAHE output,
+# binarized mask and contour table. The key of a stage is the hash of its upstream key and its own
+# parameters, starting from the hash of the file content (or of the array), so changing one
+# parameter only invalidates the stages downstream of it. Entries live in memory (LRU, up to
+# max_bytes) and, with a directory, on disk as .npz files (LRU by modification time, up to
+# max_disk_bytes). Cached arrays are read-only; contour_finder and contour_finder_sweep return
+# writable copies of them, as without a cache. Worker processes of contour_finder_batch get a
+# copy without the in-memory entries and share the disk cache.
+class StageCache:
+    STAGES = ('roi', 'clahe', 'binary', 'contours')
+
+    def __init__(self, directory=None, max_bytes=1 << 30, max_disk_bytes=8 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._init_state()
+
+    def _init_state(self):
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._file_digests = {}
+        self._lock = threading.Lock()
+        self._disk = None
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def __getstate__(self):
+        return dict(directory=self.directory, max_bytes=self.max_bytes, max_disk_bytes=self.max_disk_bytes, hits=0, misses=0)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    # Hash of the image content. File hashes are remembered per (path, size, mtime).
+    def source_digest(self, image):
+        if isinstance(image, np.ndarray):
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(repr((image.shape, image.dtype.str)).encode())
+            digest.update(np.ascontiguousarray(image).data)
+            return digest.digest()
+        stat = os.stat(image)
+        file_key = (os.path.abspath(image), stat.st_size, stat.st_mtime_ns)
+        digest = self._file_digests.get(file_key)
+        if digest is None:
+            hasher = hashlib.blake2b(digest_size=16)
+            with open(image, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    hasher.update(block)
+            digest = self._file_digests[file_key] = hasher.digest()
+        return digest
+
+    # Keys of the consecutive stages, one tuple of parameters per stage. Numbers are keyed as
+    # floats, so e.g. threshold=50 and the 50.0 of a threshold sweep share their entries.
+    def stage_keys(self, image, *stage_params):
+        keys = []
+        key = self.source_digest(image)
+        for name, params in zip(self.STAGES, stage_params):
+            key = hashlib.blake2b(key + repr((name, _stage_param(params))).encode(), digest_size=16).digest()
+            keys.append(name + '-' + key.hex())
+        return keys
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._memory_put(key, value)
+        return value
+
+    def put(self, key, value):
+        # Views (e.g. the ROI of a decoded frame or of a caller's array) are copied, so the cache
+        # neither keeps the whole frame alive nor changes when the caller's array does
+        if isinstance(value, np.ndarray) and value.base is not None:
+            value = value.copy()
+        value = _freeze_stage_value(value)
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+        return value
+
+    def _memory_put(self, key, value):
+        size = sum(array.nbytes for array in _encode_stage_value(value).values())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def _disk_get(self, key):
+        if self.directory is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with np.load(path) as data:
+                value = _decode_stage_value({name: data[name] for name in data.files})
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return _freeze_stage_value(value)
+
+    def _disk_put(self, key, value):
+        if self.directory is None:
+            return
+        path = self._disk_path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            np.savez(f, **_encode_stage_value(value))
+        os.replace(temporary, path)
+        with self._lock:
+            if self._disk is None:
+                self._disk = {entry.path: entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith('.npz')}
+            self._disk[path] = os.path.getsize(path)
+            if sum(self._disk.values()) > self.max_disk_bytes:
+                self._evict_disk()
+
+    # Removes the least recently used files until the disk cache is under its cap.
+    # Other processes may share the directory, so the listing is refreshed first.
+    def _evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        entries.sort()
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._disk = {path: size for _, path, size in entries if os.path.exists(path)}
+
+    def clear(self, disk=False):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if disk and self.directory is not None:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.npz'):
+                    os.remove(entry.path)
+            self._disk = None
+
+def _stage_param(value):
+    if isinstance(value, (tuple, list)):
+        return tuple(_stage_param(item) for item in value)
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (numbers.Real, np.number)):
+        return float(value)
+    return value
+
+# Stage values are arrays or (ContourTable, hierarchy) pairs, stored as dicts of arrays
+def _encode_stage_value(value):
+    if isinstance(value, np.ndarray):
+        return {'array': value}
+    table, hierarchy = value
+    arrays = dict(points=table.points, offsets=table.offsets, index=table.index, m00=table.m00, m10=table.m10,
+                  m01=table.m01, area=table.area, centroid=table.centroid, bbox=table.bbox)
+    if hierarchy is not None:
+        arrays['hierarchy'] = hierarchy
+    return arrays
+
+def _decode_stage_value(arrays):
+    if 'array' in arrays:
+        return arrays['array']
+    columns = tuple(arrays[name] for name in ('m00', 'm10', 'm01', 'area', 'centroid', 'bbox'))
+    return ContourTable(arrays['points'], arrays['offsets'], arrays['index'], columns), arrays.get('hierarchy')
+
+def _freeze_stage_value(value):
+    for array in _encode_stage_value(value).values():
+        array.flags.writeable = False
+    return value
+
+# Writable copy of a cached stage value, for the results handed to the caller
+def _thaw_stage_value(value):
+    return _decode_stage_value({name: array.copy() for name, array in _encode_stage_value(value).items()})
+
+# Value of one contour_finder stage: taken from the cache when possible, otherwise computed
+# (and cached), at most once per call
+class _CachedStage:
+    def __init__(self, cache, key, compute):
+        self.cache = cache
+        self.key = key
+        self.compute = compute
+        self.done = False
+
+    def __call__(self):
+        if not self.done:
+            self.value = None if self.cache is None else self.cache.get(self.key)
+            if self.value is None:
+                self.value = self.compute()
+                if self.cache is not None:
+                    self.value = self.cache.put(self.key, self.value)
+            self.done = True
+        return self.value
+
+def _decode_stage(image_path, crop_x_lim, crop_y_lim, fast_decode=False, reduce=1):
+    with _stage('contour_finder.decode') as stage:
+        cropped_image = load_image(image_path, rows=crop_x_lim, cols=crop_y_lim, fast_decode=fast_decode, reduce=reduce)
+        stage.count(0, cropped_image)
+    return cropped_image
+
+def _clahe_stage(cropped_image, clipLimit, tileGridSize):
+    with _stage('contour_finder.clahe') as stage:
+        image_contrast = enhance_contrast(cropped_image, clipLimit, tileGridSize)
+        stage.count(0, image_contrast)
+    return image_contrast
+
+def _threshold_stage(image_contrast, threshold, binarization_max_val):
+    with _stage('contour_finder.threshold') as stage:
+        thresh = cv2.threshold(src=image_contrast, thresh=threshold, maxval=binarization_max_val, type=cv2.THRESH_BINARY)[1]
+        stage.count(0, thresh)
+    return thresh
+
+def _contour_stage(thresh, droplet_hierarchy_check, gradient_image=None):
+    with _stage('contour_finder.find_contours') as stage:
+        cntrs, hierarchy = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)#cv2.RETR_EXTERNAL
+        stage.count(len(cntrs), cntrs, hierarchy)
+    with _stage('contour_finder.filter') as stage:
+        table = ContourTable.from_contours(cntrs)
+        keep = _droplet_contours(table, hierarchy, droplet_hierarchy_check)
+        # Optionally only the ones with a boundary pixel darker than their centroid
+        if gradient_image is not None:
+            keep &= check_gradient_batch(gradient_image, table)
+        table = table.filter(keep).sort_by_area()
+        stage.count(len(table), table.points, table.offsets)
+    return table, hierarchy
+
+# Keep small contours away from the top edge, optionally only the ones without a child
+def _droplet_contours(table, hierarchy, droplet_hierarchy_check):
+    keep = (table.area < 30000) & (table.centroid[:, 1] > 20)
+    if droplet_hierarchy_check and hierarchy is not None:
+        keep &= hierarchy[0, :, 2] == -1
+    return keep
+
+@_profiled('contour_finder')
+def contour_finder(image_path, crop_x_lim=(400,1100), crop_y_lim=(230,1660), clipLimit=2.0, tileGridSize=(8, 8), threshold=50, binarization_max_val=255, save_contour=False, save_contrast=False, save_binarized=False, droplet_hierarchy_check=False, return_table=False, cache=None, gradient_check=False, fast_decode=False, reduce=1):
     # Load the image
     # image = cv2.imread(image_path)
     # Crop and remove nozzle
     # x_offset = 220#580
     # y_offset = 0#485
     # cropped_image = crop_and_remove_nozzle(image.copy(), x_offset, y_offset)
-    cropped_image = cv2.imread(image_path)[crop_x_lim[0]:crop_x_lim[1], crop_y_lim[0]:crop_y_lim[1]]#, cv2.IMREAD_GRAYSCALE
+    # Every stage is computed on demand, or taken from the StageCache when one is given
+    keys = [None] * 4 if cache is None else cache.stage_keys(
+        image_path, (crop_x_lim, crop_y_lim, fast_decode, reduce), (clipLimit, tileGridSize), (threshold, binarization_max_val), (droplet_hierarchy_check, gradient_check))
+    cropped_image = _CachedStage(cache, keys[0], lambda: _decode_stage(image_path, crop_x_lim, crop_y_lim, fast_decode, reduce))
     # Enhance contrast
     # image_contrast = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2GRAY)
-    image_contrast = enhance_contrast(cropped_image, clipLimit, tileGridSize)
-    if save_contrast:
-        cv2.imwrite(image_path.replace('.jpg','_contrast.png'), image_contrast)
-    
+    image_contrast = _CachedStage(cache, keys[1], lambda: _clahe_stage(cropped_image(), clipLimit, tileGridSize))
     # threshold
-    thresh = cv2.threshold(src=image_contrast, thresh=threshold, maxval=binarization_max_val, type=cv2.THRESH_BINARY)[1]
-    if save_binarized:
-        cv2.imwrite(image_path.replace('.jpg','_binarized.png'), thresh)
-    
+    thresh = _CachedStage(cache, keys[2], lambda: _threshold_stage(image_contrast(), threshold, binarization_max_val))
     # find contours
-    cntrs, hierarchy = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)#cv2.RETR_EXTERNAL
-    # cntrs_sorted = sorted(cntrs, key=cv2.contourArea, reverse=True)
-    # contours = []
-    # contours_area = []
-    # contour_centroids = []
-    contours_zip = []
-    # For each contour, find the bounding rectangle and draw it
-    if hierarchy is not None:
-        for component in zip(cntrs, hierarchy[0]):
-            currentContour = component[0]
-            currentHierarchy = component[1]
-            if cv2.contourArea(currentContour) < 30000:
-                (x,y) = get_centroid(currentContour)
-                if y > 20:#100 and y < 1400:# or x < 100 or x > 1000
-                    if droplet_hierarchy_check:
-                        if currentHierarchy[2] == -1:
-                            contours_zip.append((currentContour, cv2.contourArea(currentContour), (x,y)))
-                            # contours.append(currentContour)
-                            # contours_area.append(cv2.contourArea(currentContour))
-                            # contour_centroids.append((x,y))
-                    else:
-                        contours_zip.append((currentContour, cv2.contourArea(currentContour), (x,y)))
-
-    # for cont in cntrs:#_sorted:
-    #     if cv2.contourArea(cont) < 30000:
-    #         (x,y) = get_centroid(cont)
-    #         if y > 20:#100 and y < 1400:# or x < 100 or x > 1000
-                
-    #             contours.append(cont)
-    #             contours_area.append(cv2.contourArea(cont))
-    #             contour_centroids.append((x,y))
-    contours_sorted = sorted(contours_zip, key=lambda x: cv2.contourArea(x[0]), reverse=True)
-    contours = [x[0] for x in contours_sorted]
-    contours_area = [x[1] for x in contours_sorted]
-    contour_centroids = [x[2] for x in contours_sorted]
+    contour_table = _CachedStage(cache, keys[3], lambda: _contour_stage(thresh(), droplet_hierarchy_check, image_contrast() if gradient_check else None))
+
+    # Intermediate images can only be saved next to an input file
+    save_contour, save_contrast, save_binarized = [save and isinstance(image_path, str) for save in (save_contour, save_contrast, save_binarized)]
+    if save_contrast:
+        cv2.imwrite(image_path.replace('.jpg','_contrast.png'), image_contrast())
+    if save_binarized:
+        cv2.imwrite(image_path.replace('.jpg','_binarized.png'), thresh())
+    table, hierarchy = contour_table() if cache is None else _thaw_stage_value(contour_table())
     if save_contour:
-        image_with_contours = cropped_image.copy()
-        draw_contours_with_different_colors(image_with_contours, contours)
+        image_with_contours = cv2.cvtColor(cropped_image(), cv2.COLOR_GRAY2BGR)
+        draw_contours_with_different_colors(image_with_contours, table.contours())
         cv2.imwrite(image_path.replace('.jpg','_contours.png'), image_with_contours)
     # image_with_contours = cropped_image.copy()
     # draw_contours_with_different_colors(image_with_contours, contours)
     # cv2.imwrite(image_path+'_contours.jpg', image_with_contours)
-    
+    if return_table:
+        return table, hierarchy
+    contours, contours_area, contour_centroids = table.to_lists()
+    return contours, contours_area, contour_centroids, hierarchy
+
+# Runs contour_finder in a worker process. Results travel back as ContourTables,
+# i.e. a handful of contiguous arrays per frame instead of one small array per contour.
+# With profile set, the worker records its own stage stats and returns them for the parent to merge.
+def _contour_finder_packed(image_paths, kwargs, profile=False):
+    if not profile:
+        return [contour_finder(image_path, return_table=True, **kwargs) for image_path in image_paths], None
+    enable_profiling()
+    try:
+        results = [contour_finder(image_path, return_table=True, **kwargs) for image_path in image_paths]
+    finally:
+        stats = disable_profiling().as_dict()
+    return results, stats
+
+def _unpack_contour_finder_result(packed, return_table):
+    table, hierarchy = packed
+    if return_table:
+        return table, hierarchy
+    contours, contours_area, contour_centroids = table.to_lists()
     return contours, contours_area, contour_centroids, hierarchy
 
+# Runs contour_finder over many images on a process pool and yields the results in input order.
+# Images are scheduled in chunks of chunksize paths; at most workers*prefetch chunks are in flight,
+# so results can be consumed while later frames are still being processed.
+def iter_contour_finder_batch(image_paths, workers=None, chunksize=8, prefetch=2, return_table=False, **kwargs):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for image_path in image_paths:
+            yield contour_finder(image_path, return_table=return_table, **kwargs)
+        return
+
+    path_iter = iter(image_paths)
+    next_chunk = lambda: list(itertools.islice(path_iter, chunksize))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for _ in range(workers * prefetch):
+            chunk = next_chunk()
+            if not chunk:
+                break
+            pending.append(executor.submit(_contour_finder_packed, chunk, kwargs, _profiler is not None))
+        while pending:
+            results, stats = pending.popleft().result()
+            if stats is not None and _profiler is not None:
+                _profiler.merge(stats)
+            chunk = next_chunk()
+            if chunk:
+                pending.append(executor.submit(_contour_finder_packed, chunk, kwargs, _profiler is not None))
+            for packed in results:
+                yield _unpack_contour_finder_result(packed, return_table)
+
+# Batch version of contour_finder, returns a list with one
+# (contours, contours_area, contour_centroids, hierarchy) tuple per image
+def contour_finder_batch(image_paths, workers=None, chunksize=8, prefetch=2, return_table=False, **kwargs):
+    return list(iter_contour_finder_batch(image_paths, workers, chunksize, prefetch, return_table, **kwargs))
+
+# Filtered contour sets of one frame for a list of thresholds (see contour_finder_sweep):
+# thresholds in ascending order, one ContourTable and hierarchy per threshold (equal
+# binarizations share them) and the droplet counts and area statistics per threshold
+class ThresholdSweep:
+    def __init__(self, thresholds, tables, hierarchies, distinct):
+        self.thresholds = np.asarray(thresholds)
+        self.tables = tables
+        self.hierarchies = hierarchies
+        # Number of different binarizations that were actually computed
+        self.distinct = distinct
+        self.counts = np.array([len(table) for table in tables], dtype=np.int64)
+        self.total_area = np.array([table.area.sum() for table in tables])
+        self.mean_area = np.array([table.area.mean() if len(table) else 0.0 for table in tables])
+        self.median_area = np.array([np.median(table.area) if len(table) else 0.0 for table in tables])
+
+    def __len__(self):
+        return len(self.thresholds)
+
+    def areas(self, i):
+        return self.tables[i].area
+
+    def stable_threshold(self, count_tolerance=0.0, area_tolerance=0.05):
+        return pick_stable_threshold(self, count_tolerance, area_tolerance)
+
+# contour_finder for many thresholds at once. The frame is decoded and contrast-enhanced once,
+# which is all the work shared between thresholds. Two thresholds give the same binarization
+# exactly when no pixel value lies between them, so the histogram of the enhanced image groups the
+# thresholds and cv2.threshold/findContours run once per group. The cost is still linear in the
+# number of distinct binarizations (ThresholdSweep.distinct): CLAHE output usually has a pixel at
+# almost every grey level, so integer thresholds of real frames are mostly distinct and the
+# sweep then costs one threshold and findContours pass per threshold. With a cache, the contours
+# are stored for every threshold, under the keys contour_finder uses.
+def contour_finder_sweep(image_path, thresholds, crop_x_lim=(400,1100), crop_y_lim=(230,1660), clipLimit=2.0, tileGridSize=(8, 8), binarization_max_val=255, droplet_hierarchy_check=False, cache=None, gradient_check=False):
+    thresholds = np.unique(np.asarray(thresholds, dtype=np.float64))
+    keys = [None] * 2 if cache is None else cache.stage_keys(image_path, (crop_x_lim, crop_y_lim, False, 1), (clipLimit, tileGridSize))
+    cropped_image = _CachedStage(cache, keys[0], lambda: _decode_stage(image_path, crop_x_lim, crop_y_lim))
+    image_contrast = _CachedStage(cache, keys[1], lambda: _clahe_stage(cropped_image(), clipLimit, tileGridSize))()
+
+    # THRESH_BINARY keeps the pixels above floor(threshold); count them for every threshold
+    histogram = np.bincount(image_contrast.ravel(), minlength=256)
+    above = image_contrast.size - np.cumsum(histogram)
+    levels = np.floor(thresholds).astype(np.int64)
+    counts = np.where(levels < 0, image_contrast.size, above[np.clip(levels, 0, 255)])
+
+    gradient_image = image_contrast if gradient_check else None
+    tables, hierarchies = [], []
+    groups, cached = {}, {}
+    for threshold, count in zip(thresholds.tolist(), counts.tolist()):
+        if cache is None:
+            if count not in groups:
+                binary = _threshold_stage(image_contrast, threshold, binarization_max_val)
+                groups[count] = _contour_stage(binary, droplet_hierarchy_check, gradient_image)
+        else:
+            binary_key, contour_key = cache.stage_keys(image_path, (crop_x_lim, crop_y_lim, False, 1), (clipLimit, tileGridSize),
+                                                       (threshold, binarization_max_val), (droplet_hierarchy_check, gradient_check))[2:]
+            if count not in groups:
+                binary = _CachedStage(cache, binary_key, lambda: _threshold_stage(image_contrast, threshold, binarization_max_val))
+                cached[count] = _CachedStage(cache, contour_key, lambda: _contour_stage(binary(), droplet_hierarchy_check, gradient_image))()
+                groups[count] = _thaw_stage_value(cached[count])
+            elif cache.get(contour_key) is None:
+                # The other thresholds of a group get its contours too, for later single runs
+                cache.put(contour_key, cached[count])
+        table, hierarchy = groups[count]
+        tables.append(table)
+        hierarchies.append(hierarchy)
+    return ThresholdSweep(thresholds, tables, hierarchies, len(groups))
+
+# Picks the threshold in the middle of the longest run of consecutive thresholds over which the
+# droplet count and the median droplet area stay within the given relative tolerances. Accepts one
+# ThresholdSweep or a list of sweeps over the same thresholds (e.g. several frames), whose counts
+# are summed and median areas averaged.
+def pick_stable_threshold(sweeps, count_tolerance=0.0, area_tolerance=0.05):
+    if isinstance(sweeps, ThresholdSweep):
+        sweeps = [sweeps]
+    thresholds = sweeps[0].thresholds
+    counts = np.sum([sweep.counts for sweep in sweeps], axis=0).astype(np.float64)
+    median_area = np.mean([sweep.median_area for sweep in sweeps], axis=0)
+    if len(thresholds) < 2:
+        return float(thresholds[0])
+    count_change = np.abs(np.diff(counts)) / np.maximum(np.maximum(counts[:-1], counts[1:]), 1)
+    area_change = np.abs(np.diff(median_area)) / np.maximum(np.maximum(median_area[:-1], median_area[1:]), 1e-12)
+    stable = (count_change <= count_tolerance) & (area_change <= area_tolerance) & (counts[:-1] > 0)
+    # Longest run of stable steps; without one, the step with the smallest change
+    best_start, best_length, start = 0, 0, None
+    for i, step in enumerate(np.append(stable, False)):
+        if step and start is None:
+            start = i
+        elif not step and start is not None:
+            if i - start > best_length:
+                best_start, best_length = start, i - start
+            start = None
+    if best_length == 0:
+        i = int(np.argmin(count_change + area_change))
+        return float(thresholds[i])
+    return float(thresholds[best_start + best_length // 2])
+
 def contour_fourier_features(contour, order=10):
+    import pyefd
     coeffs = pyefd.elliptic_fourier_descriptors(contour, order=order)
     a0, c0 = pyefd.calculate_dc_coefficients(contour)
     return coeffs, a0, c0
 
-def gradient_labeling(image_path):
+# LRU cache of elliptic Fourier descriptors keyed by contour content and normalization.
+# Every entry keeps the highest order computed so far; lower orders are slices of it, since
+# the harmonics (and the normalization, which only depends on the first harmonic) of an order
+# k expansion are the first k harmonics of any higher order expansion.
+class EFDCache:
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(contour, normalize=False):
+        contour = np.ascontiguousarray(contour, dtype=np.int32)
+        return hashlib.blake2b(contour.data, digest_size=16).digest(), normalize
+
+    def get(self, key, order):
+        entry = self._entries.get(key)
+        if entry is None or entry[0].shape[0] < order:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        coeffs, a0, c0 = entry
+        return coeffs[:order], a0, c0
+
+    def put(self, key, coeffs, a0, c0):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0].shape[0] >= coeffs.shape[0]:
+            return
+        self._entries[key] = (coeffs, a0, c0)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+# Batched contour_fourier_features: elliptic Fourier descriptors of many contours at once.
+# `contours` is a ContourTable or a list of contours; returns the coefficients as an
+# (N, order, 4) array and the DC coefficients a0, c0 as (N,) arrays. With normalize=True the
+# coefficients are normalized like pyefd.normalize_efd. Results agree with
+# pyefd.elliptic_fourier_descriptors and pyefd.calculate_dc_coefficients to within 1e-9 times
+# the contour perimeter. Normalized coefficients agree to the same precision except where the
+# normalization itself is ill-defined (circular first harmonic, or a semi-major axis exactly
+# along the x-axis), where rounding noise picks one of the equivalent phases or signs.
+# Contours without a single non-zero-length segment give NaNs.
+# An EFDCache can be passed to skip contours (and orders) that have been computed before.
+def contour_fourier_features_batch(contours, order=10, normalize=False, cache=None):
+    table = contours if isinstance(contours, ContourTable) else ContourTable.from_contours(contours)
+    n = len(table)
+    if cache is None:
+        return _elliptic_fourier_descriptors(table.points, table.offsets, order, normalize)
+
+    coeffs = np.empty((n, order, 4))
+    a0 = np.empty(n)
+    c0 = np.empty(n)
+    keys = [EFDCache.key(table.contour(i), normalize) for i in range(n)]
+    missing = []
+    for i, key in enumerate(keys):
+        cached = cache.get(key, order)
+        if cached is None:
+            missing.append(i)
+        else:
+            coeffs[i], a0[i], c0[i] = cached
+    if missing:
+        subset = table.take(missing)
+        new_coeffs, new_a0, new_c0 = _elliptic_fourier_descriptors(subset.points, subset.offsets, order, normalize)
+        coeffs[missing], a0[missing], c0[missing] = new_coeffs, new_a0, new_c0
+        for j, i in enumerate(missing):
+            cache.put(keys[i], new_coeffs[j], new_a0[j], new_c0[j])
+    return coeffs, a0, c0
+
+# Upper bound on order x segments processed at once, to bound the memory of the harmonic arrays
+_EFD_CHUNK = 1 << 22
+
+def _elliptic_fourier_descriptors(points, offsets, order, normalize):
+    n = len(offsets) - 1
+    coeffs = np.full((n, order, 4), np.nan)
+    a0 = np.full(n, np.nan)
+    c0 = np.full(n, np.nan)
+    start = 0
+    while start < n:
+        # Contours [start, stop) with at most _EFD_CHUNK harmonic terms, but at least one contour
+        stop = np.searchsorted(offsets, offsets[start] + _EFD_CHUNK // order, side='right') - 1
+        stop = min(max(stop, start + 1), n)
+        chunk = slice(offsets[start], offsets[stop])
+        coeffs[start:stop], a0[start:stop], c0[start:stop] = _efd_chunk(points[chunk], offsets[start:stop + 1] - offsets[start], order)
+        start = stop
+    if normalize:
+        coeffs = _normalize_efd(coeffs)
+    return coeffs, a0, c0
+
+def _efd_chunk(points, offsets, order):
+    n = len(offsets) - 1
+    coeffs = np.full((n, order, 4), np.nan)
+    a0 = np.full(n, np.nan)
+    c0 = np.full(n, np.nan)
+    xy = points.reshape(-1, 2).astype(np.float64)
+    n_points = np.diff(offsets)
+    contour_of_point = np.repeat(np.arange(n), n_points)
+
+    # Segments of the closed contours without the zero-length ones
+    following = np.arange(1, len(xy) + 1)
+    following[offsets[1:] - 1] = offsets[:-1]
+    dxy = xy[following] - xy
+    dt = np.sqrt((dxy ** 2).sum(axis=1))
+    non_zero = dt > np.finfo(dt.dtype).eps
+    dxy, dt, segment_contour = dxy[non_zero], dt[non_zero], contour_of_point[non_zero]
+    n_segments = np.bincount(segment_contour, minlength=n)
+    valid = n_segments > 0
+    if not valid.any():
+        return coeffs, a0, c0
+    starts = np.concatenate(([0], np.cumsum(n_segments)[:-1]))[valid]
+
+    # Arc length at the end of every segment, restarted for every contour
+    cumulative = np.cumsum(dt)
+    before = np.concatenate(([0.0], cumulative))[starts]
+    t_end = cumulative - np.repeat(before, n_segments[valid])
+    t_start = t_end - dt
+    T = np.add.reduceat(dt, starts)
+    T_segment = np.repeat(T, n_segments[valid])
+
+    # Harmonics of all segments of all contours at once
+    orders = np.arange(1, order + 1)
+    consts = T[:, None] / (2 * orders * orders * np.pi * np.pi)
+    phi_end = orders[:, None] * ((2 * np.pi * t_end) / T_segment)
+    phi_start = orders[:, None] * ((2 * np.pi * t_start) / T_segment)
+    d_cos_phi = np.cos(phi_end) - np.cos(phi_start)
+    d_sin_phi = np.sin(phi_end) - np.sin(phi_start)
+    dx_dt = dxy[:, 0] / dt
+    dy_dt = dxy[:, 1] / dt
+    coeffs[valid, :, 0] = consts * np.add.reduceat(dx_dt * d_cos_phi, starts, axis=1).T
+    coeffs[valid, :, 1] = consts * np.add.reduceat(dx_dt * d_sin_phi, starts, axis=1).T
+    coeffs[valid, :, 2] = consts * np.add.reduceat(dy_dt * d_cos_phi, starts, axis=1).T
+    coeffs[valid, :, 3] = consts * np.add.reduceat(dy_dt * d_sin_phi, starts, axis=1).T
+
+    # DC coefficients, relative to the first point of every contour
+    d_t2 = t_end ** 2 - t_start ** 2
+    x_cumulative = np.cumsum(dxy[:, 0])
+    y_cumulative = np.cumsum(dxy[:, 1])
+    xi = x_cumulative - np.repeat(np.concatenate(([0.0], x_cumulative))[starts], n_segments[valid]) - dx_dt * t_end
+    delta = y_cumulative - np.repeat(np.concatenate(([0.0], y_cumulative))[starts], n_segments[valid]) - dy_dt * t_end
+    A0 = (1 / T) * np.add.reduceat((dxy[:, 0] / (2 * dt)) * d_t2 + xi * dt, starts)
+    C0 = (1 / T) * np.add.reduceat((dxy[:, 1] / (2 * dt)) * d_t2 + delta * dt, starts)
+    first = xy[offsets[:-1]][valid]
+    a0[valid] = first[:, 0] + A0
+    c0[valid] = first[:, 1] + C0
+    return coeffs, a0, c0
+
+# pyefd.normalize_efd (size invariant) for a stack of (N, order, 4) coefficient arrays
+def _normalize_efd(coeffs):
+    first = coeffs[:, 0, :]
+    theta_1 = 0.5 * np.arctan2(
+        2 * ((first[:, 0] * first[:, 1]) + (first[:, 2] * first[:, 3])),
+        (first[:, 0] ** 2) - (first[:, 1] ** 2) + (first[:, 2] ** 2) - (first[:, 3] ** 2))
+    # Rotate the n-th harmonic by n*theta_1
+    angles = np.arange(1, coeffs.shape[1] + 1)[None, :] * theta_1[:, None]
+    cos, sin = np.cos(angles), np.sin(angles)
+    theta_rotations = np.stack([np.stack([cos, -sin], axis=-1), np.stack([sin, cos], axis=-1)], axis=-2)
+    coeffs = np.matmul(coeffs.reshape(len(coeffs), -1, 2, 2), theta_rotations).reshape(coeffs.shape)
+
+    # Rotate all coefficients so that the semi-major axis is parallel to the x-axis
+    psi_1 = np.arctan2(coeffs[:, 0, 2], coeffs[:, 0, 0])
+    psi_1 = np.where(psi_1 < 0, psi_1 + np.pi, psi_1)
+    cos, sin = np.cos(psi_1), np.sin(psi_1)
+    psi_rotations = np.stack([np.stack([cos, sin], axis=-1), np.stack([-sin, cos], axis=-1)], axis=-2)
+    coeffs = np.matmul(psi_rotations[:, None], coeffs.reshape(len(coeffs), -1, 2, 2)).reshape(coeffs.shape)
+
+    # Counter-clockwise orientation and size invariance
+    first = coeffs[:, 0, :]
+    clockwise = (first[:, 0] * first[:, 3] - first[:, 1] * first[:, 2]) < 0
+    coeffs[clockwise, :, 1] *= -1
+    coeffs[clockwise, :, 3] *= -1
+    coeffs /= np.abs(coeffs[:, 0, 0])[:, None, None]
+    return coeffs
+
+def gradient_labeling(image_path, save_figures=True, dpi=300, fast_decode=False, reduce=1):
     # Load the image
-    image = cv2.imread(image_path)
+    image = load_image(image_path, fast_decode=fast_decode, reduce=reduce)
     # Crop and remove nozzle
-    x_offset = 220#580
+    x_offset = 220 // reduce#580
     y_offset = 0#485
-    cropped_image = crop_and_remove_nozzle(image.copy(), x_offset, y_offset)
+    cropped_image = crop_and_remove_nozzle(image, x_offset, y_offset)
     
     # Enhance contrast
-    image_contrast = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2GRAY)#enhance_contrast(cropped_image)#cv2.GaussianBlur(image, (5, 5), 0)#
+    image_contrast = to_gray(cropped_image)#enhance_contrast(cropped_image)#cv2.GaussianBlur(image, (5, 5), 0)#
     
     # Detect droplet boundary
     # edges = detect_droplet_boundary(image_contrast)
@@ -499,23 +1977,48 @@ def gradient_labeling(image_path):
     # threshold
     thresh = cv2.threshold(image_contrast, 50, 255, cv2.THRESH_BINARY)[1]
     
-    fig1 = plt.figure()
-    plt.imshow(thresh, cmap='gray')
-    fig1.savefig(image_path+'edges.png', dpi=300)
-    
-    sx, sy = calculate_pixel_sum(thresh)
-    grad_x, grad_y = calculate_pixel_grad(sx, sy)
-    
-    sx = sx/np.max(sx)
-    sy = sy/np.max(sy)
-    grad_x = grad_x/np.max(grad_x)
-    grad_y = grad_y/np.max(grad_y)
-        
+    grad_x, grad_y, sx, sy = gradient_profiles(thresh)
+
+    # Figures are saved next to the input file, decoded frames only return the profiles
+    if save_figures and isinstance(image_path, str):
+        plot_binary_image(image_path+'edges.png', thresh, dpi)
+        plot_gradient_profiles(image_path+'_morphology.jpg', cropped_image, grad_x, grad_y, sx, sy, dpi)
+
+    return grad_x, grad_y, sx, sy
+
+# gradient_labeling for a stack of frames (T, H, W) or (T, H, W, 3), without figures
+def gradient_labeling_batch(frames, threshold=50, x_offset=220, y_offset=0):
+    frames = np.asarray(frames)
+    if frames.ndim == 4:
+        frames = np.stack([to_gray(frame) for frame in frames])
+    cropped = frames[:, y_offset:, x_offset:]
+    thresh = np.where(cropped > threshold, np.uint8(255), np.uint8(0))
+    return gradient_profiles(thresh)
+
+# Figure of gradient_labeling with the binarized image alone, in a figure of the default size
+def plot_binary_image(filename, image, dpi=300):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.imshow(image, cmap='gray')
+    fig.savefig(filename, dpi=dpi)
+
+# Figure of gradient_labeling: the image and the sum and gradient profiles along x and y.
+# Drawn on a bare Agg canvas, so pyplot and an interactive backend are never loaded.
+def plot_gradient_profiles(filename, image, grad_x, grad_y, sx, sy, dpi=300):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
     # Create a figure with 3 subplots
-    fig, axs = plt.subplots(nrows=1, ncols=3, figsize=(12, 4))
+    fig = Figure(figsize=(12, 4))
+    FigureCanvasAgg(fig)
+    axs = fig.subplots(nrows=1, ncols=3)
 
     # Plot the image on the first subplot
-    axs[0].imshow(cropped_image, cmap='gray')
+    axs[0].imshow(image, cmap='gray')
     axs[0].set_title('Image')
     
     axs[1].plot(sx, label='Sum')
@@ -531,99 +2034,124 @@ def gradient_labeling(image_path):
     # Adjust the spacing between subplots
     fig.tight_layout()
     
-    fig.savefig(image_path+'_morphology.jpg', dpi=300)
-    # Show the figure
-    # plt.show()
-
-    return grad_x, grad_y, sx, sy
-
-def droplet_volume_estimation(img_path):
-    # Load the image
-    image = cv2.imread(img_path)
-
+    fig.savefig(filename, dpi=dpi)
+
+# Volumes of the droplets of a nozzle jet frame, as (total_volume, num_droplets, x_diameters,
+# y_diameters). y_diameters only has entries for droplets closed by empty rows on both sides; with
+# aligned=True it has one entry per droplet instead, NaN for droplets touching the crop edges, so
+# all lists line up per droplet (see droplet_columns).
+@_profiled('droplet_volume_estimation')
+def droplet_volume_estimation(img_path, aligned=False, fast_decode=False, reduce=1):
     # Crop and remove nozzle
     # x_offset = 220
     # y_offset = 0
     # cropped_image = crop_and_remove_nozzle(image.copy(), x_offset, y_offset)
-    img = image.copy()[550:1000, 251:1000]
-    img = cv2.transpose(img)
+    # Load the cropped image in grayscale
+    with _stage('droplet_volume_estimation.decode') as stage:
+        img = load_image(img_path, rows=(550, 1000), cols=(251, 1000), fast_decode=fast_decode, reduce=reduce)
+        img = cv2.transpose(img)
+        stage.count(0, img)
     
     # Enhance contrast
-    image_contrast = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+    image_contrast = to_gray(img)
     
     # image_contrast = cv2.GaussianBlur(image_contrast, (5, 5), 0)
     
-    image_contrast = process_image(image_contrast,50)
+    with _stage('droplet_volume_estimation.threshold') as stage:
+        image_contrast = process_image(image_contrast,50)
+        stage.count(0, image_contrast)
     
     # cv2.imwrite(img_path + '_processed.jpg', image_contrast)
-    # Set the threshold for intensity change to detect the droplet boundary
-    intensity_threshold = 0  # Since the image was binarized
-
-    # Initialize the total volume
-    total_volume = [0.0]
-    num_droplets = 0
-    x_diameter_max = 0.0
-    y_diameter_max = 0.0
-    x_diameters = [0.0]
-    y_diameters = []
-    y_white = []
-    
-    pixel2um = 70.0/160.0 # Assuming 70 um per 160 pixels
-    
-    # image_c = img.copy()
-    
-    # Iterate over each row in the image
-    for y in reversed(range(image_contrast.shape[0])):
-        row = image_contrast[y, :]
-        # Find indices where the intensity changes suddenly
-        change_indices = np.where((np.abs(np.diff(row))) > intensity_threshold)[0]
-        
-        if len(change_indices) == 2:
-            diameter = (change_indices[1] - change_indices[0])*pixel2um
-            # Calculate the radius (in pixels)
-            radius = diameter / 2.0
-            # Calculate the volume of the cylinder (πr²h, with h=1 pixel)
-            volume_cylinder = np.pi * (radius ** 2) * pixel2um
-            if x_diameters[-1] < diameter:
-                x_diameters[-1] = diameter
-            # Add the volume of the cylinder to the total volume
-            total_volume[-1] += volume_cylinder
-            # cv2.circle(image_c, (int(change_indices[0]), y), int(0), (0, 0, 255), thickness=-1)
-            # cv2.circle(image_c, (int(change_indices[1]), y), int(0), (0, 255, 0), thickness=-1)
-        elif len(change_indices) > 2:
-            diameter = (change_indices[-1] - change_indices[0])*pixel2um
-            radius = diameter / 2.0
-            volume_cylinder = np.pi * (radius ** 2) * pixel2um
-            total_volume[-1] += volume_cylinder
-            if x_diameters[-1] < diameter:
-                x_diameters[-1] = diameter
-            # cv2.circle(image_c, (int(change_indices[0]), y), int(0), (0, 0, 255), thickness=-1)
-            # cv2.circle(image_c, (int(change_indices[-1]), y), int(0), (0, 255, 0), thickness=-1)
-        elif len(change_indices) < 2:
-            num_droplets += 1
-            total_volume.append(0.0)
-            x_diameters.append(0.0)
-            y_white.append(y)
-            # cv2.circle(image_c, (int(0), y), int(0), (255, 0, 0), thickness=-1)
-    if len(y_white) > 0:
-        for i in range(len(y_white)-1):
-            if np.abs(y_white[i+1] - y_white[i]) > 1:
-                y_diameters.append((y_white[i+1] - y_white[i])*pixel2um)
-                
-        # y_diameter_max = np.max(np.array(y_diameters))#*pixel2um
-    # cv2.imwrite(img_path + '_indices.jpg', image_c)
-    x_diameters = [i for i in x_diameters if i != 0]
-    y_diameters = [i for i in y_diameters if i != 0]
-    total_volume = [i for i in total_volume if i != 0]
-    num_droplets = len(total_volume)
-    return  total_volume, num_droplets, x_diameters, y_diameters
-
-    
-
-def droplet_boundary(image_path, save_ellipse=False, save_contour=False):
+    pixel2um = 70.0/160.0 * reduce # Assuming 70 um per 160 full-resolution pixels
+
+    with _stage('droplet_volume_estimation.volumes'):
+        return _droplet_volumes(image_contrast[np.newaxis], pixel2um, aligned)[0]
+
+# Same as droplet_volume_estimation for a stack of grayscale frames of shape (T, H, W),
+# returns one (total_volume, num_droplets, x_diameters, y_diameters) tuple per frame
+def droplet_volume_estimation_batch(frames, threshold=50, pixel2um=70.0/160.0, aligned=False):
+    frames = np.asarray(frames)
+    if frames.ndim == 4:
+        frames = np.stack([to_gray(frame) for frame in frames])
+    # Same crop, transpose and binarization as droplet_volume_estimation
+    stack = frames[:, 550:1000, 251:1000].transpose(0, 2, 1)
+    return _droplet_volumes(stack > threshold, pixel2um, aligned)
+
+# Whole-stack implementation of the row scan of droplet_volume_estimation.
+# Rows are visited from the bottom to the top of each binarized frame; a row with at least two
+# edges adds a one pixel high cylinder between its first and last edge to the current droplet,
+# a row with fewer edges closes the current droplet and starts a new one.
+# A droplet only has a y diameter when empty rows close it on both sides, so a jet or droplet
+# touching the top or bottom of the crop has none. With aligned, the y diameters are given per
+# droplet like the volumes and x diameters, NaN where there is none.
+def _droplet_volumes(binary, pixel2um, aligned=False):
+    rows = binary[:, ::-1, :]
+    n_frames, height, width = rows.shape
+
+    # First and last edge of every row
+    changes = rows[:, :, 1:] != rows[:, :, :-1]
+    n_changes = np.count_nonzero(changes, axis=2)
+    first = np.argmax(changes, axis=2)
+    last = (width - 2) - np.argmax(changes[:, :, ::-1], axis=2)
+    filled = n_changes >= 2
+    diameter = (last - first)*pixel2um
+    radius = diameter / 2.0
+    volume_cylinder = np.where(filled, np.pi * (radius ** 2) * pixel2um, 0.0).ravel()
+    diameter = np.where(filled, diameter, 0.0).ravel()
+
+    # Every empty row opens a new segment, every frame starts with one open segment
+    empty = ~filled.ravel()
+    frame_of_row = np.repeat(np.arange(n_frames), height)
+    segment = np.cumsum(empty) + frame_of_row
+    n_segments = n_frames + np.count_nonzero(empty)
+    total_volume = np.bincount(segment, weights=volume_cylinder, minlength=n_segments)
+    x_diameters = np.zeros(n_segments)
+    present, starts = np.unique(segment, return_index=True)
+    x_diameters[present] = np.maximum.reduceat(diameter, starts)
+    empties_per_frame = np.count_nonzero(empty.reshape(n_frames, height), axis=1)
+    segment_bounds = np.concatenate(([0], np.cumsum(empties_per_frame + 1)))
+
+    # Vertical distances between consecutive empty rows of the same frame
+    empty_rows = np.flatnonzero(empty)
+    y_white = (height - 1) - (empty_rows % height)
+    y_frame = frame_of_row[empty_rows]
+    dy = np.diff(y_white)
+    keep = (np.abs(dy) > 1) & (y_frame[1:] == y_frame[:-1])
+    y_diameters = dy[keep]*pixel2um
+    y_bounds = np.searchsorted(y_frame[1:][keep], np.arange(n_frames + 1))
+
+    if aligned:
+        # A segment between two empty rows spans its filled rows and the empty row opening it,
+        # the same distance as between the empty rows. The first and last segment of a frame are open.
+        rows_per_segment = np.bincount(segment, minlength=n_segments)
+        closed = np.ones(n_segments, dtype=bool)
+        closed[segment_bounds[:-1]] = False
+        closed[segment_bounds[1:] - 1] = False
+        segment_y_diameters = np.where(closed, -rows_per_segment*pixel2um, np.nan)
+
+    results = []
+    for t in range(n_frames):
+        volumes = total_volume[segment_bounds[t]:segment_bounds[t + 1]]
+        diameters = x_diameters[segment_bounds[t]:segment_bounds[t + 1]]
+        if aligned:
+            droplets = volumes != 0
+            frame_y_diameters = segment_y_diameters[segment_bounds[t]:segment_bounds[t + 1]][droplets]
+            results.append((volumes[droplets].tolist(), int(droplets.sum()), diameters[droplets].tolist(), frame_y_diameters.tolist()))
+            continue
+        frame_y_diameters = y_diameters[y_bounds[t]:y_bounds[t + 1]]
+        volumes = volumes[volumes != 0].tolist()
+        results.append((volumes, len(volumes), diameters[diameters != 0].tolist(), frame_y_diameters[frame_y_diameters != 0].tolist()))
+    return results
+
+    
+
+@_profiled('droplet_boundary')
+def droplet_boundary(image_path, save_ellipse=False, save_contour=False, fast_decode=False, reduce=1):
 
     # Load the image
-    image = cv2.imread(image_path)
+    with _stage('droplet_boundary.decode') as stage:
+        image = load_image(image_path, fast_decode=fast_decode, reduce=reduce)
+        stage.count(0, image)
     
     
     # edges = process_image(image)
@@ -636,18 +2164,20 @@ def droplet_boundary(image_path, save_ellipse=False, save_contour=False):
     # thresh = process_image(ft_image)
     
     # Crop and remove nozzle
-    x_offset = 220#580
+    x_offset = 220 // reduce#580
     y_offset = 0#485
-    cropped_image = crop_and_remove_nozzle(image.copy(), x_offset, y_offset)
+    cropped_image = crop_and_remove_nozzle(image, x_offset, y_offset)
     
     # Enhance contrast
-    image_contrast = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2GRAY)#enhance_contrast(cropped_image)#cv2.GaussianBlur(image, (5, 5), 0)#
+    image_contrast = to_gray(cropped_image)#enhance_contrast(cropped_image)#cv2.GaussianBlur(image, (5, 5), 0)#
 
     
     
     # Detect droplet boundary
     # edges = detect_droplet_boundary(image_contrast)
-    edges = process_image(image_contrast)
+    with _stage('droplet_boundary.threshold') as stage:
+        edges = process_image(image_contrast)
+        stage.count(0, edges)
     
     # measure_nozzle_diameter(edges)
 
@@ -706,4 +2236,1751 @@ def droplet_boundary(image_path, save_ellipse=False, save_contour=False):
     
     return ellipses_with_offset, n
 
+# Preprocessing of a stream of frames, configured once: crop (rows crop_x_lim, columns crop_y_lim,
+# as in contour_finder, None keeps the whole frame), CLAHE (clipLimit=None skips it), threshold and
+# maxval. The CLAHE object and the gray, contrast and binary images of the current frame shape are
+# kept, and every stage writes into them through dst=, so after the first frame of a shape no
+# image-sized buffer is allocated (decoding a path still allocates the decoded frame). gray(),
+# enhance() and binarize() return these buffers, or a view of the frame where no conversion is
+# needed; the next frame overwrites them. Instances are not thread-safe, use one per thread.
+#   contour_finder    - the results of contour_finder with these parameters
+#   droplet_boundary  - ellipses and count of droplet_boundary, centers in frame coordinates
+#   gradient_labeling - gradient profiles of the binarized frame, without figures
+# for_droplet_boundary() and for_gradient_labeling() are configured like those functions.
+class Preprocessor:
+    def __init__(self, crop_x_lim=(400,1100), crop_y_lim=(230,1660), clipLimit=2.0, tileGridSize=(8, 8), threshold=50, binarization_max_val=255):
+        self.crop_x_lim = crop_x_lim
+        self.crop_y_lim = crop_y_lim
+        self.clipLimit = clipLimit
+        self.tileGridSize = tileGridSize
+        self.threshold = threshold
+        self.binarization_max_val = binarization_max_val
+        self.clahe = None if clipLimit is None else cv2.createCLAHE(clipLimit=clipLimit, tileGridSize=tileGridSize)
+        self.shape = None
+
+    @classmethod
+    def for_droplet_boundary(cls):
+        return cls(crop_x_lim=None, crop_y_lim=(220, None), clipLimit=None, threshold=100)
+
+    @classmethod
+    def for_gradient_labeling(cls):
+        return cls(crop_x_lim=None, crop_y_lim=(220, None), clipLimit=None, threshold=50)
+
+    def _buffers(self, shape):
+        if shape != self.shape:
+            self._gray = np.empty(shape, dtype=np.uint8)
+            self._contrast = np.empty(shape, dtype=np.uint8)
+            self._binary = np.empty(shape, dtype=np.uint8)
+            self.shape = shape
+
+    # Region of interest in grayscale, color frames and files are converted into the gray buffer
+    def gray(self, image):
+        with _stage('preprocessor.gray') as stage:
+            roi = load_image(image, rows=self.crop_x_lim, cols=self.crop_y_lim, grayscale=False)
+            self._buffers(roi.shape[:2])
+            if roi.ndim == 3:
+                roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            stage.count(0, roi)
+        return roi
+
+    def enhance(self, image):
+        gray = self.gray(image)
+        if self.clahe is None:
+            return gray
+        with _stage('preprocessor.clahe') as stage:
+            contrast = self.clahe.apply(gray, dst=self._contrast)
+            stage.count(0, contrast)
+        return contrast
+
+    def binarize(self, image):
+        return self._threshold(self.enhance(image))
+
+    def _threshold(self, contrast):
+        with _stage('preprocessor.threshold') as stage:
+            binary = cv2.threshold(contrast, self.threshold, self.binarization_max_val, cv2.THRESH_BINARY, dst=self._binary)[1]
+            stage.count(0, binary)
+        return binary
+
+    # Origin (x, y) of the region of interest in the frame
+    def _origin(self):
+        return tuple(0 if limits is None or limits[0] is None else limits[0] for limits in (self.crop_y_lim, self.crop_x_lim))
+
+    @_profiled('preprocessor.contour_finder')
+    def contour_finder(self, image, droplet_hierarchy_check=False, return_table=False, gradient_check=False):
+        contrast = self.enhance(image)
+        table, hierarchy = _contour_stage(self._threshold(contrast), droplet_hierarchy_check, contrast if gradient_check else None)
+        if return_table:
+            return table, hierarchy
+        contours, contours_area, contour_centroids = table.to_lists()
+        return contours, contours_area, contour_centroids, hierarchy
+
+    @_profiled('preprocessor.droplet_boundary')
+    def droplet_boundary(self, image):
+        contours, hierarchy, ellipses, n = measure_droplet_properties(self.binarize(image))
+        x_offset, y_offset = self._origin()
+        return [((center[0] + x_offset, center[1] + y_offset), axes, angle) for center, axes, angle in ellipses or []], n
+
+    def gradient_labeling(self, image):
+        return gradient_profiles(self.binarize(image))
+
+# Tiled processing of images too large to be processed whole, such as stitched mosaics. The image
+# is read through a view: a decoded array, a np.memmap or a .npy file, which is memory-mapped
+# (other files are decoded to grayscale once). It is cut into tiles of tile_size pixels and every
+# tile is binarized and contoured in a window that reaches `overlap` pixels into its neighbours,
+# so only the windows in flight and their intermediates are in memory.
+# A contour that does not touch an inner edge of its window is complete and identical to the one
+# of a whole-image run. Complete contours are merged by the pixel where findContours found them
+# and put in the order findContours lists them. A foreground region or hole that is still cut in
+# the tile holding its first pixel, i.e. one larger than the overlap, is traced again in a window
+# grown around it, up to max_window pixels a side. Contours larger than that are left out with a
+# RuntimeWarning, their children have no parent.
+
+# Image of a tiled entry point: arrays (and memmaps) as they are, .npy files memory-mapped
+def _open_large_image(image):
+    if isinstance(image, np.ndarray):
+        return image
+    if image.lower().endswith('.npy'):
+        return np.load(image, mmap_mode='r')
+    return load_image(image)
+
+def _crop_slice(limits):
+    return slice(None) if limits is None else slice(*limits)
+
+# Rows or columns start:stop of an image of the given size, with the BORDER_REFLECT_101 border
+# OpenCV adds past its end
+def _reflect_101(start, stop, size):
+    if stop <= size:
+        return slice(start, stop)
+    index = np.arange(start, stop)
+    return np.clip(np.where(index < size, index, 2*(size - 1) - index), 0, size - 1)
+
+# CLAHE of a whole image, evaluated window by window. The clipped histograms and lookup tables of
+# the tileGridSize grid are computed once, cell by cell, the way cv2.createCLAHE computes them
+# (including the reflected border it adds when the image does not divide into the grid), and
+# apply() interpolates them for any window, so every window equals the same region of the
+# whole-image CLAHE.
+class _TiledCLAHE:
+    def __init__(self, image, clipLimit=2.0, tileGridSize=(8, 8)):
+        self.image = image
+        height, width = image.shape[:2]
+        nx, ny = tileGridSize
+        if width % nx or height % ny:
+            # OpenCV pads both sides as soon as one of them does not divide
+            height, width = height + ny - height % ny, width + nx - width % nx
+        self.tile = (height // ny, width // nx)
+        total = self.tile[0] * self.tile[1]
+        limit = max(int(clipLimit * total / 256), 1) if clipLimit > 0 else 0
+        scale = np.float32(255) / np.float32(total)
+        hist = np.empty((ny, nx, 256), dtype=np.int64)
+        for j in range(ny):
+            rows = _reflect_101(j * self.tile[0], (j + 1) * self.tile[0], image.shape[0])
+            band = image[rows]
+            for i in range(nx):
+                cell = to_gray(band[:, _reflect_101(i * self.tile[1], (i + 1) * self.tile[1], image.shape[1])])
+                hist[j, i] = cv2.calcHist([cell], [0], None, [256], [0, 256]).ravel()
+        if limit:
+            # Clip every histogram and spread the excess over all bins, the remainder every step-th bin
+            clipped = np.maximum(hist - limit, 0).sum(axis=2, keepdims=True)
+            np.minimum(hist, limit, out=hist)
+            batch, residual = np.divmod(clipped, 256)
+            hist += batch
+            step = np.maximum(256 // np.maximum(residual, 1), 1)
+            bins = np.arange(256)
+            hist += (bins % step == 0) & (bins // step < residual)
+        self.luts = np.rint(np.cumsum(hist, axis=2).astype(np.float32) * scale).clip(0, 255).astype(np.uint8)
+
+    # Interpolation weights along one axis, in float32 like OpenCV, and the runs of positions
+    # that interpolate between the same two grid cells
+    def _weights(self, start, stop, tile, count):
+        position = np.arange(start, stop, dtype=np.float32) * (np.float32(1) / np.float32(tile)) - np.float32(0.5)
+        first = np.floor(position)
+        weight = position - first
+        first = first.astype(np.int64)
+        runs = np.flatnonzero(np.diff(first)) + 1
+        bounds = np.concatenate(([0], runs, [len(first)])).tolist()
+        cells = [(max(first[b], 0), min(first[b] + 1, count - 1)) for b in bounds[:-1]]
+        return list(zip(bounds[:-1], bounds[1:], cells)), weight, np.float32(1) - weight
+
+    # CLAHE of the rows r0:r1 and columns c0:c1 of the image. Every block of pixels between the
+    # same four grid cells goes through their lookup tables with cv2.LUT and is blended in float32.
+    def apply(self, r0, r1, c0, c1):
+        out = np.empty((r1 - r0, c1 - c0), dtype=np.uint8)
+        ny, nx = self.luts.shape[:2]
+        gray = to_gray(self.image[r0:r1, c0:c1])
+        row_runs, ya, ya1 = self._weights(r0, r1, self.tile[0], ny)
+        col_runs, xa, xa1 = self._weights(c0, c1, self.tile[1], nx)
+        ya, ya1 = ya[:, None], ya1[:, None]
+        for top, bottom, (y1, y2) in row_runs:
+            for left, right, (x1, x2) in col_runs:
+                block = gray[top:bottom, left:right]
+                wx, wx1 = xa[left:right], xa1[left:right]
+                # (lut11*wx1 + lut12*wx)*wy1 + (lut21*wx1 + lut22*wx)*wy, in OpenCV's order of operations
+                res = self._blend(block, self.luts[y1, x1], self.luts[y1, x2], wx1, wx)
+                res *= ya1[top:bottom]
+                lower = self._blend(block, self.luts[y2, x1], self.luts[y2, x2], wx1, wx)
+                lower *= ya[top:bottom]
+                res += lower
+                np.copyto(out[top:bottom, left:right], np.rint(res, out=res), casting='unsafe')
+        return out
+
+    @staticmethod
+    def _blend(block, lut1, lut2, w1, w2):
+        res = cv2.LUT(block, lut1).astype(np.float32)
+        res *= w1
+        other = cv2.LUT(block, lut2).astype(np.float32)
+        other *= w2
+        res += other
+        return res
+
+    # Pixels of the enhanced image at the given (rows, cols) index arrays, which broadcast like
+    # numpy indices, with the same values apply() computes for them
+    def __getitem__(self, index):
+        rows, cols = (np.asarray(i, dtype=np.int64) for i in index)
+        gray = self.image[rows, cols]
+        if gray.ndim > max(rows.ndim, cols.ndim):
+            gray = to_gray(gray.reshape(-1, 1, gray.shape[-1])).reshape(gray.shape[:-1])
+        ny, nx = self.luts.shape[:2]
+        (y1, y2), ya, ya1 = self._cells(rows, self.tile[0], ny)
+        (x1, x2), xa, xa1 = self._cells(cols, self.tile[1], nx)
+        res = (self.luts[y1, x1, gray].astype(np.float32) * xa1 + self.luts[y1, x2, gray].astype(np.float32) * xa) * ya1
+        res += (self.luts[y2, x1, gray].astype(np.float32) * xa1 + self.luts[y2, x2, gray].astype(np.float32) * xa) * ya
+        return np.rint(res).astype(np.uint8)
+
+    # The two grid cells every position interpolates between and the weights of the second and the first
+    @staticmethod
+    def _cells(position, tile, count):
+        position = position.astype(np.float32) * (np.float32(1) / np.float32(tile)) - np.float32(0.5)
+        first = np.floor(position)
+        weight = position - first
+        first = first.astype(np.int64)
+        return (np.maximum(first, 0), np.minimum(first + 1, count - 1)), weight, np.float32(1) - weight
+
+# Contours of one window (r0, r1, c0, c1) of an image of the given shape, in image coordinates.
+# Returns the complete contours, their start keys (y*width + x), the keys of their parents (-1 when
+# the parent is not complete in this window) and the values of `measure` for them, plus the first
+# pixels (x, y) and bounding boxes (x0, y0, x1, y1) of the regions cut by an inner window edge:
+# outer contours and holes.
+def _window_contours(binarize, window, shape, measure):
+    r0, r1, c0, c1 = window
+    with _stage('tiled.window') as stage:
+        binary, image = binarize(r0, r1, c0, c1)
+        contours, hierarchy = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=(c0, r0))
+        # Start points of the uncompressed contours, the pixels where findContours found them
+        traced = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE, offset=(c0, r0))[0]
+        # Holes cut by an inner edge are open to the outside of the window. A foreground frame
+        # along the inner edges closes them and they come out as holes touching the frame.
+        framed = cv2.copyMakeBorder(binary, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+        framed[0, :] = 255 if r0 > 0 else 0
+        framed[-1, :] = 255 if r1 < shape[0] else 0
+        framed[:, 0] = 255 if c0 > 0 else 0
+        framed[:, -1] = 255 if c1 < shape[1] else 0
+        holes, hole_hierarchy = cv2.findContours(framed, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_NONE, offset=(c0 - 1, r0 - 1))
+        stage.count(len(contours), binary, contours)
+    inner = lambda box: (((box[:, 0] <= c0) & (c0 > 0)) | ((box[:, 1] <= r0) & (r0 > 0)) |
+                         ((box[:, 2] >= c1 - 1) & (c1 < shape[1])) | ((box[:, 3] >= r1 - 1) & (r1 < shape[0])))
+
+    # Holes touching the frame, from their first pixel (right of the point where they were found)
+    holes = ContourTable.from_contours(holes)
+    hole_box = np.column_stack([holes.bbox[:, :2], holes.bbox[:, :2] + holes.bbox[:, 2:] - 1])
+    cut_holes = np.zeros(0, dtype=np.int64) if hole_hierarchy is None else np.flatnonzero((hole_hierarchy[0, :, 3] >= 0) & inner(hole_box))
+    hole_starts = holes.points[holes.offsets[:-1][cut_holes], 0].astype(np.int64) + (1, 0)
+    hole_box = hole_box[cut_holes]
+
+    table = ContourTable.from_contours(contours)
+    no_keys = np.zeros(0, dtype=np.int64)
+    if len(table) == 0:
+        return table, no_keys, no_keys, None, hole_starts, hole_box
+    box = np.column_stack([table.bbox[:, :2], table.bbox[:, :2] + table.bbox[:, 2:] - 1])
+    cut = inner(box)
+    starts = np.array([contour[0, 0] for contour in traced], dtype=np.int64)
+    keys = starts[:, 1] * shape[1] + starts[:, 0]
+    parent = hierarchy[0, :, 3]
+    parent_keys = np.where((parent >= 0) & ~cut[parent], keys[parent], -1)
+    complete = np.flatnonzero(~cut)
+    table = table.take(complete)
+    values = None if measure is None else measure(table, image, (c0, r0))
+    return table, keys[complete], parent_keys[complete], values, np.concatenate([starts[cut], hole_starts]), np.concatenate([box[cut], hole_box])
+
+# Contours of the tile with the core rows r0:r1 and columns c0:c1, traced in its window and, while
+# regions whose first pixel is in the core are cut, in windows grown around them
+def _tile_contours(binarize, core, shape, overlap, max_window, measure):
+    r0, r1, c0, c1 = core
+    window = (max(r0 - overlap, 0), min(r1 + overlap, shape[0]), max(c0 - overlap, 0), min(c1 + overlap, shape[1]))
+    margin = max(overlap, 1)
+    found = []
+    while True:
+        table, keys, parent_keys, values, cut_starts, cut_boxes = _window_contours(binarize, window, shape, measure)
+        found.append((table, keys, parent_keys, values))
+        owned = (cut_starts[:, 0] >= c0) & (cut_starts[:, 0] < c1) & (cut_starts[:, 1] >= r0) & (cut_starts[:, 1] < r1)
+        if not owned.any():
+            return found
+        x0, y0 = (cut_boxes[owned, :2].min(axis=0) - margin).tolist()
+        x1, y1 = (cut_boxes[owned, 2:].max(axis=0) + margin + 1).tolist()
+        grown = (max(min(window[0], y0), 0), min(max(window[1], y1), shape[0]), max(min(window[2], x0), 0), min(max(window[3], x1), shape[1]))
+        if grown[1] - grown[0] > max_window or grown[3] - grown[2] > max_window:
+            warnings.warn(f"{int(owned.sum())} contours of the tile at rows {r0}:{r1}, columns {c0}:{c1} are larger than max_window={max_window} pixels and were left out", RuntimeWarning)
+            return found
+        if grown == window:
+            return found
+        window = grown
+        margin *= 2
+
+# Order in which findContours(RETR_TREE) lists contours with the given start keys and parent keys:
+# depth first, children after their parent and later-found siblings first. Contours whose parent is
+# unknown are siblings at the top. Returns the order and the (1, n, 4) hierarchy in that order.
+def _contour_tree(keys, parent_keys):
+    n = len(keys)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((1, 0, 4), dtype=np.int32)
+    by_key = np.argsort(keys)
+    position = np.clip(np.searchsorted(keys[by_key], parent_keys), 0, n - 1)
+    parent = np.where((parent_keys >= 0) & (keys[by_key[position]] == parent_keys), by_key[position], -1)
+    siblings = np.lexsort((-keys, parent))
+    group = parent[siblings]
+    bounds = np.searchsorted(group, np.arange(-1, n + 1))
+    order = []
+    stack = siblings[bounds[0]:bounds[1]][::-1].tolist()
+    while stack:
+        i = stack.pop()
+        order.append(i)
+        stack.extend(siblings[bounds[i + 1]:bounds[i + 2]][::-1].tolist())
+    order = np.array(order, dtype=np.int64)
+
+    # Hierarchy rows [next, previous, first child, parent], as positions in the order
+    rank = np.full(n + 1, -1, dtype=np.int64)
+    rank[order] = np.arange(n)
+    same = np.append(group[1:] == group[:-1], False)
+    next_sibling = np.full(n, -1, dtype=np.int64)
+    previous_sibling = np.full(n, -1, dtype=np.int64)
+    next_sibling[siblings[same]] = siblings[1:][same[:-1]]
+    previous_sibling[siblings[1:][same[:-1]]] = siblings[same]
+    first_child = np.full(n, -1, dtype=np.int64)
+    has_children = bounds[2:] > bounds[1:-1]
+    first_child[has_children] = siblings[bounds[1:-1][has_children]]
+    hierarchy = np.stack([rank[next_sibling], rank[previous_sibling], rank[first_child], rank[parent]], axis=1)[order]
+    return order, hierarchy[np.newaxis].astype(np.int32)
+
+# Windows (r0, r1, c0, c1) clipped to an image of the given shape, and the ones that overlap or
+# touch merged into their bounding box until none do
+def _merged_windows(windows, shape):
+    windows = np.clip(windows, 0, [shape[0], shape[0], shape[1], shape[1]])
+    while True:
+        r0, r1, c0, c1 = windows.T
+        meet = (r0[:, None] <= r1) & (r0 <= r1[:, None]) & (c0[:, None] <= c1) & (c0 <= c1[:, None])
+        # Lowest index of the windows each one is connected to
+        label = np.arange(len(windows))
+        while True:
+            lowest = np.where(meet, label, len(windows)).min(axis=1, initial=len(windows))
+            if np.array_equal(lowest, label):
+                break
+            label = lowest
+        groups, group = np.unique(label, return_inverse=True)
+        if len(groups) == len(windows):
+            return windows
+        merged = np.column_stack([np.full(len(groups), np.iinfo(np.int64).max), np.zeros(len(groups), dtype=np.int64)] * 2)
+        np.minimum.at(merged[:, 0], group, r0)
+        np.maximum.at(merged[:, 1], group, r1)
+        np.minimum.at(merged[:, 2], group, c0)
+        np.maximum.at(merged[:, 3], group, c1)
+        windows = merged
+
+# Positions (x, y) of rectangles of the given (rows, cols) sizes packed in shelves, tallest first,
+# one pixel apart and from the edges, in a mosaic about `width` pixels wide, and the mosaic shape
+def _shelf_layout(size, width):
+    shelf_width = max(width, int(size[:, 1].max(initial=0))) + 2
+    place = np.zeros((len(size), 2), dtype=np.int64)
+    x, y, shelf = 1, 1, 0
+    for i in np.argsort(-size[:, 0], kind='stable').tolist():
+        rows, cols = size[i].tolist()
+        if x + cols + 1 > shelf_width:
+            x, y, shelf = 1, y + shelf + 1, 0
+        place[i] = x, y
+        x += cols + 1
+        shelf = max(shelf, rows)
+    return place, (y + shelf + 1, shelf_width)
+
+# Complete contours of a whole image of the given shape, traced tile by tile on `workers` threads.
+# binarize(r0, r1, c0, c1) returns the binary image of a window and an image passed to
+# measure(table, image, offset), whose per-contour values are returned with the contours.
+# Returns a ContourTable in findContours order, its hierarchy and the measured values.
+def _stitched_contours(shape, binarize, tile_size=2048, overlap=256, workers=1, max_window=None, measure=None):
+    if max_window is None:
+        max_window = 2 * tile_size
+    cores = [(r, min(r + tile_size, shape[0]), c, min(c + tile_size, shape[1]))
+             for r in range(0, shape[0], tile_size) for c in range(0, shape[1], tile_size)]
+    tile = lambda core: _tile_contours(binarize, core, shape, overlap, max_window, measure)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            found = [window for windows in executor.map(tile, cores) for window in windows]
+    else:
+        found = [window for core in cores for window in tile(core)]
+
+    with _stage('tiled.merge') as stage:
+        table = ContourTable.concat(window[0] for window in found)
+        keys = np.concatenate([window[1] for window in found])
+        parent_keys = np.concatenate([window[2] for window in found])
+        values = None if measure is None else np.concatenate([window[3] for window in found if window[3] is not None] or [np.zeros(0)])
+        # One instance per start point, preferably one whose parent is known
+        candidates = np.lexsort((parent_keys < 0, keys))
+        unique = np.ones(len(candidates), dtype=bool)
+        unique[1:] = keys[candidates[1:]] != keys[candidates[:-1]]
+        candidates = candidates[unique]
+        order, hierarchy = _contour_tree(keys[candidates], parent_keys[candidates])
+        picked = candidates[order]
+        table = table.take(picked)
+        table.index = np.arange(len(table))
+        stage.count(len(table), table.points, hierarchy)
+    if len(table) == 0:
+        hierarchy = None
+    return table, hierarchy, None if values is None else values[picked]
+
+# contour_finder for images too large to be processed whole, see the tiled processing notes above.
+# The CLAHE lookup tables are computed for the whole cropped image in one pass over it, then every
+# window is enhanced, binarized and contoured on its own. The contours, areas and centroids are the
+# ones of contour_finder on the same image and parameters, with ties in area in the same order.
+# The hierarchy covers the stitched contours.
+@_profiled('contour_finder_tiled')
+def contour_finder_tiled(image_path, tile_size=2048, overlap=256, workers=1, max_window=None, crop_x_lim=(400,1100), crop_y_lim=(230,1660), clipLimit=2.0, tileGridSize=(8, 8), threshold=50, binarization_max_val=255, droplet_hierarchy_check=False, return_table=False, gradient_check=False):
+    image = _open_large_image(image_path)
+    roi = image[_crop_slice(crop_x_lim), _crop_slice(crop_y_lim)]
+    with _stage('contour_finder_tiled.clahe_tables'):
+        clahe = _TiledCLAHE(roi, clipLimit, tileGridSize)
+
+    def binarize(r0, r1, c0, c1):
+        image_contrast = clahe.apply(r0, r1, c0, c1)
+        thresh = cv2.threshold(src=image_contrast, thresh=threshold, maxval=binarization_max_val, type=cv2.THRESH_BINARY)[1]
+        return thresh, image_contrast
+
+    measure = (lambda table, image_contrast, offset: check_gradient_batch(image_contrast, table, offset)) if gradient_check else None
+    table, hierarchy, darker = _stitched_contours(roi.shape[:2], binarize, tile_size, overlap, workers, max_window, measure)
+    keep = _droplet_contours(table, hierarchy, droplet_hierarchy_check)
+    if gradient_check:
+        keep &= darker
+    table = table.filter(keep).sort_by_area()
+    if return_table:
+        return table, hierarchy
+    contours, contours_area, contour_centroids = table.to_lists()
+    return contours, contours_area, contour_centroids, hierarchy
+
+# droplet_boundary for images too large to be processed whole, see the tiled processing notes
+# above. Returns the same ellipses, in the same order, and droplet count as droplet_boundary.
+@_profiled('droplet_boundary_tiled')
+def droplet_boundary_tiled(image_path, tile_size=2048, overlap=256, workers=1, max_window=None):
+    image = _open_large_image(image_path)
+    x_offset = 220
+    y_offset = 0
+    cropped_image = crop_and_remove_nozzle(image, x_offset, y_offset)
+
+    def binarize(r0, r1, c0, c1):
+        return process_image(to_gray(cropped_image[r0:r1, c0:c1])), None
+
+    table, hierarchy, _ = _stitched_contours(cropped_image.shape[:2], binarize, tile_size, overlap, workers, max_window)
+    if len(table) == 0:
+        return [], 0
+    ellipses, n = _droplet_ellipses(table.contours(), hierarchy, cropped_image.shape[:2])
+    return [((cx + x_offset, cy + y_offset), axes, angle) for (cx, cy), axes, angle in ellipses], n
+
+# Coarse-to-fine detection for large, mostly empty frames. The frame is reduced to the means of
+# blocks of factor x factor pixels (cv2.INTER_AREA) and thresholded with the bounds of the CLAHE
+# lookup tables: the tables never decrease, so a gray value above the highest one that any of the
+# (up to four) tables a block blends maps to `threshold` is foreground. The other blocks may hold
+# droplets. Their connected groups are contoured at this resolution and their bounding boxes,
+# grown by pad pixels, are the windows refined at full resolution: enhanced with the lookup
+# tables of the whole frame (_TiledCLAHE), binarized and traced at once in a mosaic. Every window
+# is framed with foreground along its inner edges, one pixel apart from the others. A contour that
+# does not reach the frame is the one contour_finder finds, a hole that does is a droplet cut by
+# its window, which then grows around it. So every droplet that brings the mean of a block down to
+# the threshold, as all droplets covering a whole block do, comes out with the contour, area and
+# centroid of contour_finder. Droplets less than about 2*factor pixels across can be missed, and
+# so can anything outside the windows. Groups larger than max_window pixels a side, such as the
+# background and a jet, are left out. When the windows would cover more than half of the frame,
+# the whole frame is enhanced and traced as in contour_finder.
+
+# Lowest (reduce=np.minimum) or highest (np.maximum) value of `values` over the index ranges
+# low:high+1 along an axis
+def _range_reduce(values, low, high, reduce, axis):
+    out = np.take(values, low, axis=axis)
+    for step in range(1, int((high - low).max(initial=0)) + 1):
+        out = reduce(out, np.take(values, np.minimum(low + step, high), axis=axis))
+    return out
+
+# Range of grid cells the pixels of every block of `block` pixels along one axis interpolate between
+def _block_cells(size, block, tile, count):
+    (first, last), _, _ = _TiledCLAHE._cells(np.arange(size), tile, count)
+    starts = np.arange(0, size, block)
+    return np.minimum.reduceat(first, starts), np.maximum.reduceat(last, starts)
+
+# Windows (r0, r1, c0, c1) around the groups of blocks of factor pixels of a gray image that may
+# be binarized to background, with the lookup tables of `clahe`, grown by pad pixels. Groups
+# larger than max_window pixels a side are left out.
+def _pyramid_windows(clahe, gray, factor, threshold, pad, max_window):
+    height, width = gray.shape
+    rows, cols = height // factor, width // factor
+    # Halving by INTER_AREA has a fast path, the block means are means of means
+    reduced, step = gray[:rows * factor, :cols * factor], factor
+    while step % 2 == 0:
+        reduced, step = cv2.resize(reduced, (reduced.shape[1] // 2, reduced.shape[0] // 2), interpolation=cv2.INTER_AREA), step // 2
+    if step > 1:
+        reduced = cv2.resize(reduced, (cols, rows), interpolation=cv2.INTER_AREA)
+    # Highest gray value every lookup table maps to `threshold` or below (-1 if there is none)
+    ny, nx = clahe.luts.shape[:2]
+    below = ((clahe.luts <= threshold).sum(axis=2) - 1).astype(np.int16)
+    highest = _range_reduce(below, *_block_cells(width, factor, clahe.tile[1], nx), np.maximum, 1)
+    highest = _range_reduce(highest, *_block_cells(height, factor, clahe.tile[0], ny), np.maximum, 0)
+    candidates = (reduced <= highest[:rows, :cols]).view(np.uint8)
+    groups = cv2.findContours(candidates, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+    x, y, w, h = ContourTable.from_contours(groups).bbox.T.astype(np.int64) * factor
+    small = (w <= max_window) & (h <= max_window)
+    windows = np.column_stack([y - pad, y + h + pad, x - pad, x + w + pad])[small]
+    return _merged_windows(windows, (height, width))
+
+# Contours of the windows (r0, r1, c0, c1) of an image enhanced with `clahe` and binarized, traced
+# at once in a mosaic of the windows, each framed with foreground along its inner edges. Returns
+# the contours that do not reach the frame as a ContourTable, the positions of their parents
+# among them (-1 for none) and their windows, and the bounding boxes (r0, r1, c0, c1) of the holes
+# that do.
+def _framed_contours(clahe, windows, shape, threshold, binarization_max_val):
+    size = windows[:, [1, 3]] - windows[:, [0, 2]]
+    place, mosaic_shape = _shelf_layout(size + 2, shape[1])
+    mosaic = np.zeros(mosaic_shape, dtype=np.uint8)
+    for (r0, r1, c0, c1), (px, py) in zip(windows.tolist(), place.tolist()):
+        framed = mosaic[py:py + r1 - r0 + 2, px:px + c1 - c0 + 2]
+        framed[1:-1, 1:-1] = cv2.threshold(clahe.apply(r0, r1, c0, c1), threshold, binarization_max_val, cv2.THRESH_BINARY)[1]
+        framed[0, :] = 255 if r0 > 0 else 0
+        framed[-1, :] = 255 if r1 < shape[0] else 0
+        framed[:, 0] = 255 if c0 > 0 else 0
+        framed[:, -1] = 255 if c1 < shape[1] else 0
+    contours, hierarchy = cv2.findContours(mosaic, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if len(contours) == 0:
+        return ContourTable.from_contours([]), np.zeros(0, dtype=np.int64), windows[:0], windows[:0]
+
+    # Back to image coordinates, by the window every contour lies in
+    points, offsets = pack_contours(contours)
+    first = points[offsets[:-1], 0]
+    window = np.argmax((place[None, :, 0] <= first[:, None, 0]) & (first[:, None, 0] < place[None, :, 0] + size[None, :, 1] + 2) &
+                       (place[None, :, 1] <= first[:, None, 1]) & (first[:, None, 1] < place[None, :, 1] + size[None, :, 0] + 2), axis=1)
+    shift = (windows[:, [2, 0]] - place - 1)[window]
+    table = ContourTable(points + np.repeat(shift, np.diff(offsets), axis=0)[:, None, :].astype(np.int32), offsets)
+    r0, r1, c0, c1 = windows[window].T
+    x0, y0 = table.bbox[:, 0], table.bbox[:, 1]
+    x1, y1 = x0 + table.bbox[:, 2], y0 + table.bbox[:, 3]
+    framed = (x0 < c0) | (y0 < r0) | (x1 > c1) | (y1 > r1)
+
+    links = ContourHierarchy(hierarchy)
+    holes = np.flatnonzero(framed & (links.depth % 2 == 1))
+    cut = np.column_stack([y0, y1, x0, x1])[holes]
+    complete = np.flatnonzero(~framed)
+    position = np.full(len(table), -1, dtype=np.int64)
+    position[complete] = np.arange(len(complete))
+    parent = np.where(links.parent[complete] >= 0, position[links.parent[complete]], -1)
+    return table.take(complete), parent, windows[window[complete]], cut
+
+# Contours of the windows of _pyramid_windows, grown until no droplet is cut by one, in an order
+# and hierarchy of the findContours kind. None when the windows would cover more than half of the
+# image.
+def _pyramid_contours(clahe, windows, shape, threshold, binarization_max_val, pad, max_window):
+    found = []
+    done = set()
+    while True:
+        if int(np.prod(windows[:, [1, 3]] - windows[:, [0, 2]], axis=1).sum()) > shape[0] * shape[1] / 2:
+            return None
+        pending = np.array([tuple(window) not in done for window in windows.tolist()], dtype=bool)
+        if not pending.any():
+            break
+        table, parent, table_windows, cut = _framed_contours(clahe, windows[pending], shape, threshold, binarization_max_val)
+        found.append((table, parent, table_windows))
+        done.update(map(tuple, windows[pending].tolist()))
+        small = (cut[:, 1] - cut[:, 0] <= max_window) & (cut[:, 3] - cut[:, 2] <= max_window)
+        windows = _merged_windows(np.concatenate([windows, cut[small] + [-pad, pad, -pad, pad]]), shape)
+
+    # Contours of the final windows only, their parents are in the same window
+    final = set(map(tuple, windows.tolist()))
+    tables, parents = [], []
+    base = 0
+    for table, parent, table_windows in found:
+        rows = np.flatnonzero([tuple(window) in final for window in table_windows.tolist()])
+        position = np.full(len(table), -1, dtype=np.int64)
+        position[rows] = base + np.arange(len(rows))
+        tables.append(table.take(rows))
+        parents.append(np.where(parent[rows] >= 0, position[parent[rows]], -1))
+        base += len(rows)
+    table = ContourTable.concat(tables)
+    parent = np.concatenate(parents) if parents else np.zeros(0, dtype=np.int64)
+    # Keys that fall with the position keep the mosaic order among siblings
+    keys = len(table) - np.arange(len(table))
+    order, hierarchy = _contour_tree(keys, np.where(parent >= 0, keys[np.maximum(parent, 0)], -1))
+    table = table.take(order)
+    table.index = np.arange(len(table))
+    return table, hierarchy if len(table) else None
+
+# contour_finder for large, mostly empty frames, see the coarse-to-fine notes above. Returns the
+# contours, areas and centroids of contour_finder for the droplets it finds, and the hierarchy of
+# all contours traced in the windows; fit_ellipses on the returned table gives their ellipses.
+# factor is the block size in pixels: larger blocks make the coarse pass cheaper but miss larger
+# droplets. pad (default 2*factor) is the margin of the windows around the coarse droplets.
+@_profiled('contour_finder_pyramid')
+def contour_finder_pyramid(image_path, factor=4, pad=None, max_window=512, crop_x_lim=(400,1100), crop_y_lim=(230,1660), clipLimit=2.0, tileGridSize=(8, 8), threshold=50, binarization_max_val=255, droplet_hierarchy_check=False, return_table=False, gradient_check=False):
+    if pad is None:
+        pad = 2 * factor
+    cropped_image = _decode_stage(image_path, crop_x_lim, crop_y_lim)
+    with _stage('contour_finder_pyramid.clahe_tables'):
+        clahe = _TiledCLAHE(cropped_image, clipLimit, tileGridSize)
+    with _stage('contour_finder_pyramid.coarse') as stage:
+        windows = _pyramid_windows(clahe, to_gray(cropped_image), factor, threshold, pad, max_window)
+        stage.count(len(windows))
+    with _stage('contour_finder_pyramid.refine') as stage:
+        found = _pyramid_contours(clahe, windows, cropped_image.shape[:2], threshold, binarization_max_val, pad, max_window)
+        if found is not None:
+            stage.count(len(found[0]), found[0].points)
+    if found is None:
+        # Mostly droplets, the whole frame it is
+        image_contrast = _clahe_stage(cropped_image, clipLimit, tileGridSize)
+        thresh = _threshold_stage(image_contrast, threshold, binarization_max_val)
+        table, hierarchy = _contour_stage(thresh, droplet_hierarchy_check, image_contrast if gradient_check else None)
+    else:
+        table, hierarchy = found
+        keep = _droplet_contours(table, hierarchy, droplet_hierarchy_check)
+        if gradient_check:
+            # CLAHE values of single pixels come from the lookup tables
+            keep &= check_gradient_batch(clahe, table)
+        table = table.filter(keep).sort_by_area()
+    if return_table:
+        return table, hierarchy
+    contours, contours_area, contour_centroids = table.to_lists()
+    return contours, contours_area, contour_centroids, hierarchy
+
+# Frame sources. Every source is iterable and yields (frame_id, frame) pairs, where frame_id
+# is the index of the frame in the recording or sequence and frame a decoded image array.
+
+# Frames of a video file (AVI, MP4, ...) decoded with cv2.VideoCapture,
+# converted to grayscale on the reader thread unless grayscale=False
+class VideoSource:
+    def __init__(self, path, start=0, stop=None, step=1, grayscale=True):
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.grayscale = grayscale
+
+    def __len__(self):
+        capture = cv2.VideoCapture(self.path)
+        n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+        return len(range(self.start, n_frames if self.stop is None else min(self.stop, n_frames), self.step))
+
+    def __iter__(self):
+        capture = cv2.VideoCapture(self.path)
+        if not capture.isOpened():
+            raise IOError(f"Could not open video {self.path}")
+        try:
+            if self.start:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+            frame_id = self.start
+            while self.stop is None or frame_id < self.stop:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                if (frame_id - self.start) % self.step == 0:
+                    yield frame_id, to_gray(frame) if self.grayscale else frame
+                frame_id += 1
+        finally:
+            capture.release()
+
+# Numbered image files, given as a glob pattern (e.g. "run1/frame_*.png"), a directory or a list of paths.
+# Frames are decoded with load_image, by default to grayscale; fast_decode opts in to the
+# decoder's own gray conversion and reduce to a reduced-resolution decode (see load_image).
+class ImageSequenceSource:
+    def __init__(self, paths, grayscale=True, fast_decode=False, reduce=1):
+        if isinstance(paths, str):
+            pattern = os.path.join(paths, '*') if os.path.isdir(paths) else paths
+            paths = sorted(glob.glob(pattern))
+        self.paths = list(paths)
+        self.grayscale = grayscale
+        self.fast_decode = fast_decode
+        self.reduce = reduce
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, frame_id):
+        return load_image(self.paths[frame_id], grayscale=self.grayscale, fast_decode=self.fast_decode, reduce=self.reduce)
+
+    def __iter__(self):
+        for frame_id in range(len(self)):
+            yield frame_id, self[frame_id]
+
+# Frames that are already in memory, a (T, H, W[, 3]) array or a list of images
+class ArraySource:
+    def __init__(self, frames):
+        self.frames = frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, frame_id):
+        return self.frames[frame_id]
+
+    def __iter__(self):
+        for frame_id in range(len(self)):
+            yield frame_id, self.frames[frame_id]
+
+_VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mov', '.mkv', '.m4v', '.wmv', '.mpg', '.mpeg')
+
+# Picks the frame source for a video path, an image pattern/directory/list of paths or an array of frames
+def open_frame_source(source):
+    if isinstance(source, (VideoSource, ImageSequenceSource, ArraySource)):
+        return source
+    if isinstance(source, np.ndarray):
+        return ArraySource(source)
+    if isinstance(source, str):
+        if source.lower().endswith(_VIDEO_EXTENSIONS):
+            return VideoSource(source)
+        return ImageSequenceSource(source)
+    source = list(source)
+    if source and isinstance(source[0], np.ndarray):
+        return ArraySource(source)
+    return ImageSequenceSource(source)
+
+# Yields the (frame_id, frame) pairs of a source in order while up to `depth` frames are decoded
+# ahead on background threads. Image sequences are decoded by `threads` threads in parallel,
+# sequential sources (videos) are read by a single thread feeding a bounded queue.
+def prefetch_frames(source, depth=8, threads=2):
+    source = open_frame_source(source)
+    if isinstance(source, ImageSequenceSource) and threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            frame_ids = iter(range(len(source)))
+            pending = deque()
+            for frame_id in itertools.islice(frame_ids, depth):
+                pending.append((frame_id, executor.submit(source.__getitem__, frame_id)))
+            while pending:
+                frame_id, future = pending.popleft()
+                next_id = next(frame_ids, None)
+                if next_id is not None:
+                    pending.append((next_id, executor.submit(source.__getitem__, next_id)))
+                yield frame_id, future.result()
+        return
+
+    frames = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for item in source:
+                if not put(item):
+                    return
+            put((done, None))
+        except BaseException as error:
+            put((done, error))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            frame_id, frame = frames.get()
+            if frame_id is done:
+                if frame is not None:
+                    raise frame
+                return
+            yield frame_id, frame
+    finally:
+        stop.set()
+        thread.join()
+
+# Generator pipeline: runs `function` (contour_finder, droplet_boundary, droplet_volume_estimation,
+# gradient_labeling, ...) on every frame of a source while the next frames are being decoded,
+# and yields (frame_id, result) pairs in order
+def process_frames(source, function=None, depth=8, threads=2, **kwargs):
+    if function is None:
+        function = contour_finder
+    for frame_id, frame in prefetch_frames(source, depth, threads):
+        yield frame_id, function(frame, **kwargs)
+
+# Droplet tracking. DropletTracker links the droplets of consecutive frames and gives them
+# persistent IDs. The droplets of a frame are the ones contour_finder returns for it, in the same
+# order. Consecutive binarized frames are compared and only the droplets whose bounding box (grown
+# by one pixel) meets a changed pixel are new: they get their ellipses fitted and are matched to
+# the previous droplets that met a changed pixel. Every other droplet is unchanged and keeps its
+# ellipse, ID and velocity. A frame without changes is not contoured at all.
+# Only windows around the changed regions are contoured again: the changed boxes grown by
+# _WINDOW_MARGIN pixels, merged while they overlap or touch, traced at once in a mosaic of the
+# windows one pixel apart. A contour that does not touch an inner edge of its window is the one
+# findContours finds in the whole frame, it replaces the previous contours inside the window. A
+# window grows on the sides where it cuts a contour next to a changed pixel. Contours are known by
+# the pixel findContours starts them at and their parent's, which for a parent cut by the window
+# is the smallest previous contour of the other kind around them. The findContours order and
+# hierarchy are rebuilt from these keys (_contour_tree). When the windows would cover more than
+# full_fraction of the frame or a parent cannot be told, the whole frame is traced again.
+# Matching is greedy, cheapest pairs first, by distance to the predicted centroid (centroid +
+# velocity) plus size_weight times the difference in ellipse axes, up to max_distance pixels.
+# A new droplet without a match next to a matched one broke off from it, a previous droplet
+# without a match next to a matched one coalesced with it.
+
+# The droplets of one frame: ids, ContourTable, EllipseTable (fitEllipseDirect) and centroid
+# velocity (pixels per frame, NaN for new droplets) in the same order, the events of the frame as
+# (frame_id, kind, from_ids, to_ids) tuples with kind 'appear', 'disappear', 'breakup' or
+# 'coalescence', and the bounding boxes (x, y, w, h) of the changed regions
+class TrackedDroplets:
+    def __init__(self, frame_id, ids, table, ellipses, velocity, events, changed):
+        self.frame_id = frame_id
+        self.ids = ids
+        self.table = table
+        self.ellipses = ellipses
+        self.velocity = velocity
+        self.events = events
+        self.changed = changed
+
+    def __len__(self):
+        return len(self.ids)
+
+# Trajectory of one droplet: the frames it was seen in with its centroid, area and ellipse in each,
+# the ID of the droplet it broke off from and the one it coalesced into (None if there is none)
+class DropletTrack:
+    def __init__(self, track_id, frame_ids, centroids, areas, ellipses, parent=None, merged_into=None):
+        self.track_id = track_id
+        self.frame_ids = frame_ids
+        self.centroids = centroids
+        self.areas = areas
+        self.ellipses = ellipses
+        self.parent = parent
+        self.merged_into = merged_into
+
+    def __len__(self):
+        return len(self.frame_ids)
+
+    # Centroid velocity between consecutive observations, in pixels per frame
+    @property
+    def velocity(self):
+        return np.diff(self.centroids, axis=0) / np.diff(self.frame_ids)[:, None]
+
+# Frame-to-frame droplet tracker, see the notes above. update() takes the frames in order (paths
+# or arrays, processed with the contour_finder parameters) and returns their TrackedDroplets,
+# run() does the same for a frame source while the next frames are decoded. clipLimit=None skips
+# the contrast enhancement. When the changed regions cover more than full_fraction of a frame, or
+# with incremental=False, all droplets are treated as new. With keep_history, tracks() returns the DropletTrack of every ID seen so far.
+class DropletTracker:
+    # Pixels between a changed region and the edges of the window it is traced again in
+    _WINDOW_MARGIN = 8
+
+    def __init__(self, crop_x_lim=(400,1100), crop_y_lim=(230,1660), clipLimit=2.0, tileGridSize=(8, 8), threshold=50, binarization_max_val=255, droplet_hierarchy_check=False, max_distance=50.0, size_weight=0.5, full_fraction=0.5, incremental=True, keep_history=True):
+        self.crop_x_lim = crop_x_lim
+        self.crop_y_lim = crop_y_lim
+        self.clipLimit = clipLimit
+        self.tileGridSize = tileGridSize
+        self.threshold = threshold
+        self.binarization_max_val = binarization_max_val
+        self.droplet_hierarchy_check = droplet_hierarchy_check
+        self.max_distance = max_distance
+        self.size_weight = size_weight
+        self.full_fraction = full_fraction
+        self.incremental = incremental
+        self.keep_history = keep_history
+        self.reset()
+
+    def reset(self):
+        self.events = []
+        self._history = []
+        self._next_id = 0
+        self._frame_id = -1
+        self._binary = None
+        self._table = ContourTable.from_contours([])
+        self._ellipses = fit_ellipses(self._table)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._velocity = np.zeros((0, 2))
+        self._contours = None
+
+    @_profiled('droplet_tracker')
+    def update(self, frame, frame_id=None):
+        if frame_id is None:
+            frame_id = self._frame_id + 1
+        image = _decode_stage(frame, self.crop_x_lim, self.crop_y_lim)
+        if self.clipLimit is not None:
+            image = _clahe_stage(image, self.clipLimit, self.tileGridSize)
+        binary = _threshold_stage(image, self.threshold, self.binarization_max_val)
+        changed = None
+        if self.incremental and self._binary is not None and self._binary.shape == binary.shape:
+            changed = self._changed_regions(binary)
+        if changed is not None and len(changed) == 0:
+            # Nothing changed, neither did the droplets
+            table, ellipses, ids, keys = self._table, self._ellipses, self._ids, self._keys
+            velocity, events = self._velocity, []
+        else:
+            with _stage('droplet_tracker.find_contours') as stage:
+                # Only the windows around the changed regions are traced again when possible
+                contours = None if changed is None else self._spliced_contours(binary, changed)
+                if contours is None:
+                    contours = self._frame_contours(binary)
+                self._contours = contours
+                stage.count(len(contours[0]), contours[0].points)
+            with _stage('droplet_tracker.filter') as stage:
+                table, hierarchy = contours[0], contours[4]
+                table = table.filter(_droplet_contours(table, hierarchy, self.droplet_hierarchy_check)).sort_by_area()
+                stage.count(len(table))
+            keys = self._droplet_keys(table, binary.shape)
+            with _stage('droplet_tracker.unchanged') as stage:
+                # Droplets away from the changed regions are previous droplets, found by key
+                if changed is None or len(self._keys) == 0:
+                    dirty = np.ones(len(table), dtype=bool)
+                    previous = np.zeros(len(table), dtype=np.int64)
+                else:
+                    by_key = np.argsort(self._keys)
+                    previous = by_key[np.clip(np.searchsorted(self._keys[by_key], keys), 0, len(by_key) - 1)]
+                    dirty = self._meets(table.bbox, changed) | (self._keys[previous] != keys)
+                clean = np.flatnonzero(~dirty)
+                dirty = np.flatnonzero(dirty)
+                replaced = np.ones(len(self._ids), dtype=bool)
+                replaced[previous[clean]] = False
+                stage.count(len(dirty))
+            with _stage('droplet_tracker.fit_ellipses') as stage:
+                fits = fit_ellipses(table.take(dirty))
+                stage.count(len(dirty), fits.axes)
+            with _stage('droplet_tracker.associate') as stage:
+                new_ids, new_velocity, events = self._associate(frame_id, np.flatnonzero(replaced), table.take(dirty), fits)
+                stage.count(len(dirty))
+            # Back in table order
+            order = np.argsort(np.concatenate([clean, dirty]))
+            ellipses = EllipseTable.concat([self._ellipses.take(previous[clean]), fits]).take(order)
+            ids = np.concatenate([self._ids[previous[clean]], new_ids])[order]
+            velocity = np.concatenate([self._velocity[previous[clean]], new_velocity])[order]
+
+        self._table, self._ellipses, self._ids, self._keys, self._velocity = table, ellipses, ids, keys, velocity
+        self._binary, self._frame_id = binary, frame_id
+        self.events.extend(events)
+        if self.keep_history:
+            self._history.append((frame_id, ids, table.centroid, table.area, ellipses))
+        if changed is None:
+            changed = np.array([[0, 0, binary.shape[1], binary.shape[0]]])
+        return TrackedDroplets(frame_id, ids, table, ellipses, velocity, events, changed)
+
+    # Yields the (frame_id, TrackedDroplets) pairs of a frame source, see prefetch_frames
+    def run(self, source, depth=8, threads=2):
+        for frame_id, frame in prefetch_frames(source, depth, threads):
+            yield frame_id, self.update(frame, frame_id)
+
+    # DropletTrack of every ID seen so far, by ID
+    def tracks(self):
+        if not self._history:
+            return {}
+        frame_ids = np.concatenate([np.full(len(ids), frame_id) for frame_id, ids, _, _, _ in self._history])
+        ids = np.concatenate([ids for _, ids, _, _, _ in self._history])
+        centroids = np.concatenate([centroid for _, _, centroid, _, _ in self._history])
+        areas = np.concatenate([area for _, _, _, area, _ in self._history])
+        ellipses = EllipseTable.concat(ellipses for _, _, _, _, ellipses in self._history)
+        parent, merged_into = {}, {}
+        for _, kind, from_ids, to_ids in self.events:
+            if kind == 'breakup':
+                parent.update((to_id, from_ids[0]) for to_id in to_ids[1:])
+            elif kind == 'coalescence':
+                merged_into.update((from_id, to_ids[0]) for from_id in from_ids[1:])
+        order = np.lexsort((frame_ids, ids))
+        track_ids, starts = np.unique(ids[order], return_index=True)
+        tracks = {}
+        for track_id, rows in zip(track_ids.tolist(), np.split(order, starts[1:])):
+            tracks[track_id] = DropletTrack(track_id, frame_ids[rows], centroids[rows], areas[rows], ellipses.take(rows),
+                                            parent.get(track_id), merged_into.get(track_id))
+        return tracks
+
+    # Bounding boxes (x, y, w, h) of the regions whose binarized value changed since the previous
+    # frame, None when they cover too much of the frame to be worth it
+    def _changed_regions(self, binary):
+        with _stage('droplet_tracker.difference') as stage:
+            changed = cv2.compare(binary, self._binary, cv2.CMP_NE)
+            regions = cv2.findContours(changed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+            boxes = ContourTable.from_contours(regions).bbox
+            stage.count(len(boxes), changed)
+        if (boxes[:, 2] * boxes[:, 3]).sum() > self.full_fraction * binary.size:
+            return None
+        return boxes
+
+    # All contours of a binary frame in findContours order: ContourTable, keys (y*width + x) of the
+    # pixels where findContours found them, keys of their parents (-1 at the top), whether they are
+    # holes, and the hierarchy. The keys are left out (None) until _contour_keys fills them in.
+    @staticmethod
+    def _frame_contours(binary):
+        contours, hierarchy = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        return ContourTable.from_contours(contours), None, None, None, hierarchy
+
+    # Keys, parent keys and hole flags of the contours of _frame_contours, from the first points of
+    # the uncompressed contours
+    @staticmethod
+    def _contour_keys(binary, hierarchy):
+        traced = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[0]
+        starts = np.array([contour[0, 0] for contour in traced], dtype=np.int64).reshape(-1, 2)
+        links = ContourHierarchy(hierarchy)
+        keys = starts[:, 1] * binary.shape[1] + starts[:, 0]
+        return keys, np.where(links.parent >= 0, keys[links.parent], -1), links.depth % 2 == 1
+
+    # The contours of _frame_contours, from the ones of the previous frame and the ones traced again
+    # in windows around the changed regions, see the notes above TrackedDroplets. None when the windows would cover
+    # more than full_fraction of the frame or the parent of a contour cannot be told.
+    def _spliced_contours(self, binary, changed):
+        if self._contours is None:
+            return None
+        height, width = binary.shape
+        previous, keys, parent_keys, holes, hierarchy = self._contours
+        if keys is None:
+            keys, parent_keys, holes = self._contour_keys(self._binary, hierarchy)
+            self._contours = previous, keys, parent_keys, holes, hierarchy
+
+        # Windows around the changed boxes, grown on the sides where they cut a contour next to a change
+        margin = self._WINDOW_MARGIN
+        x, y, w, h = changed.T.astype(np.int64)
+        windows = _merged_windows(np.column_stack([y - margin, y + h + margin, x - margin, x + w + margin]), binary.shape)
+        found = []
+        done = set()
+        while True:
+            if int(np.prod(windows[:, [1, 3]] - windows[:, [0, 2]], axis=1).sum()) > self.full_fraction * binary.size:
+                return None
+            pending = np.array([tuple(window) not in done for window in windows.tolist()], dtype=bool)
+            if not pending.any():
+                break
+            block, grown = self._window_contours(binary, windows[pending], changed)
+            found.append(block)
+            done.update(map(tuple, windows[pending].tolist()))
+            windows = _merged_windows(np.concatenate([windows, grown]), binary.shape)
+
+        # Contours of the final windows only, previous contours inside them are replaced
+        final = set(map(tuple, windows.tolist()))
+        found = [block for block in found if len(block[0])]
+        tables = []
+        new_keys, new_parent_keys, new_holes, group = [], [], [], []
+        group_base = 0
+        for table, block_keys, block_parent_keys, block_holes, block_group, block_windows in found:
+            rows = np.flatnonzero([tuple(window) in final for window in block_windows.tolist()])
+            tables.append(table.take(rows))
+            new_keys.append(block_keys[rows])
+            new_parent_keys.append(block_parent_keys[rows])
+            new_holes.append(block_holes[rows])
+            group.append(np.where(block_group[rows] >= 0, block_group[rows] + group_base, -1))
+            group_base += int(block_group.max(initial=-1)) + 1
+        kept = np.flatnonzero(~self._inside(previous.bbox, windows, binary.shape).any(axis=1))
+        table = ContourTable.concat(tables)
+        new_keys = np.concatenate(new_keys) if tables else np.zeros(0, dtype=np.int64)
+        new_parent_keys = np.concatenate(new_parent_keys) if tables else np.zeros(0, dtype=np.int64)
+        new_holes = np.concatenate(new_holes) if tables else np.zeros(0, dtype=bool)
+        group = np.concatenate(group) if tables else np.zeros(0, dtype=np.int64)
+
+        # A parent that is not complete in its window is an unchanged previous contour: the smallest
+        # one of the other kind around the first pixel of a child, none at the top
+        unresolved = np.flatnonzero(group >= 0)
+        if len(unresolved):
+            groups, first, members = np.unique(group[unresolved], return_index=True, return_inverse=True)
+            child = unresolved[first]
+            box = table.bbox[child]
+            start = np.column_stack([new_keys[child] % width, new_keys[child] // width])
+            around = previous.bbox[kept]
+            holds = ((around[None, :, :2] <= box[:, None, :2]).all(axis=2) &
+                     (around[None, :, :2] + around[None, :, 2:] >= box[:, None, :2] + box[:, None, 2:]).all(axis=2) &
+                     (holes[kept][None, :] != new_holes[child][:, None]))
+            for k in np.flatnonzero(holds.any(axis=0)).tolist():
+                rows = np.flatnonzero(holds[:, k])
+                holds[rows[_points_in_polygon(previous.contour(kept[k]), start[rows]) < 0], k] = False
+            area = np.where(holds, previous.area[kept][None, :], np.inf)
+            smallest = area.min(axis=1, initial=np.inf)
+            if ((area == smallest[:, None]) & holds).sum(axis=1).max(initial=0) > 1:
+                return None
+            parent = np.where(np.isfinite(smallest), keys[kept][np.argmin(area, axis=1)] if len(kept) else -1, -1)
+            new_parent_keys[unresolved] = parent[members]
+
+        keys = np.concatenate([keys[kept], new_keys])
+        parent_keys = np.concatenate([parent_keys[kept], new_parent_keys])
+        holes = np.concatenate([holes[kept], new_holes])
+        if len(np.unique(keys)) < len(keys):
+            return None
+        order, hierarchy = _contour_tree(keys, parent_keys)
+        table = ContourTable.concat([previous.take(kept), table]).take(order)
+        table.index = np.arange(len(table))
+        return table, keys[order], parent_keys[order], holes[order], hierarchy if len(table) else None
+
+    # Contours of the windows (r0, r1, c0, c1) of a binary frame, traced at once in a mosaic of the
+    # windows separated by background. Returns the contours that do not touch an inner edge of their
+    # window: ContourTable, keys, parent keys, hole flags, groups of the ones whose parent is not
+    # complete in the window (-1 for the others, contours of one group share their parent and have
+    # the parent key -1) and windows, and the windows grown where they cut a contour that passes
+    # next to a changed box (x, y, w, h).
+    @staticmethod
+    def _window_contours(binary, windows, changed):
+        height, width = binary.shape
+        size = windows[:, [1, 3]] - windows[:, [0, 2]]
+        place, mosaic_shape = _shelf_layout(size, width)
+        mosaic = np.zeros(mosaic_shape, dtype=np.uint8)
+        # and the changed boxes grown by one pixel in them
+        near = np.zeros(mosaic.shape, dtype=bool)
+        x, y, w, h = changed.T
+        for (r0, r1, c0, c1), (px, py) in zip(windows.tolist(), place.tolist()):
+            mosaic[py:py + r1 - r0, px:px + c1 - c0] = binary[r0:r1, c0:c1]
+            for bx, by, bw, bh in changed[(x <= c1) & (c0 <= x + w) & (y <= r1) & (r0 <= y + h)].tolist():
+                near[py + max(by - 1 - r0, 0):py + min(by + bh + 1, r1) - r0, px + max(bx - 1 - c0, 0):px + min(bx + bw + 1, c1) - c0] = True
+        contours, hierarchy = cv2.findContours(mosaic, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        no_keys = np.zeros(0, dtype=np.int64)
+        if len(contours) == 0:
+            return (ContourTable.from_contours([]), no_keys, no_keys, np.zeros(0, dtype=bool), no_keys, windows[:0]), windows[:0]
+        traced = cv2.findContours(mosaic, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[0]
+
+        # Back to frame coordinates, by the window every contour lies in
+        points, offsets = pack_contours(contours)
+        lengths = np.diff(offsets)
+        first = points[offsets[:-1], 0]
+        window = np.argmax((place[None, :, 0] <= first[:, None, 0]) & (first[:, None, 0] < place[None, :, 0] + size[None, :, 1]) &
+                           (place[None, :, 1] <= first[:, None, 1]) & (first[:, None, 1] < place[None, :, 1] + size[None, :, 0]), axis=1)
+        shift = (windows[:, [2, 0]] - place)[window]
+        table = ContourTable(points + np.repeat(shift, lengths, axis=0)[:, None, :].astype(np.int32), offsets)
+        traced_lengths = np.array([len(contour) for contour in traced], dtype=np.int64)
+        traced = np.concatenate(traced).reshape(-1, 2)
+        traced_offsets = np.zeros(len(traced_lengths) + 1, dtype=np.int64)
+        np.cumsum(traced_lengths, out=traced_offsets[1:])
+        near = np.logical_or.reduceat(near[traced[:, 1], traced[:, 0]], traced_offsets[:-1])
+        traced = traced + np.repeat(shift, traced_lengths, axis=0)
+
+        r0, r1, c0, c1 = windows[window].T
+        x0, y0 = table.bbox[:, 0], table.bbox[:, 1]
+        x1, y1 = x0 + table.bbox[:, 2] - 1, y0 + table.bbox[:, 3] - 1
+        sides = np.stack([(x0 <= c0) & (c0 > 0), (y0 <= r0) & (r0 > 0), (x1 >= c1 - 1) & (c1 < width), (y1 >= r1 - 1) & (r1 < height)], axis=1)
+        cut = sides.any(axis=1)
+
+        # Cut contours next to a changed box may go on differently outside their window
+        stale = cut & near
+        if stale.any():
+            grow = np.zeros((len(windows), 4), dtype=bool)
+            np.logical_or.at(grow, window[stale], sides[stale])
+            stale_windows = np.flatnonzero(grow.any(axis=1))
+            rows, cols = size[stale_windows].T
+            (wr0, wr1, wc0, wc1), (left, top, right, bottom) = windows[stale_windows].T, grow[stale_windows].T
+            grown = np.column_stack([np.maximum(wr0 - rows*top, 0), np.minimum(wr1 + rows*bottom, height),
+                                     np.maximum(wc0 - cols*left, 0), np.minimum(wc1 + cols*right, width)])
+        else:
+            grown = windows[:0]
+
+        # Children of a cut contour share their parent, the parent of a contour at the top of the
+        # mosaic may be any contour around it
+        starts = traced[traced_offsets[:-1]].astype(np.int64)
+        keys = starts[:, 1] * width + starts[:, 0]
+        links = ContourHierarchy(hierarchy)
+        parent, n = links.parent, len(table)
+        has_parent = parent >= 0
+        known = has_parent & ~cut[parent]
+        parent_keys = np.where(known, keys[parent], -1)
+        group = np.where(known, -1, np.where(has_parent, parent, n + np.arange(n)))
+        complete = np.flatnonzero(~cut)
+        block = (table.take(complete), keys[complete], parent_keys[complete], links.depth[complete] % 2 == 1, group[complete], windows[window[complete]])
+        return block, grown
+
+    # Which of the bounding boxes (x, y, w, h) lie inside which of the windows (r0, r1, c0, c1) of an
+    # image of the given shape without touching an inner edge, (boxes, windows)
+    @staticmethod
+    def _inside(bbox, windows, shape):
+        x0, y0 = bbox[:, None, 0], bbox[:, None, 1]
+        x1, y1 = x0 + bbox[:, None, 2] - 1, y0 + bbox[:, None, 3] - 1
+        r0, r1, c0, c1 = windows.T
+        return (((x0 > c0) | (c0 == 0)) & ((y0 > r0) | (r0 == 0)) & ((x1 < c1 - 1) | (c1 == shape[1])) & ((y1 < r1 - 1) | (r1 == shape[0])) &
+                (x0 >= c0) & (y0 >= r0) & (x1 < c1) & (y1 < r1))
+
+    # Bounding boxes (x, y, w, h) grown by one pixel that meet any of the changed boxes
+    @staticmethod
+    def _meets(bbox, changed):
+        x0, y0 = bbox[:, None, 0] - 1, bbox[:, None, 1] - 1
+        x1, y1 = x0 + bbox[:, None, 2] + 2, y0 + bbox[:, None, 3] + 2
+        return ((x0 < changed[:, 0] + changed[:, 2]) & (changed[:, 0] < x1) &
+                (y0 < changed[:, 1] + changed[:, 3]) & (changed[:, 1] < y1)).any(axis=1)
+
+    # Key of every droplet: its first point and area, the same for the same contour in every frame
+    @staticmethod
+    def _droplet_keys(table, shape):
+        first = table.points[table.offsets[:-1], 0].astype(np.int64)
+        return (first[:, 1] * shape[1] + first[:, 0]) * (2 * shape[0] * shape[1] + 1) + np.rint(2 * table.area).astype(np.int64)
+
+    # IDs and velocities of the new droplets, matched to the replaced previous ones, and the events
+    def _associate(self, frame_id, replaced, table, ellipses):
+        n = len(table)
+        ids = np.full(n, -1, dtype=np.int64)
+        velocity = np.full((n, 2), np.nan)
+        old_ids = self._ids[replaced]
+        old_centroid = self._table.centroid[replaced].astype(np.float64)
+        predicted = old_centroid + np.nan_to_num(self._velocity[replaced])
+        centroid = table.centroid.astype(np.float64)
+        distance = np.hypot(centroid[None, :, 0] - predicted[:, None, 0], centroid[None, :, 1] - predicted[:, None, 1])
+        old_axes = np.sort(self._ellipses.axes[replaced], axis=1)
+        cost = distance + self.size_weight * np.abs(np.sort(ellipses.axes, axis=1)[None] - old_axes[:, None]).sum(axis=2)
+
+        # Greedy matching, cheapest pairs first
+        old_match = np.full(len(replaced), -1)
+        new_match = np.full(n, -1)
+        rows, cols = np.nonzero(distance <= self.max_distance)
+        cheapest = np.argsort(cost[rows, cols], kind='stable')
+        for i, j in zip(rows[cheapest].tolist(), cols[cheapest].tolist()):
+            if old_match[i] < 0 and new_match[j] < 0:
+                old_match[i], new_match[j] = j, i
+        matched = np.flatnonzero(new_match >= 0)
+        ids[matched] = old_ids[new_match[matched]]
+        velocity[matched] = (centroid[matched] - old_centroid[new_match[matched]]) / max(frame_id - self._frame_id, 1)
+        fresh = np.flatnonzero(new_match < 0)
+        ids[fresh] = np.arange(self._next_id, self._next_id + len(fresh))
+        self._next_id += len(fresh)
+
+        # Unmatched droplets next to a matched one broke off from it or coalesced with it
+        events = []
+        breakups, coalescences = {}, {}
+        for j in fresh.tolist():
+            near = np.flatnonzero((distance[:, j] <= self.max_distance) & (old_match >= 0))
+            if len(near):
+                breakups.setdefault(near[np.argmin(distance[near, j])], []).append(j)
+            else:
+                events.append((frame_id, 'appear', (), (int(ids[j]),)))
+        for i in np.flatnonzero(old_match < 0).tolist():
+            near = np.flatnonzero((distance[i] <= self.max_distance) & (new_match >= 0))
+            if len(near):
+                coalescences.setdefault(near[np.argmin(distance[i, near])], []).append(i)
+            else:
+                events.append((frame_id, 'disappear', (int(old_ids[i]),), ()))
+        for i, fragments in breakups.items():
+            events.append((frame_id, 'breakup', (int(old_ids[i]),), tuple(ids[[old_match[i]] + fragments].tolist())))
+        for j, merged in coalescences.items():
+            events.append((frame_id, 'coalescence', tuple(old_ids[[new_match[j]] + merged].tolist()), (int(ids[j]),)))
+        return ids, velocity, events
+
+# Per-droplet columns of one frame for ResultWriter.append. Any of the inputs can be left out:
+# ellipses (EllipseTable or a list of ((cx, cy), (w, h), angle) tuples) give center_x, center_y,
+# major_axis, minor_axis and angle like ellipses_analysis; contours (ContourTable or the
+# (contours, areas, centroids, ...) result of contour_finder) give area, centroid_x and
+# centroid_y; volumes (the result of droplet_volume_estimation(..., aligned=True) or a list of
+# volumes) give volume, x_diameter and y_diameter (NaN for droplets touching the crop edges); efd (the (n, order, 4) coefficients of contour_fourier_features_batch)
+# gives the efd column.
+def droplet_columns(ellipses=None, contours=None, volumes=None, efd=None):
+    columns = {}
+    if ellipses is not None:
+        if not isinstance(ellipses, EllipseTable):
+            ellipses = EllipseTable(np.array([e[0] for e in ellipses], dtype=np.float32).reshape(-1, 2),
+                                    np.array([e[1] for e in ellipses], dtype=np.float32).reshape(-1, 2),
+                                    np.array([e[2] for e in ellipses], dtype=np.float32))
+        columns['center_x'] = ellipses.centers[:, 0]
+        columns['center_y'] = ellipses.centers[:, 1]
+        columns['major_axis'] = ellipses.axes[:, 0]
+        columns['minor_axis'] = ellipses.axes[:, 1]
+        columns['angle'] = ellipses.angles
+    if contours is not None:
+        if isinstance(contours, ContourTable):
+            area, centroid = contours.area, contours.centroid
+        else:
+            area = np.asarray(contours[1], dtype=np.float64)
+            centroid = np.asarray(contours[2], dtype=np.int64).reshape(-1, 2)
+        columns['area'] = area
+        columns['centroid_x'] = centroid[:, 0]
+        columns['centroid_y'] = centroid[:, 1]
+    if volumes is not None:
+        if isinstance(volumes, tuple) and len(volumes) == 4:
+            total_volume, num_droplets, x_diameters, y_diameters = volumes
+            if len(y_diameters) != len(total_volume):
+                raise ValueError(f"{len(y_diameters)} y diameters for {len(total_volume)} droplets, "
+                                 "use droplet_volume_estimation(..., aligned=True) for per-droplet columns")
+            columns['x_diameter'] = np.asarray(x_diameters, dtype=np.float64)
+            columns['y_diameter'] = np.asarray(y_diameters, dtype=np.float64)
+        else:
+            total_volume = volumes
+        columns['volume'] = np.asarray(total_volume, dtype=np.float64)
+    if efd is not None:
+        columns['efd'] = np.asarray(efd)
+    return columns
+
+def _result_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    if extension in ('.h5', '.hdf5'):
+        return 'hdf5'
+    return 'memmap'
+
+# Streaming columnar writer for per-droplet measurements. Every append() adds the rows of one
+# frame (plus a frame_id column); rows are buffered up to chunk_rows and then written out, so
+# memory stays bounded however long the experiment is. The columns and their dtypes and trailing
+# shapes are fixed by the first append. Formats:
+#   memmap  - a directory with one raw file per column and a meta.json (default, no dependencies),
+#             readable while it is still being written
+#   parquet - one row group per chunk, needs pyarrow
+#   hdf5    - one resizable dataset per column, needs h5py
+class ResultWriter:
+    def __init__(self, path, format=None, chunk_rows=65536):
+        self.path = path
+        self.format = _result_format(path) if format is None else format
+        if self.format not in _RESULT_BACKENDS:
+            raise ValueError(f"Unknown result format {self.format!r}, expected one of {sorted(_RESULT_BACKENDS)}")
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.frames = 0
+        self._backend = _RESULT_BACKENDS[self.format][0](path)
+        self._schema = None
+        self._buffers = None
+        self._buffered = 0
+
+    def append(self, frame_id, **columns):
+        columns = {name: np.asarray(values) for name, values in columns.items()}
+        n = self._length(columns, f"frame {frame_id}")
+        self._add({'frame_id': np.full(n, frame_id, dtype=np.int64), **columns}, n, f"frame {frame_id}")
+        self.frames += 1
+
+    # Rows of any number of whole frames at once, e.g. all columns of a ResultReader, frame_id included
+    def append_rows(self, columns):
+        columns = {name: np.asarray(values) for name, values in columns.items()}
+        if 'frame_id' not in columns:
+            raise ValueError("append_rows needs a frame_id column")
+        n = self._length(columns, "rows")
+        self._add(columns, n, "rows")
+        self.frames += len(np.unique(columns['frame_id']))
+
+    @staticmethod
+    def _length(columns, what):
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns of {what} have different lengths: { {name: len(v) for name, v in columns.items()} }")
+        return lengths.pop() if lengths else 0
+
+    def _add(self, columns, n, what):
+        if self._schema is None:
+            self._schema = {name: (values.dtype, values.shape[1:]) for name, values in columns.items()}
+            self._buffers = {name: [] for name in self._schema}
+        elif columns.keys() != self._schema.keys():
+            raise ValueError(f"{what.capitalize()} has columns {sorted(columns)}, expected {sorted(self._schema)}")
+        # All columns are checked and converted before any is buffered, so a rejected frame leaves
+        # nothing behind
+        converted = {}
+        for name, values in columns.items():
+            dtype, shape = self._schema[name]
+            if values.shape[1:] != shape:
+                raise ValueError(f"Column {name!r} of {what} has rows of shape {values.shape[1:]}, expected {shape}")
+            converted[name] = values.astype(dtype, copy=False)
+        for name, values in converted.items():
+            self._buffers[name].append(values)
+        self._buffered += n
+        if self._buffered >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if self._schema is None:
+            return
+        chunk = {}
+        for name, (dtype, shape) in self._schema.items():
+            buffers = self._buffers[name]
+            chunk[name] = np.concatenate(buffers) if buffers else np.empty((0,) + shape, dtype=dtype)
+            self._buffers[name] = []
+        self._backend.write(chunk, self._schema)
+        self.rows += self._buffered
+        self._buffered = 0
+
+    def close(self):
+        if self._backend is None:
+            return
+        self.flush()
+        self._backend.close(self._schema or {})
+        self._backend = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+# Reader for the output of ResultWriter. Columns are loaded only when they are accessed:
+# memmap columns come back as read-only np.memmap arrays, hdf5 columns as h5py datasets
+# (sliced on demand) and parquet columns are read one column at a time.
+class ResultReader:
+    def __init__(self, path, format=None):
+        self.path = path
+        self.format = _result_format(path) if format is None else format
+        if self.format not in _RESULT_BACKENDS:
+            raise ValueError(f"Unknown result format {self.format!r}, expected one of {sorted(_RESULT_BACKENDS)}")
+        self._backend = _RESULT_BACKENDS[self.format][1](path)
+
+    @property
+    def columns(self):
+        return self._backend.columns()
+
+    def __len__(self):
+        return self._backend.rows()
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            raise KeyError(name)
+        return self._backend.column(name)
+
+    # All columns of the rows that belong to one frame
+    def frame(self, frame_id):
+        rows = np.flatnonzero(np.asarray(self['frame_id']) == frame_id)
+        # Frames are appended whole, so their rows are normally one contiguous block
+        if len(rows) == 0 or rows[-1] - rows[0] + 1 == len(rows):
+            rows = slice(rows[0], rows[-1] + 1) if len(rows) else slice(0, 0)
+        return {name: np.asarray(self[name][rows]) for name in self.columns}
+
+    def close(self):
+        self._backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class _MemmapColumnWriter:
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.files = {}
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, chunk, schema):
+        for name, values in chunk.items():
+            if name not in self.files:
+                self.files[name] = open(os.path.join(self.path, name + '.bin'), 'wb')
+            np.ascontiguousarray(values).tofile(self.files[name])
+            self.files[name].flush()
+        self.rows += len(chunk['frame_id'])
+        self._write_meta(schema)
+
+    def _write_meta(self, schema):
+        meta = dict(format='memmap', rows=self.rows,
+                    columns={name: dict(dtype=dtype.str, shape=list(shape)) for name, (dtype, shape) in schema.items()})
+        with open(os.path.join(self.path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(self.path, 'meta.json.tmp'), os.path.join(self.path, 'meta.json'))
+
+    def close(self, schema):
+        self._write_meta(schema)
+        for f in self.files.values():
+            f.close()
+
+class _MemmapColumnReader:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+    def columns(self):
+        return list(self.meta['columns'])
+
+    def rows(self):
+        return self.meta['rows']
+
+    def column(self, name):
+        info = self.meta['columns'][name]
+        shape = (self.meta['rows'],) + tuple(info['shape'])
+        dtype = np.dtype(info['dtype'])
+        if self.meta['rows'] == 0 or dtype.itemsize == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name + '.bin'), dtype=dtype, mode='r', shape=shape)
+
+    def close(self):
+        pass
+
+class _ParquetColumnWriter:
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.writer = None
+
+    def write(self, chunk, schema):
+        pa = self.pa
+        if self.writer is None:
+            fields = []
+            for name, (dtype, shape) in schema.items():
+                value_type = pa.from_numpy_dtype(dtype)
+                fields.append(pa.field(name, pa.list_(value_type, int(np.prod(shape))) if shape else value_type))
+            shapes = {name: list(shape) for name, (dtype, shape) in schema.items() if shape}
+            self.schema = pa.schema(fields, metadata={b'morphocontour.shapes': json.dumps(shapes).encode()})
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        arrays = []
+        for name, values in chunk.items():
+            if values.ndim > 1:
+                flat = pa.array(np.ascontiguousarray(values).reshape(-1))
+                arrays.append(pa.FixedSizeListArray.from_arrays(flat, int(np.prod(values.shape[1:]))))
+            else:
+                arrays.append(pa.array(values))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self, schema):
+        if self.writer is None:
+            # Nothing was written, still leave a valid (empty) file behind
+            self.write({name: np.empty((0,) + shape, dtype=dtype) for name, (dtype, shape) in schema.items()}, schema)
+        self.writer.close()
+
+class _ParquetColumnReader:
+    def __init__(self, path):
+        import pyarrow.parquet
+        self.file = pyarrow.parquet.ParquetFile(path)
+        metadata = self.file.schema_arrow.metadata or {}
+        self.shapes = json.loads(metadata.get(b'morphocontour.shapes', b'{}'))
+
+    def columns(self):
+        return self.file.schema_arrow.names
+
+    def rows(self):
+        return self.file.metadata.num_rows
+
+    def column(self, name):
+        values = self.file.read(columns=[name]).column(name).combine_chunks()
+        if name in self.shapes:
+            return values.flatten().to_numpy(zero_copy_only=False).reshape((-1,) + tuple(self.shapes[name]))
+        return values.to_numpy(zero_copy_only=False)
+
+    def close(self):
+        self.file.close()
+
+class _HDF5ColumnWriter:
+    def __init__(self, path):
+        import h5py
+        self.file = h5py.File(path, 'w')
+
+    def write(self, chunk, schema):
+        for name, values in chunk.items():
+            if name not in self.file:
+                self.file.create_dataset(name, shape=(0,) + values.shape[1:], maxshape=(None,) + values.shape[1:], dtype=values.dtype, chunks=True)
+            dataset = self.file[name]
+            start = dataset.shape[0]
+            dataset.resize(start + len(values), axis=0)
+            dataset[start:] = values
+
+    def close(self, schema):
+        for name, (dtype, shape) in schema.items():
+            if name not in self.file:
+                self.file.create_dataset(name, shape=(0,) + shape, maxshape=(None,) + shape, dtype=dtype, chunks=True)
+        self.file.attrs['columns'] = json.dumps(list(schema))
+        self.file.close()
+
+class _HDF5ColumnReader:
+    def __init__(self, path):
+        import h5py
+        self.file = h5py.File(path, 'r')
+
+    def columns(self):
+        if 'columns' in self.file.attrs:
+            return json.loads(self.file.attrs['columns'])
+        return list(self.file.keys())
+
+    def rows(self):
+        return self.file['frame_id'].shape[0] if 'frame_id' in self.file else 0
+
+    def column(self, name):
+        return self.file[name]
+
+    def close(self):
+        self.file.close()
+
+_RESULT_BACKENDS = {
+    'memmap': (_MemmapColumnWriter, _MemmapColumnReader),
+    'parquet': (_ParquetColumnWriter, _ParquetColumnReader),
+    'hdf5': (_HDF5ColumnWriter, _HDF5ColumnReader),
+}
+
+# Resumable batch jobs. A job directory holds the frame manifest (frames.txt, one path per line),
+# the job parameters (job.json) and one ResultWriter output per shard of shard_size consecutive
+# frames, with the frame's position in the manifest as frame_id:
+#   job/frames.txt
+#   job/job.json
+#   job/shards/shard-000012          results of frames 12*shard_size ... (format of the job)
+#   job/shards/shard-000012.json     checkpoint: frames, rows, failed frames, host, seconds
+# A shard is written under a temporary name and moved into place with os.replace, then its
+# checkpoint is written the same way, so a checkpoint always belongs to complete results and
+# a shard killed halfway leaves nothing behind but a temporary file. run() skips every shard
+# with a checkpoint. Machines sharing the directory split the shards statically (shard %
+# machines == machine), so no locking is needed on the shared filesystem; each machine runs
+# its shards on a process pool. Frames whose function raises are recorded in the checkpoint
+# and give no rows. merge() combines the shards, in frame order, into one result file.
+# The function is one of 'contour_finder', 'droplet_boundary' and 'droplet_volume_estimation'
+# or a function of an importable module that takes a frame path plus the job kwargs and
+# returns a dict of columns (see droplet_columns).
+def _job_contour_finder(frame, **kwargs):
+    return droplet_columns(contours=contour_finder(frame, return_table=True, **kwargs)[0])
+
+def _job_droplet_boundary(frame, **kwargs):
+    return droplet_columns(ellipses=droplet_boundary(frame, **kwargs)[0])
+
+# Per-droplet y diameters, so the volume columns have equal lengths
+def _job_droplet_volume_estimation(frame, **kwargs):
+    return droplet_columns(volumes=droplet_volume_estimation(frame, **dict(kwargs, aligned=True)))
+
+_JOB_FUNCTIONS = {
+    'contour_finder': _job_contour_finder,
+    'droplet_boundary': _job_droplet_boundary,
+    'droplet_volume_estimation': _job_droplet_volume_estimation,
+}
+
+def _job_function(name):
+    if name in _JOB_FUNCTIONS:
+        return _JOB_FUNCTIONS[name]
+    module, _, qualname = name.partition(':')
+    function = importlib.import_module(module)
+    for attribute in qualname.split('.'):
+        function = getattr(function, attribute)
+    return function
+
+# Writes a small file atomically: to a temporary name, then os.replace
+def _write_atomic(path, write, mode='w'):
+    temporary = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(temporary, mode) as f:
+        write(f)
+    os.replace(temporary, path)
+
+def _remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+# A resumable batch job in a directory, see the notes above. create() sets it up (or reopens it),
+# run() processes the pending shards, status() reports progress and merge() combines the results.
+class ShardedJob:
+    SHARD_DIGITS = 6
+
+    # Opens an existing job directory
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'job.json')) as f:
+            config = json.load(f)
+        self.shard_size = config['shard_size']
+        self.frame_count = config['frames']
+        self.function = config['function']
+        self.format = config['format']
+        # JSON has no tuples, parameters such as crop limits are given back as tuples
+        self.kwargs = {name: tuple(value) if isinstance(value, list) else value for name, value in config['kwargs'].items()}
+        self._frames = None
+
+    # Creates the job directory, or opens it when it holds the same job: calling create() again
+    # with the same frames and parameters resumes the job, anything else is an error
+    @classmethod
+    def create(cls, directory, frames, shard_size=1000, function='contour_finder', format='memmap', **kwargs):
+        frames = [os.fspath(frame) for frame in frames]
+        if not isinstance(function, str):
+            function = f"{function.__module__}:{function.__qualname__}"
+        if format not in _RESULT_BACKENDS:
+            raise ValueError(f"Unknown result format {format!r}, expected one of {sorted(_RESULT_BACKENDS)}")
+        listing = ''.join(frame + '\n' for frame in frames)
+        config = dict(frames=len(frames), shard_size=int(shard_size), function=function, format=format, kwargs=kwargs,
+                      frames_sha256=hashlib.sha256(listing.encode()).hexdigest())
+        config_path = os.path.join(directory, 'job.json')
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                existing = json.load(f)
+            if existing != json.loads(json.dumps(config)):
+                raise ValueError(f"{directory} holds a different job, use another directory or ShardedJob({directory!r})")
+            return cls(directory)
+        os.makedirs(os.path.join(directory, 'shards'), exist_ok=True)
+        _write_atomic(os.path.join(directory, 'frames.txt'), lambda f: f.write(listing))
+        _write_atomic(config_path, lambda f: json.dump(config, f, indent=1))
+        return cls(directory)
+
+    @property
+    def frames(self):
+        if self._frames is None:
+            with open(os.path.join(self.directory, 'frames.txt')) as f:
+                self._frames = f.read().splitlines()
+        return self._frames
+
+    @property
+    def shard_count(self):
+        return -(-self.frame_count // self.shard_size)
+
+    def shard_frames(self, shard):
+        return range(shard * self.shard_size, min((shard + 1) * self.shard_size, self.frame_count))
+
+    def _shard_path(self, shard):
+        extension = {'parquet': '.parquet', 'hdf5': '.h5'}.get(self.format, '')
+        return os.path.join(self.directory, 'shards', f"shard-{shard:0{self.SHARD_DIGITS}d}{extension}")
+
+    def _checkpoint_path(self, shard):
+        return os.path.join(self.directory, 'shards', f"shard-{shard:0{self.SHARD_DIGITS}d}.json")
+
+    def checkpoint(self, shard):
+        try:
+            with open(self._checkpoint_path(shard)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def completed(self):
+        return [shard for shard in range(self.shard_count) if os.path.exists(self._checkpoint_path(shard))]
+
+    def pending(self, machine=0, machines=1):
+        return [shard for shard in range(machine, self.shard_count, machines) if not os.path.exists(self._checkpoint_path(shard))]
+
+    # Completed and pending shards, frames done and the frames that failed, as (frame_id, error)
+    def status(self):
+        checkpoints = [self.checkpoint(shard) for shard in range(self.shard_count)]
+        done = [checkpoint for checkpoint in checkpoints if checkpoint is not None]
+        return dict(shards=self.shard_count, completed=len(done), pending=self.shard_count - len(done),
+                    frames=self.frame_count, frames_done=sum(checkpoint['frames'] for checkpoint in done),
+                    rows=sum(checkpoint['rows'] for checkpoint in done),
+                    failed=[tuple(failure) for checkpoint in done for failure in checkpoint['failed']])
+
+    # Runs the pending shards of this machine (all of them with the default machine=0,
+    # machines=1) on `workers` processes, or in this process with workers=1. Returns the
+    # checkpoints of the shards run.
+    def run(self, workers=None, machine=0, machines=1):
+        pending = self.pending(machine, machines)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers <= 1 or len(pending) <= 1:
+            return [self.run_shard(shard) for shard in pending]
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            return list(executor.map(_run_job_shard, itertools.repeat(self.directory), pending))
+
+    # Processes one shard and checkpoints it, whether or not it was done before
+    def run_shard(self, shard):
+        function = _job_function(self.function)
+        path = self._shard_path(shard)
+        # Leftovers of attempts that were killed, shards are only run by one worker at a time
+        for leftover in glob.glob(glob.escape(path) + '.*.tmp'):
+            _remove_path(leftover)
+        temporary = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+        start = time.perf_counter()
+        failed = []
+        with ResultWriter(temporary, format=self.format) as writer:
+            for frame_id in self.shard_frames(shard):
+                # Columns the writer rejects fail the frame like errors of the function
+                try:
+                    writer.append(frame_id, **function(self.frames[frame_id], **self.kwargs))
+                except Exception as error:
+                    failed.append((frame_id, f"{type(error).__name__}: {error}"))
+        # Results of an earlier attempt that died before its checkpoint are replaced
+        _remove_path(path)
+        os.replace(temporary, path)
+        checkpoint = dict(shard=shard, first_frame=self.shard_frames(shard).start, frames=len(self.shard_frames(shard)),
+                          rows=writer.rows, failed=failed, host=socket.gethostname(), pid=os.getpid(),
+                          seconds=time.perf_counter() - start, finished=time.time())
+        _write_atomic(self._checkpoint_path(shard), lambda f: json.dump(checkpoint, f))
+        return checkpoint
+
+    # Combines the shard results, in frame order, into one ResultWriter output at `path` (format
+    # from its extension unless given). Pending shards are an error unless allow_pending is set.
+    def merge(self, path, format=None, allow_pending=False, chunk_rows=65536):
+        pending = self.pending()
+        if pending and not allow_pending:
+            raise RuntimeError(f"{len(pending)} of {self.shard_count} shards are not complete (first: {pending[0]}), run the job first")
+        format = _result_format(path) if format is None else format
+        temporary = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+        _remove_path(temporary)
+        with ResultWriter(temporary, format=format, chunk_rows=chunk_rows) as writer:
+            for shard in self.completed():
+                if self.checkpoint(shard)['rows'] == 0:
+                    continue
+                with ResultReader(self._shard_path(shard), format=self.format) as reader:
+                    writer.append_rows({name: np.asarray(reader[name]) for name in reader.columns})
+        _remove_path(path)
+        os.replace(temporary, path)
+        return ResultReader(path, format=format)
+
+def _run_job_shard(directory, shard):
+    return ShardedJob(directory).run_shard(shard)
+
 # droplet_boundary('sattlite.jpg')#Captura0.PNG
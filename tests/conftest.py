@@ -0,0 +1,5 @@
+# Test configuration: the tests import morphocontour and benchmark from the repository root
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,16 @@
+import benchmark
+import morphocontour
+
+
+def test_benchmark_reports_stage_breakdown_for_every_entry_point():
+    records = benchmark.run_benchmark(sizes=((400, 500),), droplet_counts=(6,), n_frames=1)
+    by_entry_point = {record['entry_point']: record for record in records}
+    assert set(by_entry_point) == {'contour_finder', 'droplet_boundary', 'measure_droplet_properties', 'droplet_volume_estimation'}
+    for name, record in by_entry_point.items():
+        stages = record['stages']
+        assert stages[name]['calls'] == 1
+        assert any(stage.startswith(name + '.') for stage in stages)
+        assert all(stats['seconds'] <= record['seconds'] for stats in stages.values())
+    assert 'measure_droplet_properties.fit_ellipses' in by_entry_point['measure_droplet_properties']['stages']
+    # The benchmark leaves profiling as it found it
+    assert morphocontour.get_profiler() is None
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+
+import benchmark
+import morphocontour
+
+
+def frame():
+    image, _ = benchmark.make_synthetic_frame(800, 1000, 20, seed=6)
+    return image
+
+
+def assert_same_result(found, expected):
+    table, hierarchy = found
+    np.testing.assert_array_equal(table.points, expected[0].points)
+    np.testing.assert_array_equal(table.offsets, expected[0].offsets)
+    np.testing.assert_array_equal(table.area, expected[0].area)
+    np.testing.assert_array_equal(hierarchy, expected[1])
+
+
+def test_cached_results_are_writable_copies():
+    image = frame()
+    cache = morphocontour.StageCache()
+    expected = morphocontour.contour_finder(image)
+    for _ in range(2):
+        contours, areas, centroids, hierarchy = morphocontour.contour_finder(image, cache=cache)
+        assert hierarchy.flags.writeable
+        contours[0][:, :, 0] += 5
+        hierarchy[0, 0] = 0
+    assert cache.hits > 0
+    # Editing the results leaves the cached values unchanged
+    contours, _, _, hierarchy = morphocontour.contour_finder(image, cache=cache)
+    for contour, original in zip(contours, expected[0]):
+        np.testing.assert_array_equal(contour, original)
+    np.testing.assert_array_equal(hierarchy, expected[3])
+    sweep = morphocontour.contour_finder_sweep(image, [50], cache=cache)
+    assert sweep.tables[0].points.flags.writeable and sweep.hierarchies[0].flags.writeable
+
+
+# Changing only the threshold recomputes the binary and contour stages, the ROI and CLAHE output
+# come from the cache
+def test_threshold_change_reuses_upstream_stages():
+    image = frame()
+    cache = morphocontour.StageCache()
+    first = morphocontour.contour_finder(image, cache=cache, return_table=True)
+    assert (cache.hits, cache.misses, len(cache)) == (0, 4, 4)
+    second = morphocontour.contour_finder(image, threshold=60, cache=cache, return_table=True)
+    assert (cache.hits, cache.misses, len(cache)) == (1, 6, 6)
+    assert_same_result(second, morphocontour.contour_finder(image, threshold=60, return_table=True))
+    # Repeating a call is a single hit on the contour stage
+    assert_same_result(morphocontour.contour_finder(image, cache=cache, return_table=True), first)
+    assert (cache.hits, cache.misses) == (2, 6)
+    # A different crop invalidates everything
+    morphocontour.contour_finder(image, crop_x_lim=(400, 1000), cache=cache)
+    assert (cache.hits, cache.misses) == (2, 10)
+
+
+def test_memory_lru_eviction():
+    cache = morphocontour.StageCache(max_bytes=3000)
+    arrays = {key: np.full(1000, i, np.uint8) for i, key in enumerate('abcd')}
+    for key in 'abc':
+        cache.put(key, arrays[key])
+    assert cache.nbytes == 3000
+    # 'a' is used again, so 'b' is the least recently used entry when 'd' comes in
+    assert cache.get('a') is not None
+    cache.put('d', arrays['d'])
+    assert len(cache) == 3 and cache.nbytes == 3000
+    assert cache.get('b') is None
+    for key in 'acd':
+        np.testing.assert_array_equal(cache.get(key), arrays[key])
+        assert not cache.get(key).flags.writeable
+    # Values larger than the whole cache are not kept
+    cache.put('e', np.zeros(4000, np.uint8))
+    assert cache.get('e') is None and len(cache) == 3
+
+
+def test_disk_round_trip(tmp_path):
+    image = frame()
+    directory = str(tmp_path / "cache")
+    expected = morphocontour.contour_finder(image, cache=morphocontour.StageCache(directory), return_table=True)
+    assert len([name for name in os.listdir(directory) if name.endswith('.npz')]) == 4
+    # A new cache on the same directory (e.g. another process) reads the stages back
+    cache = morphocontour.StageCache(directory)
+    assert_same_result(morphocontour.contour_finder(image, cache=cache, return_table=True), expected)
+    assert (cache.hits, cache.misses) == (1, 0)
+    roi = morphocontour.StageCache(directory).get(cache.stage_keys(image, ((400, 1100), (230, 1660), False, 1))[0])
+    np.testing.assert_array_equal(roi, image[400:1100, 230:1660])
+    assert not roi.flags.writeable
+
+
+def test_disk_eviction(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = morphocontour.StageCache(directory, max_bytes=0)
+    for i, key in enumerate('abc'):
+        cache.put(key, np.full(10000, i, np.uint8))
+        # Distinct modification times, oldest first
+        os.utime(os.path.join(directory, key + '.npz'), ns=(i * 10**9, i * 10**9))
+    size = os.path.getsize(os.path.join(directory, 'a.npz'))
+    cache = morphocontour.StageCache(directory, max_bytes=0, max_disk_bytes=3 * size)
+    # Reading 'a' marks it as recently used, so the next put evicts 'b'
+    assert cache.get('a') is not None
+    cache.put('d', np.full(10000, 3, np.uint8))
+    assert sorted(os.listdir(directory)) == ['a.npz', 'c.npz', 'd.npz']
+    assert cache.get('b') is None
+    np.testing.assert_array_equal(cache.get('c'), np.full(10000, 2, np.uint8))
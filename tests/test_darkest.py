@@ -0,0 +1,119 @@
+import cv2
+import numpy as np
+import pytest
+
+import morphocontour
+
+
+# cv2.LineIterator (8-connected) in Python: the segment is clipped to the image, then Bresenham
+# steps along the major axis and also along the minor one while the error term is negative
+def reference_line(shape, start, end):
+    height, width = shape
+    inside, start, end = cv2.clipLine((0, 0, width, height), start, end)
+    if not inside:
+        return []
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    sx, sy = (-1 if dx < 0 else 1), (-1 if dy < 0 else 1)
+    dx, dy = abs(dx), abs(dy)
+    major, minor = (sx, 0), (0, sy)
+    if dy > dx:
+        dx, dy = dy, dx
+        major, minor = minor, major
+    err = dx - 2 * dy
+    x, y = start
+    pixels = []
+    for _ in range(dx + 1):
+        pixels.append((x, y))
+        move_minor = err < 0
+        err += -2 * dy + (2 * dx if move_minor else 0)
+        x, y = x + major[0] + (minor[0] if move_minor else 0), y + major[1] + (minor[1] if move_minor else 0)
+    return pixels
+
+
+# Segments in all eight directions, inside the image, partly outside, entirely outside and
+# single points
+def segments(shape, n, seed):
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    inside = [((int(rng.integers(width)), int(rng.integers(height))), (int(rng.integers(width)), int(rng.integers(height)))) for _ in range(n)]
+    crossing = [((int(rng.integers(-60, width + 60)), int(rng.integers(-60, height + 60))),
+                 (int(rng.integers(-60, width + 60)), int(rng.integers(-60, height + 60)))) for _ in range(n)]
+    fixed = [((5, 5), (5, 5)), ((0, 0), (width - 1, height - 1)), ((width - 1, 0), (0, height - 1)),
+             ((-10, -10), (-1, 40)), ((width + 5, 3), (width + 50, 30)), ((-20, 10), (width + 20, 10)),
+             ((10, -20), (10, height + 20)), ((3, 7), (40, 9)), ((40, 9), (3, 7))]
+    return inside + crossing + fixed
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_line_pixels_follow_line_iterator(seed):
+    shape = (90, 130)
+    pairs = segments(shape, 100, seed)
+    pixels, offsets = morphocontour._line_pixels(shape, [s for s, _ in pairs], [e for _, e in pairs])
+    assert len(offsets) == len(pairs) + 1
+    for i, (start, end) in enumerate(pairs):
+        found = [tuple(p) for p in pixels[offsets[i]:offsets[i + 1]].tolist()]
+        assert found == reference_line(shape, start, end), (start, end)
+        # cv2.line runs the same iterator, but from the left end of the clipped segment
+        drawn = np.zeros(shape, np.uint8)
+        cv2.line(drawn, start, end, 255, 1, cv2.LINE_8)
+        ys, xs = np.nonzero(drawn)
+        _, clipped_start, clipped_end = cv2.clipLine((0, 0, shape[1], shape[0]), start, end)
+        left_to_right = found if clipped_start[0] <= clipped_end[0] else reference_line(shape, clipped_end, clipped_start)
+        assert sorted(left_to_right) == sorted(zip(xs.tolist(), ys.tolist()))
+
+
+def test_find_darkest_points_matches_single_segments():
+    rng = np.random.default_rng(3)
+    img = rng.integers(0, 256, (90, 130), dtype=np.uint8)
+    img[img < 30] = 255
+    pairs = segments(img.shape, 50, 3)
+    points, intensities, profiles, offsets = morphocontour.find_darkest_points(img, [s for s, _ in pairs], [e for _, e in pairs])
+    for i, (start, end) in enumerate(pairs):
+        line = reference_line(img.shape, start, end)
+        values = [int(img[y, x]) for x, y in line]
+        np.testing.assert_array_equal(profiles[offsets[i]:offsets[i + 1]], values)
+        if values and min(values) < 255:
+            assert tuple(points[i]) == line[int(np.argmin(values))] and intensities[i] == min(values)
+        else:
+            assert tuple(points[i]) == (-1, -1) and intensities[i] == 255
+
+
+def test_find_darkest_points_subpixel():
+    rng = np.random.default_rng(4)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (60, 80), dtype=np.uint8), (7, 7), 0)
+    starts = np.array([(3.5, 4.25), (70.0, 50.0), (10.0, 10.0), (0.0, 59.0)])
+    ends = np.array([(60.25, 40.5), (5.0, 55.0), (10.0, 10.0), (79.0, 0.0)])
+    points, intensities, profiles, offsets = morphocontour.find_darkest_points(img, starts, ends, subpixel=True, samples_per_pixel=3)
+    for i in range(len(starts)):
+        length = np.hypot(*(ends[i] - starts[i]))
+        count = int(np.ceil(length * 3)) + 1
+        assert offsets[i + 1] - offsets[i] == count
+        t = np.linspace(0, 1, count) if count > 1 else np.zeros(1)
+        xy = (starts[i] + (ends[i] - starts[i]) * t[:, None]).astype(np.float32)
+        # Bilinear interpolation of the float image, as cv2.remap does it
+        expected = cv2.remap(img.astype(np.float32), xy[:, None, 0], xy[:, None, 1], cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)[:, 0]
+        np.testing.assert_allclose(profiles[offsets[i]:offsets[i + 1]], expected, atol=1e-3)
+        first = int(np.argmin(profiles[offsets[i]:offsets[i + 1]]))
+        np.testing.assert_allclose(points[i], xy[first], atol=1e-5)
+        assert intensities[i] == profiles[offsets[i] + first]
+
+
+def test_find_darkest_points_splits_contours():
+    img = np.full((100, 100), 200, np.uint8)
+    cv2.line(img, (50, 0), (50, 99), 40, 1)
+    contours = [cv2.ellipse2Poly((50, 50), (30, 15), 0, 0, 360, 5).reshape(-1, 1, 2),
+                cv2.ellipse2Poly((50, 30), (20, 8), 0, 0, 360, 10).reshape(-1, 1, 2),
+                np.array([[[5, 5]], [[15, 5]], [[15, 15]]], np.int32)]
+    starts, ends = [(20, 50), (30, 30), (200, 200)], [(80, 50), (70, 30), (300, 300)]
+    points, _, _, _, splits = morphocontour.find_darkest_points(img, starts, ends, contours=contours)
+    assert len(splits) == len(contours)
+    for contour, point, (part1, part2) in zip(contours[:2], points[:2], splits[:2]):
+        assert point[0] == 50
+        expected = morphocontour.split_contour_at_point(contour, point)
+        np.testing.assert_array_equal(part1, expected[0])
+        np.testing.assert_array_equal(part2, expected[1])
+        np.testing.assert_array_equal(np.concatenate([part1, part2]), contour)
+    # A segment outside the image has no darkest point, its contour is not split
+    assert tuple(points[2]) == (-1, -1)
+    np.testing.assert_array_equal(splits[2][0], contours[2])
+    assert len(splits[2][1]) == 0
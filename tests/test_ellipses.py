@@ -0,0 +1,82 @@
+import cv2
+import numpy as np
+import pytest
+
+import benchmark
+import morphocontour
+
+
+def frame_contours(mode):
+    frame, _ = benchmark.make_synthetic_frame(1500, 1500, 120, seed=4)
+    contours = []
+    for binary in (frame < 100, frame > 100):
+        found, _ = cv2.findContours(binary.astype(np.uint8) * 255, cv2.RETR_TREE, mode)
+        contours.extend(found)
+    return contours
+
+
+def assert_same_ellipse(got, expected):
+    (cx, cy), (width, height), angle = expected
+    np.testing.assert_allclose(got[0], (cx, cy), rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(got[1], (width, height), rtol=1e-5, atol=1e-4)
+    # The angle of a near circle is not defined
+    if width < height * (1 - 1e-3):
+        assert abs((got[2] - angle + 90) % 180 - 90) < 1e-3
+
+
+@pytest.mark.parametrize("mode", [cv2.CHAIN_APPROX_SIMPLE, cv2.CHAIN_APPROX_NONE])
+def test_fit_ellipses_matches_cv2_on_real_contours(mode):
+    contours = frame_contours(mode)
+    table = morphocontour.fit_ellipses(contours)
+    assert len(table) == len(contours)
+    for i, contour in enumerate(contours):
+        if len(contour) < 5:
+            assert not table.fitted[i]
+            continue
+        assert table.fitted[i]
+        assert_same_ellipse(table[i], cv2.fitEllipseDirect(contour))
+
+
+DEGENERATE = [
+    [(i, 0) for i in range(10)],                  # horizontal line
+    [(i, i) for i in range(7)],                   # diagonal line
+    [(0, 0), (1, 0), (2, 0), (1, 0), (0, 0)],     # line traced back and forth
+    [(5, 5)] * 6,                                 # one repeated point
+    [(0, 0), (3, 0), (3, 1), (0, 1), (0, 0)],     # one pixel high rectangle
+    [(0, 0), (1, 0), (1, 1), (0, 1)],             # too few points
+]
+
+
+@pytest.mark.parametrize("points", DEGENERATE)
+def test_fit_ellipses_matches_cv2_on_degenerate_contours(points):
+    contour = np.array(points, dtype=np.int32).reshape(-1, 1, 2)
+    # OpenCV perturbs degenerate point sets with its random generator, so both fits get the same seed
+    cv2.setRNGSeed(7)
+    table = morphocontour.fit_ellipses([contour])
+    if len(contour) < 5:
+        assert not table.fitted[0] and not table.accepted[0]
+        return
+    cv2.setRNGSeed(7)
+    expected = cv2.fitEllipseDirect(contour)
+    np.testing.assert_allclose(np.concatenate([table.centers[0], table.axes[0], [table.angles[0]]]),
+                               np.concatenate([expected[0], expected[1], [expected[2]]]), rtol=1e-6)
+
+
+def test_fit_ellipses_random_point_sets():
+    rng = np.random.default_rng(0)
+    contours = [rng.integers(0, 50, (k, 1, 2)).astype(np.int32) for k in (5, 6, 8, 20, 50)]
+    table = morphocontour.fit_ellipses(contours)
+    for i, contour in enumerate(contours):
+        assert_same_ellipse(table[i], cv2.fitEllipseDirect(contour))
+
+
+def test_ellipses_analysis_of_table_matches_list():
+    table = morphocontour.fit_ellipses(frame_contours(cv2.CHAIN_APPROX_SIMPLE))
+    table = table[table.accepted]
+    n, properties, ellipses_sorted = morphocontour.ellipses_analysis(table)
+    expected = morphocontour.ellipses_analysis(table.to_list())
+    assert n == expected[0]
+    assert properties == expected[1]
+    assert ellipses_sorted == expected[2]
+    assert isinstance(properties, list) and isinstance(properties[0], tuple)
+    assert morphocontour.ellipses_analysis(table[:0]) == morphocontour.ellipses_analysis([])
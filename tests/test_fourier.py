@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+import pytest
+
+import benchmark
+import morphocontour
+
+
+def test_fourier_filters_are_bounded():
+    morphocontour._fourier_filter.cache_clear()
+    rng = np.random.default_rng(0)
+    for size in range(16, 16 + 3*morphocontour._FOURIER_FILTER_SHAPES):
+        frame = rng.integers(0, 256, (size, size + 1), dtype=np.uint8)
+        expected = morphocontour.FourierHighPass(frame.shape, radius=10, optimal_size=False).apply(frame)
+        np.testing.assert_array_equal(morphocontour.apply_fourier_transform(frame), expected)
+    assert morphocontour._fourier_filter.cache_info().currsize == morphocontour._FOURIER_FILTER_SHAPES
+
+
+# Outlines of a synthetic frame (SIMPLE and NONE approximations) and hand-made polygons,
+# including a contour that doubles back on itself and one with repeated points
+def efd_contours():
+    frame, _ = benchmark.make_synthetic_frame(600, 800, 30, seed=5)
+    binary = cv2.threshold(frame, 50, 255, cv2.THRESH_BINARY)[1]
+    contours = []
+    for method in (cv2.CHAIN_APPROX_SIMPLE, cv2.CHAIN_APPROX_NONE):
+        contours += [c for c in cv2.findContours(binary, cv2.RETR_TREE, method)[0] if len(c) >= 3]
+    contours.append(np.array([[[0, 0]], [[6, 0]], [[6, 6]], [[3, 6]], [[3, 3]], [[3, 6]], [[0, 6]]], np.int32))
+    contours.append(np.array([[[5, 5]], [[5, 5]], [[9, 5]], [[9, 5]], [[9, 9]]], np.int32))
+    return contours
+
+
+# Rotated ellipses, clearly non-circular and not aligned with the axes, where the
+# normalization is well defined
+def random_ellipses(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    ellipses = []
+    for _ in range(n):
+        major = rng.uniform(15, 80)
+        minor = major / rng.uniform(1.3, 3)
+        angle = rng.uniform(1, 179)
+        points = cv2.ellipse2Poly((int(rng.integers(100, 300)), int(rng.integers(100, 300))), (int(major), int(minor)), int(angle), 0, 360, 3)
+        ellipses.append(points.reshape(-1, 1, 2).astype(np.int32))
+    return ellipses
+
+
+def perimeter(contour):
+    return cv2.arcLength(contour, True)
+
+
+@pytest.mark.parametrize('order', [1, 10, 20])
+def test_efd_matches_pyefd(order):
+    pyefd = pytest.importorskip('pyefd')
+    contours = efd_contours()
+    coeffs, a0, c0 = morphocontour.contour_fourier_features_batch(contours, order=order)
+    assert coeffs.shape == (len(contours), order, 4)
+    for i, contour in enumerate(contours):
+        tolerance = 1e-9 * perimeter(contour)
+        points = contour.reshape(-1, 2)
+        np.testing.assert_allclose(coeffs[i], pyefd.elliptic_fourier_descriptors(points, order=order), rtol=0, atol=tolerance)
+        expected_a0, expected_c0 = pyefd.calculate_dc_coefficients(points)
+        np.testing.assert_allclose([a0[i], c0[i]], [expected_a0, expected_c0], rtol=0, atol=tolerance)
+
+
+def test_normalized_efd_matches_pyefd():
+    pyefd = pytest.importorskip('pyefd')
+    contours = random_ellipses()
+    coeffs, a0, c0 = morphocontour.contour_fourier_features_batch(contours, order=10, normalize=True)
+    table = morphocontour.ContourTable.from_contours(contours)
+    assert np.array_equal(coeffs, morphocontour.contour_fourier_features_batch(table, order=10, normalize=True)[0])
+    for i, contour in enumerate(contours):
+        points = contour.reshape(-1, 2)
+        expected = pyefd.normalize_efd(pyefd.elliptic_fourier_descriptors(points, order=10))
+        np.testing.assert_allclose(coeffs[i], expected, rtol=0, atol=1e-9)
+        np.testing.assert_allclose([a0[i], c0[i]], pyefd.calculate_dc_coefficients(points), rtol=0, atol=1e-9 * perimeter(contour))
+
+
+def test_efd_cache_hits_and_order_sweep():
+    contours = efd_contours()[:20]
+    cache = morphocontour.EFDCache()
+    expected = morphocontour.contour_fourier_features_batch(contours, order=10)
+    first = morphocontour.contour_fourier_features_batch(contours, order=10, cache=cache)
+    assert (cache.hits, cache.misses, len(cache)) == (0, 20, 20)
+    for found, values in zip(first, expected):
+        np.testing.assert_array_equal(found, values)
+    # Lower orders are slices of the cached expansion
+    lower = morphocontour.contour_fourier_features_batch(contours, order=4, cache=cache)
+    assert (cache.hits, cache.misses) == (20, 20)
+    np.testing.assert_array_equal(lower[0], expected[0][:, :4])
+    # A higher order is computed again and replaces the entries
+    higher = morphocontour.contour_fourier_features_batch(contours, order=15, cache=cache)
+    assert (cache.hits, cache.misses, len(cache)) == (20, 40, 20)
+    np.testing.assert_allclose(higher[0][:, :10], expected[0], rtol=0, atol=1e-9)
+    morphocontour.contour_fourier_features_batch(contours, order=12, cache=cache)
+    assert cache.hits == 40
+    # Normalized descriptors are separate entries, and the cache keeps at most maxsize
+    ellipses = random_ellipses(20)
+    small = morphocontour.EFDCache(maxsize=5)
+    morphocontour.contour_fourier_features_batch(ellipses, order=10, normalize=True, cache=small)
+    assert len(small) == 5
+    np.testing.assert_allclose(morphocontour.contour_fourier_features_batch(ellipses[-5:], order=10, normalize=True, cache=small)[0],
+                               morphocontour.contour_fourier_features_batch(ellipses[-5:], order=10, normalize=True)[0], rtol=0, atol=1e-9)
+    assert small.hits == 5
+
+
+# A single point and a contour whose points all coincide give NaN rows, the others are unaffected
+def test_efd_of_degenerate_contours():
+    square = np.array([[[0, 0]], [[10, 0]], [[10, 10]], [[0, 10]]], np.int32)
+    contours = [square, np.array([[[4, 4]]], np.int32), np.array([[[7, 3]], [[7, 3]], [[7, 3]]], np.int32), square + 5]
+    for normalize in (False, True):
+        coeffs, a0, c0 = morphocontour.contour_fourier_features_batch(contours, order=5, normalize=normalize)
+        assert np.isnan(coeffs[1:3]).all() and np.isnan(a0[1:3]).all() and np.isnan(c0[1:3]).all()
+        assert np.isfinite(coeffs[[0, 3]]).all() and np.isfinite(a0[[0, 3]]).all()
+        np.testing.assert_allclose(coeffs[3], coeffs[0], rtol=0, atol=1e-12)
+
+
+# The original apply_fourier_transform: complex DFT, fftshift and a centered circular mask
+def reference_high_pass(gray_image):
+    dft_shift = np.fft.fftshift(cv2.dft(np.float32(gray_image), flags=cv2.DFT_COMPLEX_OUTPUT))
+    rows, cols = gray_image.shape
+    mask = np.ones((rows, cols, 2), np.uint8)
+    x, y = np.ogrid[:rows, :cols]
+    mask[(x - rows // 2) ** 2 + (y - cols // 2) ** 2 <= 10 * 10] = 0
+    img_back = cv2.idft(np.fft.ifftshift(dft_shift * mask))
+    img_back = cv2.magnitude(img_back[:, :, 0], img_back[:, :, 1])
+    cv2.normalize(img_back, img_back, 0, 255, cv2.NORM_MINMAX)
+    return np.uint8(img_back)
+
+
+@pytest.mark.parametrize('shape', [(481, 639), (480, 640), (64, 64), (37, 53), (120, 31)])
+def test_fourier_high_pass_matches_original(shape):
+    rng = np.random.default_rng(shape[0])
+    frames = [rng.integers(0, 256, shape, dtype=np.uint8)]
+    if min(shape) > 100:
+        frames.append(benchmark.make_synthetic_frame(*shape, 10, seed=1)[0])
+    high_pass = morphocontour.FourierHighPass(shape)
+    assert high_pass.fft_shape == shape
+    for frame in frames:
+        expected = reference_high_pass(frame).astype(int)
+        assert np.abs(high_pass.apply(frame).astype(int) - expected).max() <= 1
+        assert np.abs(morphocontour.apply_fourier_transform(frame).astype(int) - expected).max() <= 1
+    # The optimal DFT size is opt-in
+    assert morphocontour.FourierHighPass(shape, optimal_size=True).fft_shape == (cv2.getOptimalDFTSize(shape[0]), cv2.getOptimalDFTSize(shape[1]))
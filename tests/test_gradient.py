@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+import pytest
+
+import benchmark
+import morphocontour
+
+
+# Contours of a synthetic frame, including lines and single pixels without area, and hand-made
+# collinear and single-point contours whose centroid falls back to their first point
+def gradient_contours():
+    frame, _ = benchmark.make_synthetic_frame(400, 500, 20, seed=9)
+    binary = cv2.threshold(frame, 50, 255, cv2.THRESH_BINARY)[1]
+    binary[280:380, 20:150] = 0
+    cv2.line(binary, (30, 300), (120, 330), 255, 1)
+    binary[350, 40] = 255
+    contours = list(cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[0])
+    contours += [np.array([[[60, 100]], [[80, 100]], [[100, 100]]], np.int32), np.array([[[250, 200]]], np.int32),
+                 np.array([[[10, 10]], [[20, 20]], [[10, 10]]], np.int32)]
+    return frame, contours
+
+
+def test_check_gradient_batch_matches_check_gradient():
+    frame, contours = gradient_contours()
+    flat = [c for c in contours if cv2.moments(c)['m00'] == 0]
+    assert len(flat) >= 5
+    expected = [morphocontour.check_gradient(frame, contour) for contour in contours]
+    assert any(expected) and not all(expected)
+    np.testing.assert_array_equal(morphocontour.check_gradient_batch(frame, contours), expected)
+    table = morphocontour.ContourTable.from_contours(contours)
+    np.testing.assert_array_equal(morphocontour.check_gradient_batch(frame, table), expected)
+    assert morphocontour.check_gradient_batch(frame, []).shape == (0,)
+
+
+# With an offset, the image is a window of the frame at that position and the contours stay in
+# frame coordinates
+def test_check_gradient_batch_with_offset():
+    frame, contours = gradient_contours()
+    x0, y0 = 5, 8
+    window = frame[y0:, x0:].copy()
+    inside = [c for c in contours if c[:, 0, 0].min() >= x0 and c[:, 0, 1].min() >= y0
+              and morphocontour.get_centroid(c)[0] >= x0 and morphocontour.get_centroid(c)[1] >= y0]
+    expected = [morphocontour.check_gradient(window, contour - np.array([x0, y0], np.int32)) for contour in inside]
+    np.testing.assert_array_equal(morphocontour.check_gradient_batch(window, inside, offset=(x0, y0)), expected)
+    np.testing.assert_array_equal(expected, [morphocontour.check_gradient(frame, contour) for contour in inside])
+
+
+# edges.png is a rendered figure of the binarized frame, as with pyplot before, not the raw mask
+def test_gradient_labeling_figures(tmp_path):
+    pytest.importorskip('matplotlib')
+    frame, _ = benchmark.make_jet_frame(6, seed=1)
+    path = str(tmp_path / "jet.png")
+    cv2.imwrite(path, frame)
+    morphocontour.gradient_labeling(path, dpi=50)
+    edges = cv2.imread(path + 'edges.png')
+    assert edges.shape == (240, 320, 3)
+    assert cv2.imread(path + '_morphology.jpg').shape == (200, 600, 3)
@@ -0,0 +1,106 @@
+import itertools
+
+import cv2
+import numpy as np
+import pytest
+
+import morphocontour
+
+
+# Random rectangles, diamonds and ellipses, clustered so that many boxes overlap, touch or are a
+# few pixels apart
+def random_contours(n, seed):
+    rng = np.random.default_rng(seed)
+    contours = []
+    for _ in range(n):
+        x, y = (int(v) for v in rng.integers(0, 300, 2))
+        w, h = (int(v) for v in rng.integers(1, 40, 2))
+        kind = rng.integers(3)
+        if kind == 0:
+            points = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+        elif kind == 1:
+            points = [(x + w // 2, y), (x + w, y + h // 2), (x + w // 2, y + h), (x, y + h // 2)]
+        else:
+            points = cv2.ellipse2Poly((x + w // 2, y + h // 2), (w // 2 + 1, h // 2 + 1), int(rng.integers(180)), 0, 360, 10)
+        contours.append(np.array(points, np.int32).reshape(-1, 1, 2))
+    return contours
+
+
+def boxes(index):
+    return index.x0, index.y0, index.x1, index.y1
+
+
+def brute_force_pairs(index, margin):
+    x0, y0, x1, y1 = boxes(index)
+    return [(i, j) for i, j in itertools.combinations(range(len(index)), 2)
+            if x0[i] <= x1[j] + margin and x0[j] <= x1[i] + margin and y0[i] <= y1[j] + margin and y0[j] <= y1[i] + margin]
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('cell_size', [None, 1, 7, 500])
+def test_candidate_pairs_match_brute_force(seed, cell_size):
+    index = morphocontour.ContourIndex(random_contours(120, seed), cell_size=cell_size)
+    for margin in (0, 1, 5, 30):
+        pairs = index.candidate_pairs(margin)
+        assert pairs.shape[1] == 2
+        assert [tuple(pair) for pair in pairs.tolist()] == brute_force_pairs(index, margin)
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('cell_size', [None, 1, 7, 500])
+def test_query_region_matches_brute_force(seed, cell_size):
+    index = morphocontour.ContourIndex(random_contours(120, seed), cell_size=cell_size)
+    x0, y0, x1, y1 = boxes(index)
+    rng = np.random.default_rng(seed + 100)
+    # Rectangles inside, across and entirely outside the indexed area, and empty ones
+    for _ in range(200):
+        x, y = (int(v) for v in rng.integers(-100, 450, 2))
+        w, h = (int(v) for v in rng.integers(0, 120, 2))
+        found = index.query_region(x, y, w, h)
+        expected = np.flatnonzero((x0 <= x + w - 1) & (x1 >= x) & (y0 <= y + h - 1) & (y1 >= y)) if w > 0 and h > 0 else []
+        np.testing.assert_array_equal(found, expected)
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('cell_size', [None, 1, 7, 500])
+def test_nearest_matches_brute_force(seed, cell_size):
+    index = morphocontour.ContourIndex(random_contours(120, seed), cell_size=cell_size)
+    centroid = index.table.centroid
+    rng = np.random.default_rng(seed + 200)
+    # Query points inside the grid and far outside it, so rings grow until they cover the grid
+    points = [(int(x), int(y)) for x, y in rng.integers(-50, 400, (150, 2))] + [(-1000, -1000), (2000, 150), (150, 5000)]
+    for x, y in points:
+        for k in (1, 3, 20, 200):
+            found, distance = index.nearest(x, y, k)
+            expected_distance = np.hypot(centroid[:, 0] - x, centroid[:, 1] - y)
+            expected = np.lexsort((np.arange(len(index)), expected_distance))[:k]
+            np.testing.assert_array_equal(found, expected)
+            np.testing.assert_array_equal(distance, expected_distance[expected])
+
+
+# Centroids at the same distance on both sides of a cell border: ties go to the lower index even
+# when it is in the next ring
+def test_nearest_tie_across_cells():
+    points = [(10, 5), (0, 5), (0, 0), (19, 19)]
+    index = morphocontour.ContourIndex([np.array([[point]], np.int32) for point in points], cell_size=10)
+    found, distance = index.nearest(5, 5, 1)
+    np.testing.assert_array_equal(found, [0])
+    np.testing.assert_array_equal(distance, [5.0])
+
+
+@pytest.mark.parametrize('edges_only', [True, False])
+def test_intersecting_pairs_match_all_pairs(edges_only):
+    contours = random_contours(60, 7)
+    index = morphocontour.ContourIndex(contours)
+    expected = [(i, j) for i, j in itertools.combinations(range(len(contours)), 2)
+                if morphocontour.contour_intersect(index.table.contour(i), index.table.contour(j), edges_only)
+                or morphocontour.contour_intersect(index.table.contour(j), index.table.contour(i), edges_only)]
+    assert expected
+    assert [tuple(pair) for pair in index.intersecting_pairs(edges_only).tolist()] == expected
+
+
+def test_empty_index():
+    index = morphocontour.ContourIndex([])
+    assert index.candidate_pairs().shape == (0, 2)
+    assert len(index.query_region(0, 0, 10, 10)) == 0
+    assert len(index.nearest(5, 5, 3)[0]) == 0
@@ -0,0 +1,117 @@
+import itertools
+
+import cv2
+import numpy as np
+import pytest
+
+import morphocontour
+
+
+# The original contour_intersect: one pointPolygonTest per query point
+def reference_intersecting_points(cnt_ref, cnt_query, edges_only=True):
+    intersecting_pts = []
+    for pt in cnt_query:
+        x, y = pt[0]
+        distance = cv2.pointPolygonTest(cnt_ref, (int(x), int(y)), True)
+        if (edges_only and distance == 0) or (not edges_only and distance >= 0):
+            intersecting_pts.append(pt[0])
+    return np.array(intersecting_pts, dtype=np.int32).reshape(-1, 2)
+
+
+def polygon(points):
+    return np.array(points, dtype=np.int32).reshape(-1, 1, 2)
+
+
+# Rectangles (horizontal and vertical edges), collinear vertices, a concave notch, a spike that
+# doubles back on itself, and the degenerate segment and single point
+POLYGONS = {
+    'rectangle': polygon([(2, 2), (12, 2), (12, 8), (2, 8)]),
+    'collinear': polygon([(2, 2), (7, 2), (12, 2), (12, 8), (7, 8), (2, 8)]),
+    'triangle': polygon([(0, 0), (10, 5), (0, 10)]),
+    'diamond': polygon([(5, 0), (10, 5), (5, 10), (0, 5)]),
+    'concave': polygon([(0, 0), (10, 0), (10, 10), (5, 3), (0, 10)]),
+    'spike': polygon([(0, 0), (6, 0), (6, 6), (3, 6), (3, 3), (3, 6), (0, 6)]),
+    'clockwise': polygon([(1, 1), (1, 9), (9, 9), (9, 1)]),
+    'segment': polygon([(3, 3), (9, 3)]),
+    'point': polygon([(4, 4)]),
+}
+
+
+# Filled blobs whose RETR_TREE contours include a hole with an island, touching rectangles and a
+# rotated ellipse
+def scene_contours(method):
+    image = np.zeros((200, 200), np.uint8)
+    cv2.circle(image, (60, 60), 30, 255, -1)
+    cv2.circle(image, (60, 60), 10, 0, -1)
+    cv2.circle(image, (60, 60), 4, 255, -1)
+    cv2.rectangle(image, (100, 20), (150, 60), 255, -1)
+    cv2.rectangle(image, (151, 20), (180, 40), 255, -1)
+    cv2.ellipse(image, ((130, 140), (60, 30), 30), 255, -1)
+    cv2.rectangle(image, (20, 150), (40, 190), 255, -1)
+    contours, _ = cv2.findContours(image, cv2.RETR_TREE, method)
+    return list(contours)
+
+
+def all_contours():
+    contours = scene_contours(cv2.CHAIN_APPROX_SIMPLE) + scene_contours(cv2.CHAIN_APPROX_NONE)
+    contours += list(POLYGONS.values())
+    # Shifted copies that share edges (1), overlap (30) and just touch (31) the originals
+    contours += [c + np.array([[[shift, 0]]], np.int32) for c in contours[:6] for shift in (1, 30, 31)]
+    return contours
+
+
+@pytest.mark.parametrize('name', sorted(POLYGONS))
+def test_points_in_polygon_matches_point_polygon_test(name):
+    cnt = POLYGONS[name]
+    points = np.array([(x, y) for y in range(-2, 15) for x in range(-2, 15)])
+    expected = [int(cv2.pointPolygonTest(cnt, (int(x), int(y)), False)) for x, y in points]
+    np.testing.assert_array_equal(morphocontour._points_in_polygon(cnt, points), expected)
+
+
+@pytest.mark.parametrize('method', [cv2.CHAIN_APPROX_SIMPLE, cv2.CHAIN_APPROX_NONE])
+def test_points_in_polygon_on_found_contours(method):
+    for cnt in scene_contours(method):
+        x, y, w, h = cv2.boundingRect(cnt)
+        points = np.array([(px, py) for py in range(y - 2, y + h + 2) for px in range(x - 2, x + w + 2)])
+        expected = [int(cv2.pointPolygonTest(cnt, (int(px), int(py)), False)) for px, py in points]
+        np.testing.assert_array_equal(morphocontour._points_in_polygon(cnt, points), expected)
+
+
+@pytest.mark.parametrize('edges_only', [True, False])
+def test_contour_intersect_matches_reference(edges_only):
+    contours = all_contours()
+    # Covers both the short-query loop and the chunked _points_in_polygon path
+    assert any(len(c) <= morphocontour._INTERSECT_LOOP_POINTS for c in contours)
+    assert any(len(c) > morphocontour._INTERSECT_LOOP_POINTS for c in contours)
+    for cnt_ref, cnt_query in itertools.permutations(contours, 2):
+        expected = reference_intersecting_points(cnt_ref, cnt_query, edges_only)
+        assert morphocontour.contour_intersect(cnt_ref, cnt_query, edges_only) == (len(expected) > 0)
+        np.testing.assert_array_equal(
+            morphocontour.contour_intersection_points(cnt_ref, cnt_query, edges_only), expected)
+
+
+def test_contour_intersect_cases():
+    outer = polygon([(10, 10), (40, 10), (40, 40), (10, 40)])
+    inner = polygon([(20, 20), (30, 20), (30, 30), (20, 30)])
+    sharing_edge = polygon([(40, 10), (60, 10), (60, 40), (40, 40)])
+    sharing_vertex = polygon([(40, 40), (60, 40), (60, 60), (40, 60)])
+    disjoint = polygon([(41, 10), (60, 10), (60, 40), (41, 40)])
+    assert not morphocontour.contour_intersect(outer, inner)
+    assert morphocontour.contour_intersect(outer, inner, edges_only=False)
+    assert not morphocontour.contour_intersect(inner, outer, edges_only=False)
+    assert morphocontour.contour_intersect(outer, sharing_edge)
+    assert morphocontour.contour_intersect(outer, sharing_vertex)
+    assert not morphocontour.contour_intersect(outer, disjoint)
+    assert not morphocontour.contour_intersect(outer, disjoint, edges_only=False)
+
+
+# The raster method is approximate on the outline but agrees away from it
+def test_raster_method_on_separated_contours():
+    outer = scene_contours(cv2.CHAIN_APPROX_NONE)
+    for cnt_ref, cnt_query in itertools.permutations(outer, 2):
+        distances = [abs(cv2.pointPolygonTest(cnt_ref, (int(x), int(y)), True)) for x, y in cnt_query[:, 0]]
+        if min(distances) < 2:
+            continue
+        for edges_only in (True, False):
+            expected = len(reference_intersecting_points(cnt_ref, cnt_query, edges_only)) > 0
+            assert morphocontour.contour_intersect(cnt_ref, cnt_query, edges_only, method='raster') == expected
@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+
+import benchmark
+import morphocontour
+
+
+def color_jpeg(tmp_path):
+    frame, _ = benchmark.make_synthetic_frame(1200, 1800, 20, seed=1)
+    rng = np.random.default_rng(0)
+    # Channels that differ, so decoder and cvtColor gray conversions can disagree
+    color = np.dstack([frame, np.clip(frame.astype(int) + rng.integers(-40, 40, frame.shape), 0, 255), frame // 2]).astype(np.uint8)
+    path = str(tmp_path / "frame.jpg")
+    cv2.imwrite(path, color)
+    return path
+
+
+def test_load_image_keeps_cvtcolor_conversion(tmp_path):
+    path = color_jpeg(tmp_path)
+    expected = cv2.cvtColor(cv2.imread(path)[400:1100, 230:1660], cv2.COLOR_BGR2GRAY)
+    np.testing.assert_array_equal(morphocontour.load_image(path, rows=(400, 1100), cols=(230, 1660)), expected)
+    fast = morphocontour.load_image(path, rows=(400, 1100), cols=(230, 1660), fast_decode=True)
+    assert fast.shape == expected.shape
+
+
+def test_contour_finder_on_color_file_matches_decoded_frame(tmp_path):
+    path = color_jpeg(tmp_path)
+    from_path = morphocontour.contour_finder(path, return_table=True)[0]
+    from_frame = morphocontour.contour_finder(cv2.imread(path), return_table=True)[0]
+    np.testing.assert_array_equal(from_path.points, from_frame.points)
+    np.testing.assert_array_equal(from_path.offsets, from_frame.offsets)
+
+
+def test_image_sequence_source_fast_decode_is_opt_in(tmp_path):
+    path = color_jpeg(tmp_path)
+    np.testing.assert_array_equal(morphocontour.ImageSequenceSource([path])[0], cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2GRAY))
+    np.testing.assert_array_equal(morphocontour.ImageSequenceSource([path], fast_decode=True)[0], cv2.imread(path, cv2.IMREAD_GRAYSCALE))
+
+
+def test_gray_files_stay_single_channel(tmp_path, monkeypatch):
+    frame, _ = benchmark.make_synthetic_frame(1200, 1800, 20, seed=2)
+    path = str(tmp_path / "frame.png")
+    cv2.imwrite(path, frame)
+    # The file is decoded once, without expanding it to three channels
+    imread = cv2.imread
+    decoded = []
+    monkeypatch.setattr(cv2, "imread", lambda *args: decoded.append(imread(*args)) or decoded[-1])
+    roi = morphocontour.load_image(path, rows=(400, 1100), cols=(230, 1660))
+    assert decoded[0].ndim == 2
+    np.testing.assert_array_equal(roi, cv2.cvtColor(imread(path), cv2.COLOR_BGR2GRAY)[400:1100, 230:1660])
+    ellipses, n = morphocontour.droplet_boundary(path)
+    assert decoded[-1].ndim == 2
+    assert (ellipses, n) == morphocontour.droplet_boundary(frame)
+
+
+def test_reduced_decode_scales_the_crop(tmp_path):
+    path = color_jpeg(tmp_path)
+    full = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2GRAY)
+    for reduce in (2, 4):
+        roi = morphocontour.load_image(path, rows=(400, 1100), cols=(230, 1660), reduce=reduce)
+        expected = cv2.cvtColor(cv2.imread(path, {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4}[reduce]), cv2.COLOR_BGR2GRAY)
+        np.testing.assert_array_equal(roi, expected[400 // reduce:1100 // reduce, 230 // reduce:1660 // reduce])
+        fast = morphocontour.load_image(path, rows=(400, 1100), cols=(230, 1660), fast_decode=True, reduce=reduce)
+        assert fast.shape == roi.shape
+        # Decoded frames are resized to the same shape
+        frame = morphocontour.load_image(full, rows=(400, 1100), cols=(230, 1660), reduce=reduce)
+        assert frame.shape == roi.shape
+
+
+def test_entry_points_on_reduced_frames(tmp_path):
+    frame, _ = benchmark.make_synthetic_frame(1200, 1800, 20, seed=3)
+    path = str(tmp_path / "frame.png")
+    cv2.imwrite(path, frame)
+    full = morphocontour.contour_finder(path, return_table=True)[0]
+    reduced = morphocontour.contour_finder(path, reduce=2, return_table=True)[0]
+    assert reduced.bbox[:, 0].max() < (1660 - 230) // 2 and reduced.bbox[:, 1].max() < (1100 - 400) // 2
+    # Same droplets, with areas in reduced pixels
+    assert abs(len(reduced) - len(full)) <= 2
+    np.testing.assert_allclose(np.sort(reduced.area)[-5:] * 4, np.sort(full.area)[-5:], rtol=0.1)
+
+    jet, _ = benchmark.make_jet_frame(6, seed=1)
+    volumes = morphocontour.droplet_volume_estimation(jet)
+    reduced_volumes = morphocontour.droplet_volume_estimation(jet, reduce=2)
+    assert reduced_volumes[1] == volumes[1]
+    # Volumes in the same units, the row scan's diameters are about one reduced pixel shorter
+    np.testing.assert_allclose(reduced_volumes[0], volumes[0], rtol=0.25)
@@ -0,0 +1,81 @@
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytest
+
+import benchmark
+import morphocontour
+
+
+def frames(n=3, height=1200, width=1800):
+    return [benchmark.make_synthetic_frame(height, width, 20, seed=seed)[0] for seed in range(n)]
+
+
+@pytest.mark.parametrize('droplet_hierarchy_check, gradient_check', [(False, False), (True, False), (False, True)])
+def test_preprocessor_matches_contour_finder(droplet_hierarchy_check, gradient_check, tmp_path):
+    pre = morphocontour.Preprocessor()
+    options = dict(droplet_hierarchy_check=droplet_hierarchy_check, gradient_check=gradient_check, return_table=True)
+    images = frames()
+    # A color frame and a file are converted like contour_finder converts them
+    images.append(cv2.cvtColor(images[0], cv2.COLOR_GRAY2BGR) + np.uint8([0, 3, 7]))
+    images.append(str(tmp_path / "frame.png"))
+    cv2.imwrite(images[-1], images[3])
+    for image in images:
+        table, hierarchy = pre.contour_finder(image, **options)
+        expected, expected_hierarchy = morphocontour.contour_finder(image, **options)
+        np.testing.assert_array_equal(table.points, expected.points)
+        np.testing.assert_array_equal(table.offsets, expected.offsets)
+        np.testing.assert_array_equal(hierarchy, expected_hierarchy)
+
+
+def test_preprocessor_matches_droplet_boundary_and_gradient_labeling():
+    boundary = morphocontour.Preprocessor.for_droplet_boundary()
+    labeling = morphocontour.Preprocessor.for_gradient_labeling()
+    images = [benchmark.make_jet_frame(8, seed=seed)[0] for seed in range(2)] + frames(2, 600, 900)
+    for image in images:
+        assert boundary.droplet_boundary(image) == morphocontour.droplet_boundary(image)
+        for found, expected in zip(labeling.gradient_labeling(image), morphocontour.gradient_labeling(image, save_figures=False)):
+            np.testing.assert_array_equal(found, expected)
+
+
+# The buffers of a frame shape are kept for the following frames of that shape and replaced when
+# the shape changes
+def test_preprocessor_reuses_buffers_per_shape():
+    pre = morphocontour.Preprocessor(crop_x_lim=None, crop_y_lim=None)
+    small, large = frames(2, 300, 400), frames(1, 500, 600)
+    binary = pre.binarize(small[0])
+    buffers = pre._gray, pre._contrast, pre._binary
+    assert binary is pre._binary and pre.shape == (300, 400)
+    # A gray frame needs no conversion, the gray stage is a view of it
+    assert np.shares_memory(pre.gray(small[1]), small[1])
+    assert pre.binarize(small[1]) is binary
+    assert (pre._gray, pre._contrast, pre._binary) == buffers
+    np.testing.assert_array_equal(binary, cv2.threshold(morphocontour.enhance_contrast(small[1]), 50, 255, cv2.THRESH_BINARY)[1])
+    assert pre.binarize(large[0]).shape == (500, 600) and pre.shape == (500, 600)
+    assert pre._binary is not buffers[2]
+    np.testing.assert_array_equal(pre.binarize(small[0]), cv2.threshold(morphocontour.enhance_contrast(small[0]), 50, 255, cv2.THRESH_BINARY)[1])
+
+
+# After the first frame of a shape, the stages allocate nothing of the size of a frame
+def test_preprocessor_steady_state_allocates_no_images():
+    images = frames(3)
+    color = [cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) for image in images]
+    pre = morphocontour.Preprocessor()
+    pre.binarize(color[0])
+    roi_bytes = pre._binary.nbytes
+    tracemalloc.start()
+    try:
+        for image in color[1:]:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            pre.binarize(image)
+            assert tracemalloc.get_traced_memory()[1] - before < roi_bytes // 10
+        # Without the preprocessor the same stages allocate several images
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        roi = cv2.cvtColor(color[1][400:1100, 230:1660], cv2.COLOR_BGR2GRAY)
+        cv2.threshold(morphocontour.enhance_contrast(roi), 50, 255, cv2.THRESH_BINARY)
+        assert tracemalloc.get_traced_memory()[1] - before >= 2 * roi_bytes
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+import pytest
+
+import benchmark
+import morphocontour
+
+PARAMETERS = dict(crop_x_lim=None, crop_y_lim=None)
+
+
+def contours_by_points(table):
+    return {contour.tobytes(): (area, tuple(centroid)) for contour, area, centroid in zip(table.contours(), table.area, table.centroid)}
+
+
+# Sparse droplets, spots and satellites, plus a droplet with a thin filament that reaches out of
+# its coarse window
+def sparse_frame():
+    frame, _ = benchmark.make_synthetic_frame(900, 1200, 25, seed=4)
+    cv2.circle(frame, (300, 300), 20, benchmark.DROPLET, -1)
+    cv2.line(frame, (300, 300), (420, 330), benchmark.DROPLET, 2)
+    return frame
+
+
+@pytest.mark.parametrize('factor', [2, 4, 6])
+@pytest.mark.parametrize('droplet_hierarchy_check, gradient_check', [(False, False), (True, False), (False, True)])
+def test_pyramid_finds_the_contours_of_contour_finder(factor, droplet_hierarchy_check, gradient_check):
+    frame = sparse_frame()
+    options = dict(droplet_hierarchy_check=droplet_hierarchy_check, gradient_check=gradient_check, return_table=True, **PARAMETERS)
+    whole, _ = morphocontour.contour_finder(frame, **options)
+    pyramid, _ = morphocontour.contour_finder_pyramid(frame, factor=factor, **options)
+    expected, found = contours_by_points(whole), contours_by_points(pyramid)
+    # Nothing that contour_finder does not find, and every droplet covering a block
+    assert set(found) <= set(expected)
+    for key, value in found.items():
+        assert value == expected[key]
+    large = whole.filter(whole.bbox[:, 2:].min(axis=1) >= 2 * factor)
+    assert set(contours_by_points(large)) <= set(found)
+    assert any(points.tobytes() in found for points in whole.contours() if len(points) > 40)
+
+
+def test_pyramid_on_jet_frames():
+    for seed in range(3):
+        frame, _ = benchmark.make_jet_frame(30, seed=seed)
+        whole, _ = morphocontour.contour_finder(frame, return_table=True)
+        pyramid, _ = morphocontour.contour_finder_pyramid(frame, return_table=True)
+        assert set(contours_by_points(pyramid)) == set(contours_by_points(whole))
+
+
+# Windows covering most of the frame: the whole frame is processed as in contour_finder
+def test_pyramid_falls_back_on_dense_frames():
+    frame = np.full((400, 400), benchmark.BACKGROUND, np.uint8)
+    for y in range(30, 400, 24):
+        for x in range(12, 400, 24):
+            cv2.circle(frame, (x, y), 6, benchmark.DROPLET, -1)
+    whole = morphocontour.contour_finder(frame, **PARAMETERS)
+    pyramid = morphocontour.contour_finder_pyramid(frame, **PARAMETERS)
+    assert len(pyramid[0]) == len(whole[0])
+    for contour, expected in zip(pyramid[0], whole[0]):
+        np.testing.assert_array_equal(contour, expected)
+    np.testing.assert_array_equal(pyramid[3], whole[3])
+
+
+def test_pyramid_on_an_empty_frame():
+    frame = np.full((300, 400), benchmark.BACKGROUND, np.uint8)
+    contours, areas, centroids, hierarchy = morphocontour.contour_finder_pyramid(frame, **PARAMETERS)
+    assert contours == [] and areas == [] and centroids == []
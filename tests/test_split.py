@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+
+import morphocontour
+
+
+# The original split_contour, on the full frame
+def reference_split_contour(img_gray, contour):
+    img = np.zeros_like(img_gray)
+    cv2.drawContours(img, [contour], -1, 255, -1)
+    dist = cv2.distanceTransform(img, cv2.DIST_L2, 3)
+    cv2.normalize(dist, dist, 0, 255.0, cv2.NORM_MINMAX)
+    dist = dist.astype(np.uint8)
+    thresh = cv2.threshold(dist, 50, 255, cv2.THRESH_BINARY)[1]
+    dilated = cv2.dilate(thresh, np.ones((9, 9), dtype=np.uint8))
+    return cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+
+# Outer contours of touching and overlapping groups of two to four circles, pairs of circles
+# joined by a narrow neck, many of them cut by the frame edges, plus a thin bar and a single pixel
+def merged_blobs(seed, height=160, width=200):
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width), np.uint8)
+    for _ in range(6):
+        x, y = int(rng.integers(-10, width + 10)), int(rng.integers(-10, height + 10))
+        for _ in range(int(rng.integers(2, 5))):
+            radius = int(rng.integers(4, 20))
+            cv2.circle(image, (x, y), radius, 255, -1)
+            x, y = x + int(rng.integers(-radius, radius + 1)) * 2 // 3 + radius, y + int(rng.integers(-radius, radius + 1)) // 2
+    for _ in range(3):
+        x, y, radius = int(rng.integers(0, width)), int(rng.integers(0, height)), int(rng.integers(8, 20))
+        x2, y2 = x + int(rng.integers(3, 5)) * radius * int(rng.choice([-1, 1])), y + int(rng.integers(-radius, radius + 1))
+        cv2.circle(image, (x, y), radius, 255, -1)
+        cv2.circle(image, (x2, y2), int(rng.integers(8, 20)), 255, -1)
+        cv2.line(image, (x, y), (x2, y2), 255, int(rng.integers(1, 4)))
+    cv2.rectangle(image, (int(rng.integers(width)), int(rng.integers(height))), (width - 1, int(rng.integers(height))), 255, 1)
+    image[int(rng.integers(height)), int(rng.integers(width))] = 255
+    contours = cv2.findContours(image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+    return image, contours
+
+
+def test_split_contour_matches_full_frame():
+    at_edge, split = 0, 0
+    for seed in range(40):
+        image, contours = merged_blobs(seed)
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            at_edge += x == 0 or y == 0 or x + w == image.shape[1] or y + h == image.shape[0]
+            found, hierarchy = morphocontour.split_contour(image, contour)
+            expected, expected_hierarchy = reference_split_contour(image, contour)
+            assert len(found) == len(expected)
+            for piece, expected_piece in zip(found, expected):
+                np.testing.assert_array_equal(piece, expected_piece)
+            np.testing.assert_array_equal(hierarchy, expected_hierarchy)
+            split += len(found) > 1
+    # Contours cut by the frame edges and contours split into several pieces are covered
+    assert at_edge > 20 and split > 20
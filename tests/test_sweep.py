@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import benchmark
+import morphocontour
+
+PARAMETERS = dict(crop_x_lim=None, crop_y_lim=None)
+
+
+def frame():
+    image, _ = benchmark.make_synthetic_frame(500, 700, 25, seed=8)
+    return image
+
+
+@pytest.mark.parametrize('droplet_hierarchy_check, gradient_check', [(False, False), (True, False), (False, True)])
+def test_sweep_matches_contour_finder(droplet_hierarchy_check, gradient_check):
+    image = frame()
+    thresholds = [20, 35.5, 50, 50.4, 80, 120, 200]
+    options = dict(droplet_hierarchy_check=droplet_hierarchy_check, gradient_check=gradient_check, **PARAMETERS)
+    sweep = morphocontour.contour_finder_sweep(image, thresholds[::-1], **options)
+    np.testing.assert_array_equal(sweep.thresholds, thresholds)
+    for i, threshold in enumerate(thresholds):
+        table, hierarchy = morphocontour.contour_finder(image, threshold=threshold, return_table=True, **options)
+        np.testing.assert_array_equal(sweep.tables[i].points, table.points)
+        np.testing.assert_array_equal(sweep.tables[i].offsets, table.offsets)
+        np.testing.assert_array_equal(sweep.hierarchies[i], hierarchy)
+        assert sweep.counts[i] == len(table)
+        assert sweep.median_area[i] == (np.median(table.area) if len(table) else 0.0)
+
+
+# Thresholds with no pixel value of the enhanced image between them give the same binarization
+# and share one findContours result
+def test_sweep_groups_equal_binarizations():
+    image = frame()
+    contrast = morphocontour.enhance_contrast(image)
+    present = np.flatnonzero(np.bincount(contrast.ravel(), minlength=256))
+    # A grey level missing from the image, with the level above it present: thresholds from the
+    # level below it up to just below the level above are equal
+    missing = np.setdiff1d(np.arange(present[0], present[-1]), present)
+    gap = int(missing[np.isin(missing + 1, present)][0])
+    thresholds = [gap - 1, gap - 0.5, gap, gap + 0.5, gap + 1, present[-1], 255]
+    sweep = morphocontour.contour_finder_sweep(image, thresholds, **PARAMETERS)
+    assert sweep.tables[0] is sweep.tables[1] is sweep.tables[2] is sweep.tables[3]
+    assert sweep.tables[3] is not sweep.tables[4]
+    assert sweep.tables[5] is sweep.tables[6]
+    assert sweep.distinct == 3
+    for threshold, table in zip(thresholds, sweep.tables):
+        expected = morphocontour.contour_finder(image, threshold=threshold, return_table=True, **PARAMETERS)[0]
+        np.testing.assert_array_equal(table.points, expected.points)
+
+
+# A sweep and single runs share the cache entries of every stage
+def test_sweep_and_contour_finder_share_cache_entries():
+    image = frame()
+    cache = morphocontour.StageCache()
+    morphocontour.contour_finder_sweep(image, [40, 50, 60], cache=cache, **PARAMETERS)
+    misses = cache.misses
+    for threshold in (40, 50, 60):
+        morphocontour.contour_finder(image, threshold=threshold, cache=cache, **PARAMETERS)
+    morphocontour.contour_finder(image, threshold=np.uint8(50), cache=cache, **PARAMETERS)
+    assert cache.misses == misses
+    morphocontour.contour_finder_sweep(image, [40, 50], cache=cache, **PARAMETERS)
+    assert cache.misses == misses
@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+
+import benchmark
+import morphocontour
+
+
+# RETR_TREE contours of a synthetic frame (holes are clockwise, outer contours counter-clockwise,
+# in both approximations), plus degenerate ones: a single point, a segment and a contour that
+# doubles back on itself
+def table_contours():
+    frame, _ = benchmark.make_synthetic_frame(500, 700, 30, seed=10)
+    binary = cv2.threshold(frame, 50, 255, cv2.THRESH_BINARY)[1]
+    contours = []
+    for method in (cv2.CHAIN_APPROX_SIMPLE, cv2.CHAIN_APPROX_NONE):
+        contours += list(cv2.findContours(binary, cv2.RETR_TREE, method)[0])
+    contours += [np.array([[[7, 9]]], np.int32), np.array([[[3, 3]], [[40, 12]]], np.int32),
+                 np.array([[[0, 0]], [[6, 0]], [[6, 6]], [[3, 6]], [[3, 3]], [[3, 6]], [[0, 6]]], np.int32)]
+    return contours
+
+
+def assert_matches_cv2(table, contours):
+    assert len(table) == len(contours)
+    for i, contour in enumerate(contours):
+        np.testing.assert_array_equal(table.contour(i), contour)
+        moments = cv2.moments(contour)
+        np.testing.assert_allclose([table.m00[i], table.m10[i], table.m01[i]], [moments['m00'], moments['m10'], moments['m01']], rtol=1e-12, atol=1e-9)
+        assert table.area[i] == cv2.contourArea(contour)
+        assert tuple(table.centroid[i]) == tuple(morphocontour.get_centroid(contour))
+        assert tuple(table.bbox[i]) == cv2.boundingRect(contour)
+
+
+def test_contour_properties_match_cv2():
+    contours = table_contours()
+    table = morphocontour.ContourTable.from_contours(contours)
+    assert_matches_cv2(table, contours)
+    np.testing.assert_array_equal(table.index, np.arange(len(contours)))
+    empty = morphocontour.ContourTable.from_contours([])
+    assert len(empty) == 0 and empty.centroid.shape == (0, 2) and empty.bbox.shape == (0, 4)
+
+
+def test_take_filter_and_sort_keep_the_properties():
+    contours = table_contours()
+    table = morphocontour.ContourTable.from_contours(contours)
+    rng = np.random.default_rng(0)
+    indices = rng.permutation(len(contours))[:40]
+    taken = table.take(indices)
+    assert_matches_cv2(taken, [contours[i] for i in indices])
+    np.testing.assert_array_equal(taken.index, indices)
+
+    mask = table.area > 50
+    filtered = table.filter(mask)
+    assert_matches_cv2(filtered, [c for c, keep in zip(contours, mask) if keep])
+    assert_matches_cv2(table[mask], [c for c, keep in zip(contours, mask) if keep])
+
+    # Same order as sorted(), including the ties of equal areas
+    for reverse in (True, False):
+        expected = sorted(contours, key=cv2.contourArea, reverse=reverse)
+        assert_matches_cv2(table.sort_by_area(reverse=reverse), expected)
+    contours_list, areas, centroids = filtered.sort_by_area().to_lists()
+    expected = sorted([c for c, keep in zip(contours, mask) if keep], key=cv2.contourArea, reverse=True)
+    assert areas == [cv2.contourArea(c) for c in expected]
+    assert centroids == [tuple(morphocontour.get_centroid(c)) for c in expected]
+
+    # concat of slices gives the original table back
+    assert_matches_cv2(morphocontour.ContourTable.concat([table[:10], table[10:]]), contours)
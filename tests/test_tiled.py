@@ -0,0 +1,71 @@
+import warnings
+
+import cv2
+import numpy as np
+import pytest
+
+import benchmark
+import morphocontour
+
+
+# Droplets crossing tile borders, an annulus with an island (nested contours) and a blob larger
+# than the overlap, so windows have to be grown around it. The bright background is one region
+# spanning the whole frame.
+def mosaic():
+    frame, _ = benchmark.make_synthetic_frame(600, 500, 60, seed=3)
+    cv2.circle(frame, (250, 300), 70, benchmark.DROPLET, -1)
+    cv2.circle(frame, (250, 300), 30, benchmark.BACKGROUND, -1)
+    cv2.circle(frame, (250, 300), 10, benchmark.DROPLET, -1)
+    cv2.rectangle(frame, (20, 60), (180, 90), benchmark.DROPLET, -1)
+    return frame
+
+
+def assert_same_contours(tiled, whole):
+    contours, areas, centroids, _ = tiled
+    expected_contours, expected_areas, expected_centroids, _ = whole
+    assert len(contours) == len(expected_contours)
+    for contour, expected in zip(contours, expected_contours):
+        np.testing.assert_array_equal(contour, expected)
+    assert areas == expected_areas
+    assert [tuple(c) for c in centroids] == [tuple(c) for c in expected_centroids]
+
+
+@pytest.mark.parametrize('tile_size, overlap, workers', [(128, 32, 1), (100, 16, 2), (64, 8, 1), (1024, 256, 1)])
+@pytest.mark.parametrize('droplet_hierarchy_check', [False, True])
+def test_contour_finder_tiled_matches_whole_image(tile_size, overlap, workers, droplet_hierarchy_check):
+    frame = mosaic()
+    whole = morphocontour.contour_finder(frame, crop_x_lim=None, crop_y_lim=None, droplet_hierarchy_check=droplet_hierarchy_check)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        tiled = morphocontour.contour_finder_tiled(frame, tile_size=tile_size, overlap=overlap, workers=workers, max_window=600, crop_x_lim=None, crop_y_lim=None, droplet_hierarchy_check=droplet_hierarchy_check)
+    assert_same_contours(tiled, whole)
+
+
+def test_contour_finder_tiled_gradient_check_and_crop():
+    frame = mosaic()
+    whole = morphocontour.contour_finder(frame, crop_x_lim=(50, 550), crop_y_lim=(20, 480), gradient_check=True)
+    tiled = morphocontour.contour_finder_tiled(frame, tile_size=96, overlap=24, max_window=500, crop_x_lim=(50, 550), crop_y_lim=(20, 480), gradient_check=True)
+    assert_same_contours(tiled, whole)
+
+
+def test_droplet_boundary_tiled_matches_whole_image():
+    frame, _ = benchmark.make_jet_frame(12, seed=2)
+    ellipses, n = morphocontour.droplet_boundary(frame)
+    tiled_ellipses, tiled_n = morphocontour.droplet_boundary_tiled(frame, tile_size=256, overlap=32, max_window=1100)
+    assert tiled_n == n
+    np.testing.assert_allclose(np.array([(*c, *a, t) for c, a, t in tiled_ellipses]).reshape(-1, 5),
+                               np.array([(*c, *a, t) for c, a, t in ellipses]).reshape(-1, 5))
+
+
+# Contours that do not fit in max_window are left out, with a warning; the others are unchanged
+def test_contours_larger_than_max_window_warn():
+    frame = mosaic()
+    with pytest.warns(RuntimeWarning, match='max_window=96'):
+        contours, areas, _, _ = morphocontour.contour_finder_tiled(frame, tile_size=64, overlap=8, max_window=96, crop_x_lim=None, crop_y_lim=None)
+    whole, whole_areas, _, _ = morphocontour.contour_finder(frame, crop_x_lim=None, crop_y_lim=None)
+    found = {(tuple(c[0, 0]), len(c)) for c in contours}
+    kept = [(tuple(c[0, 0]), len(c)) in found for c in whole]
+    assert areas == [area for area, k in zip(whole_areas, kept) if k]
+    left_out = [cv2.boundingRect(c) for c, k in zip(whole, kept) if not k]
+    assert (19, 59, 163, 33) in left_out
+    assert all(max(w, h) > 8 for _, _, w, h in left_out)
@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+import pytest
+
+import benchmark
+import morphocontour
+
+PARAMETERS = dict(crop_x_lim=None, crop_y_lim=None)
+
+
+# Static droplets with spots, droplets moving in different directions, a pair that merges and a
+# droplet that stops moving after the fourth frame
+def moving_frames(n_frames=8, height=300, width=400, seed=0):
+    rng = np.random.default_rng(seed)
+    static = [((int(rng.uniform(40, width - 40)), int(rng.uniform(60, height - 40))), int(rng.uniform(5, 14))) for _ in range(12)]
+    moving = [((int(rng.uniform(60, width - 60)), int(rng.uniform(80, height - 60))), int(rng.uniform(6, 14)),
+               (int(rng.integers(-4, 5)), int(rng.integers(-4, 5)))) for _ in range(4)]
+    frames = []
+    for t in range(n_frames):
+        frame = np.full((height, width), benchmark.BACKGROUND, np.uint8)
+        for center, radius in static:
+            cv2.circle(frame, center, radius, benchmark.DROPLET, -1)
+            cv2.circle(frame, center, max(2, radius // 4), benchmark.SPOT, -1)
+        for (x, y), radius, (vx, vy) in moving:
+            cv2.circle(frame, (x + vx * t, y + vy * t), radius, benchmark.DROPLET, -1)
+        cv2.circle(frame, (200 - 2 * t, 40), 8, benchmark.DROPLET, -1)
+        cv2.circle(frame, (170 + 2 * t, 40), 8, benchmark.DROPLET, -1)
+        stop = min(t, 4)
+        cv2.circle(frame, (300 + 3 * stop, 250), 10, benchmark.DROPLET, -1)
+        frames.append(frame)
+    return frames
+
+
+def spy_splices(tracker):
+    spliced = []
+    splice = tracker._spliced_contours
+    tracker._spliced_contours = lambda binary, changed: spliced.append(splice(binary, changed)) or spliced[-1]
+    return spliced
+
+
+@pytest.mark.parametrize('droplet_hierarchy_check', [False, True])
+def test_tracker_droplets_match_contour_finder(droplet_hierarchy_check):
+    tracker = morphocontour.DropletTracker(droplet_hierarchy_check=droplet_hierarchy_check, **PARAMETERS)
+    spliced = spy_splices(tracker)
+    for frame in moving_frames():
+        droplets = tracker.update(frame)
+        expected, _ = morphocontour.contour_finder(frame, droplet_hierarchy_check=droplet_hierarchy_check, return_table=True, **PARAMETERS)
+        np.testing.assert_array_equal(droplets.table.points, expected.points)
+        np.testing.assert_array_equal(droplets.table.offsets, expected.offsets)
+    assert any(contours is not None for contours in spliced)
+
+
+# Random binary images edited in small spots: the spliced contours, keys and hierarchy are the ones
+# of the whole frame
+@pytest.mark.parametrize('seed', range(3))
+def test_spliced_contours_match_whole_frame(seed):
+    rng = np.random.default_rng(seed)
+    height, width = 120, 140
+    n_spliced = 0
+    for _ in range(10):
+        image = (rng.random((height, width)) < rng.uniform(0.3, 0.7)).astype(np.uint8) * 255
+        image = cv2.medianBlur(cv2.medianBlur(image, 5), 5)
+        tracker = morphocontour.DropletTracker(clipLimit=None, full_fraction=0.9, **PARAMETERS)
+        spliced = spy_splices(tracker)
+        for k in range(6):
+            for _ in range(int(rng.integers(1, 4))) if k else ():
+                x, y, radius = int(rng.integers(0, width)), int(rng.integers(0, height)), int(rng.integers(1, 6))
+                cv2.circle(image, (x, y), radius, int(rng.choice([0, 255])), -1)
+            tracker.update(image.copy())
+            table, _, _, _, hierarchy = morphocontour.DropletTracker._frame_contours(tracker._binary)
+            keys = morphocontour.DropletTracker._contour_keys(tracker._binary, hierarchy)
+            contours = tracker._contours
+            np.testing.assert_array_equal(contours[0].points, table.points)
+            np.testing.assert_array_equal(contours[0].offsets, table.offsets)
+            np.testing.assert_array_equal(contours[4], hierarchy)
+            if contours[1] is not None:
+                for found, expected in zip(contours[1:4], keys):
+                    np.testing.assert_array_equal(found, expected)
+        n_spliced += sum(contours is not None for contours in spliced)
+    assert n_spliced > 0
+
+
+def test_unchanged_droplets_keep_their_velocity():
+    tracker = morphocontour.DropletTracker(**PARAMETERS)
+    results = [tracker.update(frame) for frame in moving_frames()]
+    # The droplet at row 250 stops in the fifth frame and is unchanged after it
+    rows = [int(np.flatnonzero(np.abs(droplets.table.centroid[:, 1] - 250) < 1)[0]) for droplets in results]
+    ids = [droplets.ids[row] for droplets, row in zip(results, rows)]
+    assert len(set(ids)) == 1
+    velocity = [droplets.velocity[row] for droplets, row in zip(results, rows)]
+    np.testing.assert_allclose(velocity[4], (3, 0), atol=0.5)
+    for v in velocity[5:]:
+        np.testing.assert_array_equal(v, velocity[4])
@@ -0,0 +1,111 @@
+import cv2
+import numpy as np
+import pytest
+
+import benchmark
+import morphocontour
+
+
+# Row scan of the original droplet_volume_estimation, on the binarized and transposed crop
+def reference_volumes(binary, pixel2um=70.0/160.0):
+    total_volume, x_diameters, y_diameters, y_white = [0.0], [0.0], [], []
+    for y in reversed(range(binary.shape[0])):
+        change_indices = np.where(np.abs(np.diff(binary[y, :].astype(int))) > 0)[0]
+        if len(change_indices) >= 2:
+            diameter = (change_indices[-1] - change_indices[0])*pixel2um
+            total_volume[-1] += np.pi * (diameter / 2.0) ** 2 * pixel2um
+            x_diameters[-1] = max(x_diameters[-1], diameter)
+        else:
+            total_volume.append(0.0)
+            x_diameters.append(0.0)
+            y_white.append(y)
+    for i in range(len(y_white) - 1):
+        if abs(y_white[i + 1] - y_white[i]) > 1:
+            y_diameters.append((y_white[i + 1] - y_white[i])*pixel2um)
+    total_volume = [v for v in total_volume if v != 0]
+    return total_volume, len(total_volume), [d for d in x_diameters if d != 0], [d for d in y_diameters if d != 0]
+
+
+def jet_frame(edge=None):
+    frame, _ = benchmark.make_jet_frame(6, seed=1)
+    # A jet reaching across the first (251) or last (999) column of the crop
+    if edge == 'first':
+        cv2.rectangle(frame, (240, 760), (262, 790), benchmark.DROPLET, -1)
+    elif edge == 'last':
+        cv2.rectangle(frame, (990, 760), (1010, 790), benchmark.DROPLET, -1)
+    return frame
+
+
+def binarized(frame):
+    return morphocontour.process_image(cv2.transpose(frame[550:1000, 251:1000]), 50)
+
+
+@pytest.mark.parametrize("edge", [None, 'first', 'last'])
+def test_volumes_match_original_row_scan(edge):
+    frame = jet_frame(edge)
+    expected = reference_volumes(binarized(frame))
+    result = morphocontour.droplet_volume_estimation(frame)
+    assert result[1] == expected[1]
+    np.testing.assert_allclose(result[0], expected[0])
+    np.testing.assert_allclose(result[2], expected[2])
+    np.testing.assert_allclose(result[3], expected[3])
+
+
+@pytest.mark.parametrize("edge", ['first', 'last'])
+def test_jet_touching_the_crop_edge_gives_aligned_columns(edge, tmp_path):
+    frame = jet_frame(edge)
+    legacy = morphocontour.droplet_volume_estimation(frame)
+    volumes, n, x_diameters, y_diameters = morphocontour.droplet_volume_estimation(frame, aligned=True)
+    assert len(legacy[3]) == n - 1
+    assert len(volumes) == len(x_diameters) == len(y_diameters) == n
+    assert volumes == legacy[0] and x_diameters == legacy[2]
+    # The droplet at the edge has no y diameter, the others keep theirs in order
+    y_diameters = np.array(y_diameters)
+    missing = np.flatnonzero(np.isnan(y_diameters))
+    assert list(missing) == ([n - 1] if edge == 'first' else [0])
+    np.testing.assert_allclose(y_diameters[~np.isnan(y_diameters)], legacy[3])
+
+    with pytest.raises(ValueError, match="aligned=True"):
+        morphocontour.droplet_columns(volumes=legacy)
+    with morphocontour.ResultWriter(str(tmp_path / "volumes")) as writer:
+        writer.append(0, **morphocontour.droplet_columns(volumes=(volumes, n, x_diameters, list(y_diameters))))
+    results = morphocontour.ResultReader(str(tmp_path / "volumes"))
+    assert len(results) == n
+    np.testing.assert_array_equal(np.isnan(results['y_diameter']), np.isnan(y_diameters))
+
+
+def test_batch_aligned_matches_single_frames():
+    frames = np.stack([jet_frame(edge) for edge in (None, 'first', 'last')])
+    batch = morphocontour.droplet_volume_estimation_batch(frames, aligned=True)
+    for frame, result in zip(frames, batch):
+        single = morphocontour.droplet_volume_estimation(frame, aligned=True)
+        assert result[:3] == single[:3]
+        np.testing.assert_array_equal(result[3], single[3])
+
+
+# A frame function whose columns have different lengths
+def uneven_columns(frame):
+    return dict(volume=np.zeros(2), x_diameter=np.zeros(3))
+
+
+def test_sharded_volume_job_with_edge_jets(tmp_path):
+    paths = []
+    for i, edge in enumerate([None, 'first', 'last', None]):
+        paths.append(str(tmp_path / f"frame{i}.png"))
+        cv2.imwrite(paths[-1], jet_frame(edge))
+    paths.append(str(tmp_path / "missing.png"))
+    job = morphocontour.ShardedJob.create(str(tmp_path / "job"), paths, shard_size=2, function="droplet_volume_estimation")
+    job.run(workers=1)
+    status = job.status()
+    assert [frame_id for frame_id, _ in status["failed"]] == [4]
+    results = job.merge(str(tmp_path / "results"))
+    expected = [morphocontour.droplet_volume_estimation(path, aligned=True) for path in paths[:4]]
+    assert len(results) == status["rows"] == sum(n for _, n, _, _ in expected)
+    np.testing.assert_array_equal(results["frame_id"], np.repeat(np.arange(4), [n for _, n, _, _ in expected]))
+    np.testing.assert_array_equal(results["y_diameter"], np.concatenate([y for _, _, _, y in expected]))
+
+    # Columns the writer rejects are failed frames too, and the other shards still run
+    job = morphocontour.ShardedJob.create(str(tmp_path / "uneven"), paths[:3], shard_size=2, function=uneven_columns)
+    job.run(workers=1)
+    assert [frame_id for frame_id, _ in job.status()["failed"]] == [0, 1, 2]
+    assert job.status()["completed"] == 2